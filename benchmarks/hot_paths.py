@@ -0,0 +1,330 @@
+"""
+Times and memory-profiles the hot paths of `bundler` on synthetic datasets, without a browser.
+
+Covers loading a table (`Dataset.load`, `get_color_mapping`, `read_file` with image encoding), label filtering
+(`Dataset.filter`, and `label_filter`, a pandas scan, as its baseline), the callbacks of a session driven against a
+Bokeh `Document` (selection, label filter, pagination, level of detail) and the payload building of
+`LabelStudioClient.create_tab`. Every case is timed (best of `--repeat` runs) then run once more under `tracemalloc`
+for its peak allocation.
+
+Results are keyed by case, number of rows and color type, so that two runs can be compared:
+
+Usage:
+    python benchmarks/hot_paths.py --sizes 10000 100000 1000000 --output baseline.json
+    python benchmarks/hot_paths.py --sizes 10000 100000 1000000 --compare baseline.json
+    python benchmarks/hot_paths.py --sizes 10000000 --cases load filter --json
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import bokeh
+import numpy as np
+import pandas as pd
+import requests
+from bokeh.document import Document
+from bokeh.events import RangesUpdate, SelectionGeometry
+from bokeh.models import Plot, TableColumn
+
+from bundler.utils.dataset import Dataset
+from bundler.utils.ls_client import LabelStudioClient
+from bundler.utils.session import Session
+from bundler.utils.tables import write_table
+from bundler.utils.utils import encode_image, get_color_mapping, read_file
+from synthetic import COLORS, make_image_table, make_table
+from thumbnails import make_images
+
+CASES = ("load", "filter", "callbacks", "create_tab", "images")
+
+# number of points past which sessions render a density image, as with the default of the CLI
+LOD_THRESHOLD = 1_000_000
+
+
+def parse_args():
+    """"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Numbers of rows of the synthetic datasets, up to 10M")
+    parser.add_argument("--colors", type=str, nargs="+", choices=COLORS, default=list(COLORS))
+    parser.add_argument("--cases", type=str, nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every case, the best is kept")
+    parser.add_argument("--format", type=str, default="parquet", help="Extension of the table read by the load case")
+    parser.add_argument("--images", type=int, default=20, help="Number of image files of the images case")
+    parser.add_argument("--image-rows", type=int, default=200, help="Number of rows of the table of the images case")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to a JSON file")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    parser.add_argument("--compare", type=str, default=None, help="Compare the results with a previous JSON output")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Slowdown ratio past which a case counts as a regression in the comparison")
+    parser.add_argument("--min-seconds", type=float, default=0.005,
+                        help="Cases faster than this in both runs are too noisy to count as regressions")
+    return parser.parse_args()
+
+
+def measure(fn: Callable[[Any], Any], setup: Callable[[], Any] = lambda: None, repeat: int = 3) -> Dict[str, float]:
+    """
+    Times `fn(setup())` and measures its peak memory allocation.
+
+    Args:
+        fn (Callable[[Any], Any]): The measured function, called with the output of `setup`.
+        setup (Callable[[], Any]): Prepares the input of a run, it is neither timed nor profiled.
+        repeat (int): Number of timed runs, the fastest is kept.
+
+    Returns:
+        Dict[str, float]: The best time in seconds, and the peak of the memory allocated by a run in MB.
+    """
+    timings = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        fn(state)
+        timings.append(time.perf_counter() - start)
+
+    # tracemalloc slows pure Python code down, so the memory is measured on a separate run
+    state = setup()
+    tracemalloc.start()
+    try:
+        fn(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": peak / 1024 ** 2}
+
+
+def selection(dataset: Dataset, fraction: float = 0.1) -> Dict[str, float]:
+    """A box around the center of the points, holding about `fraction` of them."""
+    x, y = dataset.plot_data["x"], dataset.plot_data["y"]
+    low, high = 50 * (1 - np.sqrt(fraction)), 50 * (1 + np.sqrt(fraction))
+    (x0, x1), (y0, y1) = np.nanpercentile(x, [low, high]), np.nanpercentile(y, [low, high])
+    return {"type": "rect", "x0": float(x0), "x1": float(x1), "y0": float(y0), "y1": float(y1)}
+
+
+def filter_values(dataset: Dataset) -> List:
+    """A label filter keeping about half of the labels."""
+    if dataset.is_label_float:
+        low, high = dataset.label_range
+        return [low + (high - low) / 4, high - (high - low) / 4]
+    return dataset.label_options[::2]
+
+
+def label_filter(df: pd.DataFrame, values: List, is_label_float: bool) -> pd.DataFrame:
+    """The label filter as a scan of the 'color' column, the baseline of the indexes of `Dataset.filter`."""
+    if is_label_float:
+        min_val, max_val = values
+        return df[(df["color"] > min_val) & (df["color"] < max_val)]
+    return df[df["color"].isin(values)]
+
+
+def new_session(dataset: Dataset) -> Session:
+    """Opens a session in a new document, as the server does for every browser tab."""
+    columns = [TableColumn(field=col, title=col) for col in dataset.table_columns]
+    session = Session(dataset, columns, lod_threshold=LOD_THRESHOLD)
+    Document().add_root(session.layout)
+    return session
+
+
+def select(session: Session, geometry: Dict[str, float], indices: List[int]) -> None:
+    """
+    Selects the points within a box, through the same Bokeh machinery as a box selection in the browser: the
+    selection geometry in level of detail mode, otherwise the `indices` of the points, found by the browser.
+    """
+    if session.is_lod:
+        plot = session.layout.select_one({"type": Plot})
+        plot._trigger_event(SelectionGeometry(plot, geometry=geometry, final=True))
+    else:
+        session.source_orig.selected.indices = indices
+
+
+class RecordingAdapter(requests.adapters.BaseAdapter):
+    """Transport answering every Label Studio request locally, recording the size of the request bodies."""
+
+    def __init__(self):
+        super(RecordingAdapter, self).__init__()
+        self.n_requests = 0
+        self.n_bytes = 0
+
+    def send(self, request, **kwargs):
+        self.n_requests += 1
+        self.n_bytes += len(request.body or b"")
+        response = requests.Response()
+        response.status_code = 201
+        response._content = json.dumps({"id": self.n_requests}).encode("utf8")
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def bench_load(df: pd.DataFrame, directory: pathlib.Path, fmt: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    path = directory / f"table.{fmt}"
+    write_table(df, str(path))
+    return {
+        "load.dataset": measure(lambda _: Dataset.load(str(path)), repeat=repeat),
+        "load.get_color_mapping": measure(get_color_mapping, lambda: df.copy(), repeat=repeat),
+    }
+
+
+def bench_filter(df: pd.DataFrame, dataset: Dataset, repeat: int) -> Dict[str, Dict[str, float]]:
+    values = filter_values(dataset)
+    _, processed = get_color_mapping(df.copy())
+    indices = np.sort(np.random.default_rng(0).choice(len(dataset), size=len(dataset) // 10, replace=False))
+    return {
+        "filter.label_filter": measure(
+            lambda _: label_filter(processed, values, dataset.is_label_float), repeat=repeat
+        ),
+        "filter.dataset_all": measure(lambda _: dataset.filter(None, values), repeat=repeat),
+        "filter.dataset_selection": measure(lambda _: dataset.filter(indices, values), repeat=repeat),
+    }
+
+
+def bench_callbacks(dataset: Dataset, repeat: int) -> Dict[str, Dict[str, float]]:
+    geometry = selection(dataset)
+    x, y = dataset.plot_data["x"], dataset.plot_data["y"]
+    indices = np.flatnonzero(
+        (x >= geometry["x0"]) & (x <= geometry["x1"]) & (y >= geometry["y0"]) & (y <= geometry["y1"])
+    ).tolist()
+    values = filter_values(dataset)
+
+    def selected() -> Session:
+        session = new_session(dataset)
+        select(session, geometry, indices)
+        return session
+
+    def pan(session: Session) -> None:
+        x0, x1 = session.dataset.plot_data["x"].min(), session.dataset.plot_data["x"].max()
+        plot = session.layout.select_one({"type": Plot})
+        plot._trigger_event(RangesUpdate(plot, x0=float(x0), x1=float((x0 + x1) / 2), y0=-30.0, y1=30.0))
+
+    results = {
+        "callbacks.new_session": measure(lambda _: new_session(dataset), repeat=repeat),
+        "callbacks.select": measure(lambda session: select(session, geometry, indices), lambda: new_session(dataset),
+                                    repeat=repeat),
+        "callbacks.label_filter": measure(
+            lambda session: setattr(session.label_filter_widget, "value", values), selected, repeat=repeat
+        ),
+        "callbacks.next_page": measure(lambda session: session.next_page(), selected, repeat=repeat),
+    }
+    if len(dataset) > LOD_THRESHOLD:
+        results["callbacks.lod_pan"] = measure(pan, lambda: new_session(dataset), repeat=repeat)
+    return results
+
+
+def bench_create_tab(dataset: Dataset, repeat: int) -> Dict[str, Dict[str, float]]:
+    # a lasso selection: a contiguous block of rows along with scattered rows
+    rng = np.random.default_rng(0)
+    block = np.arange(len(dataset) // 4, len(dataset) // 4 + len(dataset) // 20)
+    indices = np.union1d(block, rng.choice(len(dataset), size=len(dataset) // 20, replace=False))
+    adapter = RecordingAdapter()
+    session = requests.Session()
+    session.mount("http://", adapter)
+    client = LabelStudioClient(url="http://localhost:8080", token="benchmark", session=session)
+
+    results = {
+        "create_tab.tasks": measure(lambda _: dataset.tasks(indices), repeat=repeat),
+        "create_tab.upload": measure(lambda tasks: client.create_tab(tasks, "benchmark"),
+                                     lambda: dataset.tasks(indices), repeat=repeat),
+    }
+    n_runs = repeat + 1
+    results["create_tab.upload"].update({
+        "views": adapter.n_requests / n_runs,
+        "payload_bytes": adapter.n_bytes / n_runs,
+    })
+    return results
+
+
+def bench_images(directory: pathlib.Path, n_images: int, n_rows: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    paths = make_images(directory, n_images, 1600, 1200)
+    table = directory / "images.csv"
+    make_image_table(paths, n_rows).to_csv(table, index=False)
+    results = {
+        "images.encode_image": measure(lambda _: [encode_image(p) for p in paths], repeat=repeat),
+        "images.read_file": measure(lambda _: read_file(str(table)), repeat=repeat),
+    }
+    results["images.encode_image"]["images"] = len(paths)
+    results["images.read_file"]["rows"] = n_rows
+    return results
+
+
+def run(args) -> List[Dict[str, Any]]:
+    records = []
+
+    def add(results: Dict[str, Dict[str, float]], rows: Optional[int], color: Optional[str]):
+        for case, result in results.items():
+            records.append({"case": case, "rows": rows, "color": color, **result})
+            print(f"{case:<28}{rows or '':>10} {color or '':<10}{result['seconds'] * 1000:>12.1f} ms"
+                  f"{result['peak_mb']:>10.1f} MB", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = pathlib.Path(tmp_dir)
+        for n in args.sizes:
+            for color in args.colors:
+                df = make_table(n, color=color)
+                mapper, processed = get_color_mapping(df.copy())
+                dataset = Dataset(processed, mapper)
+                if "load" in args.cases:
+                    add(bench_load(df, directory, args.format, args.repeat), n, color)
+                if "filter" in args.cases:
+                    add(bench_filter(df, dataset, args.repeat), n, color)
+                if "callbacks" in args.cases:
+                    add(bench_callbacks(dataset, args.repeat), n, color)
+                if "create_tab" in args.cases and color == args.colors[0]:
+                    # the upload doesn't depend on the labels
+                    add(bench_create_tab(dataset, args.repeat), n, None)
+        if "images" in args.cases:
+            add(bench_images(directory, args.images, args.image_rows, args.repeat), None, None)
+    return records
+
+
+def compare(records: List[Dict[str, Any]], baseline_path: str, tolerance: float, min_seconds: float = 0.0) -> bool:
+    """Prints the time ratio of every case with a previous run, returns whether none regressed past `tolerance`."""
+    with open(baseline_path, "r") as f:
+        baseline = {(r["case"], r["rows"], r["color"]): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"{'case':<28}{'rows':>10} {'color':<10}{'before ms':>12}{'after ms':>12}{'ratio':>8}")
+    for record in records:
+        before = baseline.get((record["case"], record["rows"], record["color"]))
+        if before is None:
+            continue
+        ratio = record["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+        regressed = ratio > tolerance and max(record["seconds"], before["seconds"]) >= min_seconds
+        ok &= not regressed
+        print(f"{record['case']:<28}{record['rows'] or '':>10} {record['color'] or '':<10}"
+              f"{before['seconds'] * 1000:>12.1f}{record['seconds'] * 1000:>12.1f}{ratio:>8.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main(args):
+    records = run(args)
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "bokeh": bokeh.__version__,
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": records,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.json:
+        print(json.dumps(output, indent=2))
+    if args.compare and not compare(records, args.compare, args.tolerance, args.min_seconds):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
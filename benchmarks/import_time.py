@@ -0,0 +1,75 @@
+"""
+Checks that the command line starts fast: importing `bundler.__main__` must stay within a time budget and must not
+import the heavy dependencies, which only the commands using them import.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 100 --json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+MODULE = "bundler.__main__"
+
+# dependencies that only the commands serving a dataset may import
+HEAVY_MODULES = ("bokeh", "pandas", "numpy", "PIL", "requests", "tqdm", "tornado", "pyarrow")
+
+
+def parse_args():
+    """"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=150, help="Maximum import time of the command line")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters, the fastest is kept")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    return parser.parse_args()
+
+
+def import_time_ms(module: str) -> float:
+    """Cumulative import time of `module` in a fresh interpreter, as reported by `python -X importtime`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s*\d+\s*\|\s*(\d+)\s*\|\s*(\S+)$", line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1000
+    raise ValueError(f"No import time reported for {module}.")
+
+
+def imported_heavy_modules(module: str) -> List[str]:
+    """The heavy dependencies imported along with `module`, in a fresh interpreter."""
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def run(budget_ms: float, runs: int) -> Dict:
+    milliseconds = min(import_time_ms(MODULE) for _ in range(runs))
+    heavy = imported_heavy_modules(MODULE)
+    return {
+        "module": MODULE,
+        "import_ms": milliseconds,
+        "budget_ms": budget_ms,
+        "heavy_modules": heavy,
+        "ok": milliseconds <= budget_ms and not heavy,
+    }
+
+
+def main(args):
+    result = run(args.budget_ms, args.runs)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{MODULE}: {result['import_ms']:.1f}ms (budget {args.budget_ms:.0f}ms)")
+        if result["heavy_modules"]:
+            print(f"Imported heavy modules: {', '.join(result['heavy_modules'])}")
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
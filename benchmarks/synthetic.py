@@ -0,0 +1,108 @@
+"""
+Generates synthetic `bundler` tables: clustered 2D coordinates, short texts, Label Studio task ids and a 'color' label.
+
+Usage:
+    python benchmarks/synthetic.py --rows 1000000 --color category --output synthetic.parquet
+    python benchmarks/synthetic.py --rows 100000 --color float --output synthetic.csv
+"""
+import argparse
+import time
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from bundler.utils.tables import write_table
+
+VOCABULARY = np.array([
+    "label", "studio", "bundle", "embedding", "cluster", "review", "sample", "token", "sentence", "model",
+    "batch", "entity", "span", "query", "annotation", "prediction", "project", "task", "layout", "point",
+])
+
+COLORS = ("category", "float")
+
+
+def parse_args():
+    """"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--color", type=str, choices=COLORS, default="category")
+    parser.add_argument("--labels", type=int, default=20, help="Number of distinct categorical labels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, required=True,
+                        help="Output table, its format is inferred from the extension")
+    return parser.parse_args()
+
+
+def make_texts(n: int, rng: np.random.Generator, n_words: int = 8) -> List[str]:
+    """Random sentences of `n_words` words, suffixed with their row number so that they are all distinct."""
+    words = VOCABULARY[rng.integers(0, len(VOCABULARY), size=(n, n_words))]
+    sentences = words[:, 0].astype(object)
+    for i in range(1, n_words):
+        sentences = sentences + " " + words[:, i]
+    return [f"{s} {i}" for i, s in enumerate(sentences)]
+
+
+def make_table(n: int, color: str = "category", n_labels: int = 20, n_projects: int = 3, seed: int = 0,
+               missing: float = 0.01) -> pd.DataFrame:
+    """
+    Generates a table laid out like the output of `scripts/embed.py`.
+
+    Points are drawn around one center per label, so that selections and label filters select comparable
+    numbers of rows whatever the size of the table.
+
+    Args:
+        n (int): Number of rows.
+        color (str): Either "category" for string labels or "float" for a continuous score.
+        n_labels (int): Number of distinct categorical labels, and of point clusters.
+        n_projects (int): Number of Label Studio projects the tasks are spread over.
+        seed (int): Seed of the generator.
+        missing (float): Fraction of rows without a label.
+
+    Returns:
+        pd.DataFrame: The 'x', 'y', 'text', 'color', 'id' and 'project' columns.
+    """
+    if color not in COLORS:
+        raise ValueError(f"Unsupported color '{color}', expected one of {COLORS}.")
+    rng = np.random.default_rng(seed)
+    clusters = rng.integers(0, n_labels, size=n)
+    centers = rng.uniform(-20, 20, size=(n_labels, 2))
+    xy = centers[clusters] + rng.normal(0, 1.5, size=(n, 2))
+
+    if color == "category":
+        labels = pd.Categorical.from_codes(clusters, categories=[f"label-{i}" for i in range(n_labels)])
+        values = pd.Series(labels).astype(object)
+    else:
+        values = pd.Series(clusters / max(n_labels - 1, 1) + rng.normal(0, 0.05, size=n))
+    values[rng.random(n) < missing] = np.nan
+
+    return pd.DataFrame({
+        "x": xy[:, 0],
+        "y": xy[:, 1],
+        "text": make_texts(n, rng),
+        "color": values,
+        "id": np.arange(1, n + 1),
+        "project": rng.integers(1, n_projects + 1, size=n),
+    })
+
+
+def make_image_table(paths: Sequence[str], n: int, n_labels: int = 20, seed: int = 0) -> pd.DataFrame:
+    """Generates an image table of `n` rows cycling over the image files `paths`."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "x": rng.normal(size=n),
+        "y": rng.normal(size=n),
+        "path": [paths[i % len(paths)] for i in range(n)],
+        "color": [f"label-{c}" for c in rng.integers(0, n_labels, size=n)],
+    })
+
+
+def main(args):
+    start = time.perf_counter()
+    df = make_table(args.rows, color=args.color, n_labels=args.labels, seed=args.seed)
+    write_table(df, args.output)
+    print(f"Wrote {len(df)} rows to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(parse_args())
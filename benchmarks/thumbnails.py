@@ -0,0 +1,96 @@
+"""
+Compares the size and encoding time of thumbnails produced by `make_thumbnail` under several settings.
+
+Usage:
+    python benchmarks/thumbnails.py --count 50 --width 4000 --height 3000
+    python benchmarks/thumbnails.py --images-dir <DIR_WITH_JPEGS> --json
+"""
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from bundler.utils.utils import ThumbnailSpec, make_thumbnail
+
+CASES = {
+    # encoding used before thumbnails were resized: full resolution at quality 10
+    "full-jpeg-q10": ThumbnailSpec(size=None, format="JPEG", quality=10),
+    "200px-jpeg-q10": ThumbnailSpec(size=200, format="JPEG", quality=10),
+    "200px-jpeg-q50": ThumbnailSpec(size=200, format="JPEG", quality=50),
+    "200px-webp-q50": ThumbnailSpec(size=200, format="WEBP", quality=50),
+    "100px-webp-q50": ThumbnailSpec(size=100, format="WEBP", quality=50),
+}
+
+
+def parse_args():
+    """"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images-dir", type=str, default=None, help="Benchmark real images instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=20, help="Number of synthetic images")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    return parser.parse_args()
+
+
+def make_images(directory: pathlib.Path, count: int, width: int, height: int) -> List[str]:
+    """Writes photo-like JPEG files: smooth gradients with some noise so they don't compress to nothing."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    paths = []
+    for i in range(count):
+        phase = rng.uniform(0, 2 * np.pi, 3)
+        channels = [
+            127 + 100 * np.sin(xx / rng.uniform(50, 400) + yy / rng.uniform(50, 400) + phase[c]) for c in range(3)
+        ]
+        pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+        path = directory / f"image-{i}.jpg"
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def run(paths: List[str]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, spec in CASES.items():
+        sizes = []
+        start = time.perf_counter()
+        for path in paths:
+            sizes.append(len(make_thumbnail(path, spec=spec)))
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "bytes_per_thumbnail": float(np.mean(sizes)),
+            "ms_per_thumbnail": 1000 * elapsed / len(paths),
+        }
+    return results
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.images_dir:
+            paths = sorted(str(p) for p in pathlib.Path(args.images_dir).iterdir() if p.is_file())
+        else:
+            paths = make_images(pathlib.Path(tmp_dir), args.count, args.width, args.height)
+        results = run(paths)
+
+    if args.json:
+        print(json.dumps({"images": len(paths), "results": results}, indent=2))
+        return
+
+    baseline = results["full-jpeg-q10"]
+    print(f"{'case':<16}{'bytes/thumb':>14}{'ms/thumb':>12}{'size ratio':>12}{'speedup':>10}")
+    for name, res in results.items():
+        print(
+            f"{name:<16}{res['bytes_per_thumbnail']:>14.0f}{res['ms_per_thumbnail']:>12.1f}"
+            f"{res['bytes_per_thumbnail'] / baseline['bytes_per_thumbnail']:>12.3f}"
+            f"{baseline['ms_per_thumbnail'] / res['ms_per_thumbnail']:>10.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(parse_args())
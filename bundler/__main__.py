@@ -1,12 +1,17 @@
+import hashlib
+import json
 import pathlib
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
 
 import typer
-from bokeh.server.server import Server
-from bokeh.util.browser import view
-from tornado.ioloop import IOLoop
 
-from bundler.image import bulk_images
-from bundler.text import bulk_text
+# only the modules needed to declare the commands are imported here, every command imports what it uses so that
+# e.g. `bundler version` doesn't import Bokeh nor pandas
+from bundler.utils.cache import DEFAULT_CACHE_DIR
+from bundler.utils.options import BundleKind, ThumbnailFormat, ThumbnailMode
+
+if TYPE_CHECKING:
+    from bundler.utils.dataset import Dataset
 
 app = typer.Typer(
     name="bundler",
@@ -15,30 +20,190 @@ app = typer.Typer(
     no_args_is_help=True,
 )
 
+TABLE_HELP = "Path to a .csv, .parquet, .feather/.arrow or .jsonl file"
+SOURCE_HELP = f"{TABLE_HELP}, or to a bundle written by `bundler prepare`"
+COLUMNS_HELP = "Column to display in the table, can be repeated. Only these columns are loaded. Defaults to all"
+VECTORS_HELP = "Embeddings of the rows (.npy), enables expanding selections with their nearest neighbors"
+LOD_HELP = "Number of points past which the scatter plot is drawn as a density image until zoomed in, 0 to disable"
+PORT_HELP = "Port the server listens on"
+ADDRESS_HELP = "Address the server listens on, e.g. 0.0.0.0 to accept remote connections. Defaults to all addresses"
+NUM_PROCS_HELP = "Number of server processes, they share a single memory-mapped copy of the dataset"
+ORIGIN_HELP = "Host (with an optional port) browsers may connect from besides localhost, can be repeated"
+SHARED_DIR_HELP = "Directory of the memory-mapped datasets shared by the server processes"
+SLOW_CALLBACK_HELP = "Log the session callbacks slower than this many milliseconds"
+WORKERS_HELP = "Number of processes used to encode the thumbnails"
+CACHE_HELP = "Keep encoded thumbnails in an on-disk cache"
+CACHE_DIR_HELP = "Thumbnail cache directory"
+CACHE_SIZE_HELP = "Maximum size of the thumbnail cache, in MB"
+THUMBNAILS_HELP = "Encode all thumbnails upfront, only the ones shown in the table, or serve them over HTTP"
+THUMBNAIL_SIZE_HELP = "Thumbnail bounding box in pixels, 0 for full size"
+THUMBNAIL_FORMAT_HELP = "Thumbnail encoding format"
+THUMBNAIL_QUALITY_HELP = "Thumbnail encoding quality"
+
+
+def share(dataset: "Dataset", path: pathlib.Path, shared_dir: pathlib.Path, num_procs: int, kind: BundleKind,
+          options: Dict[str, Any]) -> None:
+    """
+    Memory-maps the dataset before the server forks its processes.
+
+    Each version of a source table (its path, size and modification time) loaded with given options has its own
+    directory, so that servers of the same table with other options don't overwrite each other's columns.
+    """
+    if num_procs > 1:
+        stat = path.stat()
+        key = json.dumps([str(path.resolve()), stat.st_size, stat.st_mtime_ns, kind.value, options], sort_keys=True)
+        dataset.share(shared_dir / hashlib.sha1(key.encode("utf8")).hexdigest()[:16])
+
+
+def serve(applications: Dict[str, Any], port: int, address: Optional[str], num_procs: int,
+          allow_websocket_origin: List[str], slow_callback_ms: Optional[int] = None, extra_patterns: Sequence = ()) \
+        -> None:
+    """
+    Starts a Bokeh server, along with its /metrics endpoint, and opens its page in the browser.
+
+    With several processes, the server forks once its sockets are bound; every process then runs its own IOLoop
+    and only the first one opens the browser. Every process keeps its own metrics.
+    """
+    from bokeh.server.server import Server
+    from bokeh.util.browser import view
+    from tornado.ioloop import IOLoop
+    from tornado.process import task_id
+
+    from bundler.utils.handlers import metrics_pattern
+    from bundler.utils.metrics import set_slow_callback_threshold
+
+    set_slow_callback_threshold(slow_callback_ms / 1000 if slow_callback_ms is not None else None)
+    server = Server(
+        applications,
+        io_loop=IOLoop() if num_procs == 1 else None,
+        port=port,
+        address=address,
+        num_procs=num_procs,
+        allow_websocket_origin=[f"localhost:{port}", *allow_websocket_origin] if allow_websocket_origin else None,
+        extra_patterns=[metrics_pattern(), *extra_patterns]
+    )
+    server.start()
+
+    if task_id() in (None, 0):
+        host = address if address not in (None, "", "0.0.0.0", "::") else "localhost"
+        server.io_loop.add_callback(view, f"http://{host}:{port}/")
+    server.io_loop.start()
+
 
 @app.command("version")
 def version():
     print("0.1.0")
 
 
+@app.command("prepare")
+def prepare(
+        path: pathlib.Path = typer.Argument(..., help=TABLE_HELP, exists=True, dir_okay=False),
+        kind: BundleKind = typer.Option(BundleKind.text, help="Whether the bundle is served by `text` or `image`"),
+        output: Optional[pathlib.Path] = typer.Option(None, help="Bundle directory, defaults to PATH.bundle"),
+        columns: List[str] = typer.Option(None, help=COLUMNS_HELP),
+        force: bool = typer.Option(False, help="Rebuild the bundle even if it is up to date"),
+        workers: int = typer.Option(1, min=1, help=WORKERS_HELP),
+        cache: bool = typer.Option(True, help=CACHE_HELP),
+        cache_dir: pathlib.Path = typer.Option(DEFAULT_CACHE_DIR / "thumbnails", help=CACHE_DIR_HELP),
+        cache_size: int = typer.Option(1024, min=1, help=CACHE_SIZE_HELP),
+        thumbnails: ThumbnailMode = typer.Option(ThumbnailMode.eager, help=THUMBNAILS_HELP),
+        thumbnail_size: int = typer.Option(200, min=0, help=THUMBNAIL_SIZE_HELP),
+        thumbnail_format: ThumbnailFormat = typer.Option(ThumbnailFormat.jpeg, help=THUMBNAIL_FORMAT_HELP),
+        thumbnail_quality: int = typer.Option(10, min=1, max=100, help=THUMBNAIL_QUALITY_HELP),
+):
+    """Compile a table into a bundle that `text` and `image` open without preprocessing it"""
+    from bundler.utils import bundle
+    from bundler.utils.cache import ThumbnailCache
+    from bundler.utils.utils import ThumbnailSpec
+
+    thumbnail_cache = ThumbnailCache(cache_dir, max_size=cache_size * 1024 ** 2) \
+        if cache and kind == BundleKind.image else None
+    spec = ThumbnailSpec(size=thumbnail_size or None, format=thumbnail_format.value.upper(), quality=thumbnail_quality)
+    if kind == BundleKind.text:
+        options = bundle.text_options(columns)
+    else:
+        options = bundle.image_options(columns, thumbnails, spec)
+    prepared = bundle.prepare(path, kind, options, directory=output, force=force, workers=workers,
+                              cache=thumbnail_cache, spec=spec)
+    print(prepared.directory)
+
+
 @app.command("text")
-def text(path: pathlib.Path = typer.Argument(..., help="Path to .csv file", exists=True)):
+def text(
+        path: pathlib.Path = typer.Argument(..., help=SOURCE_HELP, exists=True),
+        columns: List[str] = typer.Option(None, help=COLUMNS_HELP),
+        lod_threshold: int = typer.Option(1_000_000, min=0, help=LOD_HELP),
+        vectors: Optional[pathlib.Path] = typer.Option(None, help=VECTORS_HELP, exists=True),
+        port: int = typer.Option(5006, min=0, max=65535, help=PORT_HELP),
+        address: Optional[str] = typer.Option(None, help=ADDRESS_HELP),
+        num_procs: int = typer.Option(1, min=1, help=NUM_PROCS_HELP),
+        allow_websocket_origin: List[str] = typer.Option(None, help=ORIGIN_HELP),
+        shared_dir: pathlib.Path = typer.Option(DEFAULT_CACHE_DIR / "datasets", help=SHARED_DIR_HELP),
+        slow_callback_ms: Optional[int] = typer.Option(None, min=0, help=SLOW_CALLBACK_HELP),
+):
     """Bulk Labelling for Text"""
-    server = Server({"/": bulk_text(path)}, io_loop=IOLoop())
-    server.start()
+    from bundler.text import bulk_text
+    from bundler.utils.bundle import open_dataset, text_options
 
-    server.io_loop.add_callback(view, "http://localhost:5006/")
-    server.io_loop.start()
+    options = text_options(columns)
+    dataset = open_dataset(path, BundleKind.text, options)
+    if vectors is not None:
+        dataset.load_neighbors(vectors)
+    share(dataset, path, shared_dir, num_procs, BundleKind.text, options)
+    serve({"/": bulk_text(dataset, lod_threshold=lod_threshold or None)}, port, address, num_procs,
+          allow_websocket_origin, slow_callback_ms=slow_callback_ms)
 
 
 @app.command("image")
-def text(path: pathlib.Path = typer.Argument(..., help="Path to .csv file", exists=True)):
-    """Bulk Labelling for Text"""
-    server = Server({"/": bulk_images(path)}, io_loop=IOLoop())
-    server.start()
+def image(
+        path: pathlib.Path = typer.Argument(..., help=SOURCE_HELP, exists=True),
+        columns: List[str] = typer.Option(None, help=COLUMNS_HELP),
+        lod_threshold: int = typer.Option(1_000_000, min=0, help=LOD_HELP),
+        vectors: Optional[pathlib.Path] = typer.Option(None, help=VECTORS_HELP, exists=True),
+        port: int = typer.Option(5006, min=0, max=65535, help=PORT_HELP),
+        address: Optional[str] = typer.Option(None, help=ADDRESS_HELP),
+        num_procs: int = typer.Option(1, min=1, help=NUM_PROCS_HELP),
+        allow_websocket_origin: List[str] = typer.Option(None, help=ORIGIN_HELP),
+        shared_dir: pathlib.Path = typer.Option(DEFAULT_CACHE_DIR / "datasets", help=SHARED_DIR_HELP),
+        slow_callback_ms: Optional[int] = typer.Option(None, min=0, help=SLOW_CALLBACK_HELP),
+        workers: int = typer.Option(1, min=1, help=WORKERS_HELP),
+        cache: bool = typer.Option(True, help=CACHE_HELP),
+        cache_dir: pathlib.Path = typer.Option(DEFAULT_CACHE_DIR / "thumbnails", help=CACHE_DIR_HELP),
+        cache_size: int = typer.Option(1024, min=1, help=CACHE_SIZE_HELP),
+        thumbnails: ThumbnailMode = typer.Option(ThumbnailMode.eager, help=THUMBNAILS_HELP),
+        thumbnail_size: int = typer.Option(200, min=0, help=THUMBNAIL_SIZE_HELP),
+        thumbnail_format: ThumbnailFormat = typer.Option(ThumbnailFormat.jpeg, help=THUMBNAIL_FORMAT_HELP),
+        thumbnail_quality: int = typer.Option(10, min=1, max=100, help=THUMBNAIL_QUALITY_HELP),
+):
+    """Bulk Labelling for Images"""
+    from bundler.image import bulk_images
+    from bundler.utils.bundle import image_options, open_dataset
+    from bundler.utils.cache import ThumbnailCache
+    from bundler.utils.handlers import thumbnail_pattern
+    from bundler.utils.utils import ThumbnailSpec
 
-    server.io_loop.add_callback(view, "http://localhost:5006/")
-    server.io_loop.start()
+    thumbnail_cache = ThumbnailCache(cache_dir, max_size=cache_size * 1024 ** 2) if cache else None
+    spec = ThumbnailSpec(
+        size=thumbnail_size or None,
+        format=thumbnail_format.value.upper(),
+        quality=thumbnail_quality
+    )
+
+    # a bundle keeps the thumbnail mode it was prepared with
+    options = image_options(columns, thumbnails, spec)
+    dataset = open_dataset(
+        path, BundleKind.image, options, workers=workers, cache=thumbnail_cache, spec=spec
+    )
+    if vectors is not None:
+        dataset.load_neighbors(vectors)
+    share(dataset, path, shared_dir, num_procs, BundleKind.image, options)
+
+    extra_patterns = []
+    if dataset.mode == ThumbnailMode.http:
+        extra_patterns.append(thumbnail_pattern(dataset.paths, cache=thumbnail_cache, spec=spec))
+
+    serve({"/": bulk_images(dataset, lod_threshold=lod_threshold or None)}, port, address, num_procs,
+          allow_websocket_origin, slow_callback_ms=slow_callback_ms, extra_patterns=extra_patterns)
 
 
 if __name__ == '__main__':
@@ -1,2 +1,18 @@
-from .ls_client import LabelStudioClient
-from .utils import get_color_mapping, get_datatable_columns
+import importlib
+
+# submodules are only imported when one of their names is first accessed (PEP 562), so that importing a light
+# module of the package doesn't import Bokeh, pandas and requests
+_EXPORTS = {
+    "ThumbnailCache": "cache",
+    "LabelStudioClient": "ls_client",
+    "get_color_mapping": "utils",
+    "get_datatable_columns": "utils",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+from typing import Any, Dict, Iterable, Optional, Union
+
+import bokeh.models
+import bokeh.transform
+import numpy as np
+
+from bundler.utils.cache import ThumbnailCache
+from bundler.utils.dataset import Dataset, ImageDataset
+from bundler.utils.filters import LabelIndex
+from bundler.utils.options import BundleKind, ThumbnailMode
+from bundler.utils.store import ColumnStore
+from bundler.utils.utils import DEFAULT_THUMBNAIL, LazyThumbnails, ThumbnailSpec
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+BUNDLE_SUFFIX = ".bundle"
+MANIFEST_FILE = "bundle.json"
+COLUMNS_DIR = "columns"
+LABELS_DIR = "labels"
+CHECKSUM_CHUNK = 1 << 20
+
+
+def file_checksum(path: Union[str, pathlib.Path]) -> str:
+    """BLAKE2b digest of a file, read by chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_bundle_dir(path: Union[str, pathlib.Path]) -> pathlib.Path:
+    """The bundle `bundler prepare` writes next to a table by default, e.g. data.parquet.bundle."""
+    path = pathlib.Path(path)
+    return path.with_name(path.name + BUNDLE_SUFFIX)
+
+
+def is_bundle(path: Union[str, pathlib.Path]) -> bool:
+    return (pathlib.Path(path) / MANIFEST_FILE).is_file()
+
+
+def text_options(columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """The options a text bundle is built with, bundles built with other options are not reused."""
+    return {"columns": list(columns) if columns else None}
+
+
+def image_options(columns: Optional[Iterable[str]] = None, mode: ThumbnailMode = ThumbnailMode.eager,
+                  spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Dict[str, Any]:
+    """The options an image bundle is built with, the thumbnail spec only matters for eagerly encoded thumbnails."""
+    return {
+        "columns": list(columns) if columns else None,
+        "thumbnails": mode.value,
+        "spec": spec._asdict() if mode == ThumbnailMode.eager else None,
+    }
+
+
+def _mapper_to_json(mapper: Optional[bokeh.transform.transform]) -> Optional[Dict[str, Any]]:
+    if mapper is None:
+        return None
+    transform = mapper["transform"]
+    return {
+        "field": mapper["field"],
+        "type": type(transform).__name__,
+        "properties": transform.properties_with_values(include_defaults=False),
+    }
+
+
+def _mapper_from_json(spec: Optional[Dict[str, Any]]) -> Optional[bokeh.transform.transform]:
+    if spec is None:
+        return None
+    transform = getattr(bokeh.models, spec["type"])(**spec["properties"])
+    return bokeh.transform.field(spec["field"], transform)
+
+
+def _json_default(value: Any) -> Any:
+    # numpy scalars, e.g. the bounds of the color mapper of numerical labels
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Bundle(object):
+    """
+    A dataset compiled by `bundler prepare` into a directory that opens without parsing nor preprocessing the table.
+
+    The directory holds the columns of the dataset as a `ColumnStore` (categorical labels as codes and factors,
+    float32 coordinates, eagerly encoded thumbnails), the `LabelIndex` of the label filters and the color mapper,
+    all memory-mapped when opened. Its manifest records the size, modification time and checksum of the source
+    table, so that a bundle whose source changed is rebuilt rather than served.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path]):
+        """
+        Args:
+            directory (Union[str, pathlib.Path]): The bundle directory, see `build`.
+        """
+        self.directory = pathlib.Path(directory)
+        with open(self.directory / MANIFEST_FILE, "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported bundle version in {self.directory}, run `bundler prepare` again.")
+
+    @property
+    def kind(self) -> BundleKind:
+        return BundleKind(self.manifest["kind"])
+
+    @property
+    def source(self) -> pathlib.Path:
+        """The table the bundle was built from."""
+        return pathlib.Path(self.manifest["source"]["path"])
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        return self.manifest["options"]
+
+    def is_stale(self) -> bool:
+        """
+        Whether the source table changed since the bundle was built.
+
+        The size and modification time are checked first, the source is only read to compare its checksum when
+        they differ, so that e.g. a copied table with a new modification time doesn't trigger a rebuild. A bundle
+        whose source is gone is served as is.
+        """
+        if not self.source.is_file():
+            return False
+        recorded = self.manifest["source"]
+        stat = self.source.stat()
+        if stat.st_size == recorded["size"] and stat.st_mtime_ns == recorded["mtime_ns"]:
+            return False
+        return stat.st_size != recorded["size"] or file_checksum(self.source) != recorded["checksum"]
+
+    @classmethod
+    def build(cls, directory: Union[str, pathlib.Path], source: Union[str, pathlib.Path], dataset: Dataset,
+              kind: BundleKind, options: Dict[str, Any]) -> "Bundle":
+        """
+        Writes a dataset to a bundle directory, atomically: the directory only appears once complete.
+
+        Args:
+            directory (Union[str, pathlib.Path]): The destination, replaced if it exists.
+            source (Union[str, pathlib.Path]): The table the dataset was loaded from.
+            dataset (Dataset): The loaded dataset.
+            kind (BundleKind): Whether the dataset is served by `bundler text` or `bundler image`.
+            options (Dict[str, Any]): The options the dataset was loaded with, see `text_options` and
+                `image_options`.
+
+        Returns:
+            Bundle: The written bundle.
+        """
+        directory = pathlib.Path(directory)
+        source = pathlib.Path(source).resolve()
+        tmp = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        stat = source.stat()
+        dataset.store.save(tmp / COLUMNS_DIR)
+        if dataset.label_index is not None:
+            dataset.label_index.save(tmp / LABELS_DIR)
+        manifest = {
+            "version": BUNDLE_VERSION,
+            "kind": kind.value,
+            "source": {
+                "path": str(source),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "checksum": file_checksum(source),
+            },
+            "options": options,
+            "n_rows": len(dataset),
+            "mapper": _mapper_to_json(dataset.mapper),
+        }
+        with open(tmp / MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=2, default=_json_default)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+        logger.info(f"Prepared {len(dataset)} rows from {source} in {directory}")
+        return cls(directory)
+
+    def load(self, thumbnails: Optional[LazyThumbnails] = None) -> Dataset:
+        """
+        Memory-maps the dataset of the bundle.
+
+        Args:
+            thumbnails (Optional[LazyThumbnails]): The thumbnail encoder of image bundles prepared with lazy
+                thumbnails, which are still encoded when displayed.
+
+        Returns:
+            Dataset: A `Dataset` or an `ImageDataset`, depending on the kind of the bundle.
+        """
+        store = ColumnStore.load(self.directory / COLUMNS_DIR)
+        mapper = _mapper_from_json(self.manifest["mapper"])
+        label_index = LabelIndex.load(self.directory / LABELS_DIR) if mapper is not None else None
+        if self.kind == BundleKind.image:
+            mode = ThumbnailMode(self.options["thumbnails"])
+            if mode == ThumbnailMode.lazy and thumbnails is None:
+                raise ValueError(f"{self.directory} encodes its thumbnails lazily, a thumbnail encoder is required.")
+            dataset = ImageDataset(store, mapper, mode=mode, thumbnails=thumbnails, label_index=label_index)
+        else:
+            dataset = Dataset(store, mapper, label_index=label_index)
+        logger.info(f"Opened {len(dataset)} rows from {self.directory}")
+        return dataset
+
+
+def load_source(source: Union[str, pathlib.Path], kind: BundleKind, options: Dict[str, Any], workers: int = 1,
+                cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Dataset:
+    """
+    Loads a dataset from its table, as a bundle built with `options` would hold it.
+
+    Args:
+        source (Union[str, pathlib.Path]): The table.
+        kind (BundleKind): The kind of dataset.
+        options (Dict[str, Any]): See `text_options` and `image_options`.
+        workers (int): Number of processes encoding the thumbnails of image datasets.
+        cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+        spec (ThumbnailSpec): Thumbnail spec, unless the options record the one of eagerly encoded thumbnails.
+
+    Returns:
+        Dataset: The loaded dataset.
+    """
+    if kind == BundleKind.text:
+        return Dataset.load(source, columns=options["columns"])
+    mode = ThumbnailMode(options["thumbnails"])
+    spec = ThumbnailSpec(**options["spec"]) if options["spec"] is not None else spec
+    return ImageDataset.load(source, columns=options["columns"], mode=mode, workers=workers, cache=cache, spec=spec)
+
+
+def prepare(source: Union[str, pathlib.Path], kind: BundleKind, options: Dict[str, Any],
+            directory: Optional[Union[str, pathlib.Path]] = None, force: bool = False, workers: int = 1,
+            cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Bundle:
+    """
+    Builds the bundle of a table, unless an up-to-date bundle built with the same options already exists.
+
+    Args:
+        source (Union[str, pathlib.Path]): The table.
+        kind (BundleKind): The kind of dataset.
+        options (Dict[str, Any]): See `text_options` and `image_options`.
+        directory (Optional[Union[str, pathlib.Path]]): The bundle directory, defaults to `default_bundle_dir`.
+        force (bool): Rebuild the bundle even if it is up to date.
+        workers (int): Number of processes encoding the thumbnails of image datasets.
+        cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+        spec (ThumbnailSpec): Thumbnail spec of image datasets.
+
+    Returns:
+        Bundle: The bundle.
+    """
+    directory = pathlib.Path(directory) if directory is not None else default_bundle_dir(source)
+    if not force and is_bundle(directory):
+        bundle = Bundle(directory)
+        if bundle.kind == kind and bundle.options == options and bundle.source == pathlib.Path(source).resolve() \
+                and not bundle.is_stale():
+            logger.info(f"{directory} is up to date")
+            return bundle
+    dataset = load_source(source, kind, options, workers=workers, cache=cache, spec=spec)
+    return Bundle.build(directory, source, dataset, kind, options)
+
+
+def open_dataset(path: Union[str, pathlib.Path], kind: BundleKind, options: Dict[str, Any], workers: int = 1,
+                 cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Dataset:
+    """
+    Opens the dataset of a table or of a bundle, rebuilding the bundle if its source table changed.
+
+    A bundle directory is opened with the options it was prepared with. A table is opened from its default bundle
+    (see `default_bundle_dir`) when one was prepared with the same options, and loaded from the table otherwise.
+
+    Args:
+        path (Union[str, pathlib.Path]): A table or a bundle directory.
+        kind (BundleKind): The kind of dataset.
+        options (Dict[str, Any]): The options a table is loaded with, see `text_options` and `image_options`.
+        workers (int): Number of processes encoding the thumbnails of image datasets.
+        cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+        spec (ThumbnailSpec): Thumbnail spec, unless the bundle records the one of eagerly encoded thumbnails.
+
+    Returns:
+        Dataset: The opened dataset.
+    """
+    path = pathlib.Path(path)
+    if is_bundle(path):
+        bundle = Bundle(path)
+        if bundle.kind != kind:
+            raise ValueError(f"{path} is a bundle of {bundle.kind.value} data, not of {kind.value} data.")
+    else:
+        bundle = Bundle(default_bundle_dir(path)) if is_bundle(default_bundle_dir(path)) else None
+        if bundle is not None and (bundle.kind != kind or bundle.options != options
+                                   or bundle.source != path.resolve()):
+            logger.info(f"Ignoring {bundle.directory}, prepared from other options")
+            bundle = None
+        if bundle is None:
+            return load_source(path, kind, options, workers=workers, cache=cache, spec=spec)
+
+    if bundle.is_stale():
+        logger.info(f"{bundle.source} changed, rebuilding {bundle.directory}")
+        dataset = load_source(bundle.source, kind, bundle.options, workers=workers, cache=cache, spec=spec)
+        bundle = Bundle.build(bundle.directory, bundle.source, dataset, kind, bundle.options)
+
+    thumbnails = None
+    if kind == BundleKind.image and bundle.options["thumbnails"] == ThumbnailMode.lazy.value:
+        thumbnails = LazyThumbnails(workers=workers, cache=cache, spec=spec)
+    return bundle.load(thumbnails=thumbnails)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")) / "bundler"
+
+# minimum delay between two background prunes of a cache, in seconds
+PRUNE_INTERVAL = 60.0
+
+
+def thumbnail_key(path: str, **params) -> Optional[str]:
+    """
+    Computes the content address of a thumbnail.
+
+    Args:
+        path (str): The file system path of the source image.
+        **params: The encoding parameters the thumbnail depends on.
+
+    Returns:
+        Optional[str]: The hexadecimal key, or None if the source file cannot be stat'ed.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    payload = json.dumps(
+        [os.path.abspath(path), stat.st_mtime_ns, stat.st_size, sorted(params.items())],
+        default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ThumbnailCache(object):
+    """
+    Content-addressed on-disk cache of encoded thumbnails.
+
+    Entries are keyed by the source path, its modification time and size, and the encoding parameters, so an
+    edited image or a change of encoding settings naturally misses the cache. Each entry's modification time is
+    refreshed on read, which lets `prune` evict the least recently used entries once the cache outgrows its limit.
+
+    Only the directory and size limit are pickled, so the cache can be shared with worker processes.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path] = DEFAULT_CACHE_DIR / "thumbnails",
+                 max_size: int = 1024 ** 3):
+        """
+        Args:
+            directory (Union[str, pathlib.Path]): Directory where the thumbnails are stored.
+            max_size (int): Maximum size of the cache in bytes. Defaults to 1GiB.
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._last_prune: Optional[float] = None
+        self._prune_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "max_size": self.max_size}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def key(self, path: str, **params) -> Optional[str]:
+        """Computes the cache key of an image, see `thumbnail_key`."""
+        return thumbnail_key(path, **params)
+
+    def _entry(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached thumbnail for `key`, or None on a miss."""
+        entry = self._entry(key)
+        try:
+            data = entry.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(entry)  # marks the entry as recently used
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Stores a thumbnail. Writes are atomic so concurrent workers never observe partial entries."""
+        entry = self._entry(key)
+        try:
+            entry.parent.mkdir(exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            logger.warning(f"Could not write thumbnail to cache: {e}")
+
+    def prune(self) -> int:
+        """
+        Evicts the least recently used entries until the cache fits within `max_size`.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        entries = []
+        total = 0
+        for entry in self.directory.glob("*/*"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+            total += stat.st_size
+
+        evicted = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} thumbnails from {self.directory}")
+        return evicted
+
+    def prune_later(self, interval: float = PRUNE_INTERVAL) -> bool:
+        """
+        Prunes the cache in a background thread, at most once every `interval` seconds.
+
+        `prune` scans the whole cache directory, this lets a server keep the cache within its limit without
+        making the requests that write to it wait for the scan.
+
+        Args:
+            interval (float): Minimum delay since the previous prune, in seconds.
+
+        Returns:
+            bool: Whether a prune was started.
+        """
+        now = time.monotonic()
+        if self._last_prune is not None and now - self._last_prune < interval:
+            return False
+        if not self._prune_lock.acquire(blocking=False):
+            return False
+        self._last_prune = now
+
+        def run():
+            try:
+                self.prune()
+            except Exception:
+                logger.exception(f"Could not prune {self.directory}")
+            finally:
+                self._prune_lock.release()
+
+        threading.Thread(target=run, name="thumbnail-cache-prune", daemon=True).start()
+        return True
@@ -0,0 +1,273 @@
+import logging
+import pathlib
+from functools import cached_property
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import bokeh.transform
+import numpy as np
+import pandas as pd
+
+from bundler.utils.cache import ThumbnailCache
+from bundler.utils.filters import MISSING_LABEL, LabelIndex
+from bundler.utils.handlers import THUMBNAIL_ROUTE
+from bundler.utils.lod import point_colors
+from bundler.utils.metrics import DATASET_LOAD_SECONDS
+from bundler.utils.neighbors import NeighborIndex
+from bundler.utils.options import ThumbnailMode
+from bundler.utils.store import ColumnStore
+from bundler.utils.tables import app_columns, read_table
+from bundler.utils.utils import DEFAULT_THUMBNAIL, LazyThumbnails, ThumbnailSpec, get_color_bar_kwargs, \
+    get_color_codes, get_color_mapping, get_datatable_columns, read_file
+
+logger = logging.getLogger(__name__)
+
+
+class Dataset(object):
+    """
+    Read-only dataset shared by every session of a server.
+
+    The table is loaded and preprocessed once when the server starts. Sessions only hold row positions (their
+    selection and filters) and ask the dataset for the rows they display, so opening a new tab does not reload
+    nor copy the data. The columns live in a `ColumnStore`, which `share` moves to memory-mapped files so that
+    the worker processes of a server read a single copy of them.
+    """
+
+    def __init__(self, df: Union[pd.DataFrame, ColumnStore], mapper: Optional[bokeh.transform.transform],
+                 label_index: Optional[LabelIndex] = None):
+        """
+        Args:
+            df (Union[pd.DataFrame, ColumnStore]): The data, already processed by `get_color_mapping`. It must not
+                be modified afterwards.
+            mapper (Optional[bokeh.transform.transform]): The color mapper returned by `get_color_mapping`.
+            label_index (Optional[LabelIndex]): The index of the 'color' column, e.g. loaded from a bundle (see
+                `bundler.utils.bundle`). Defaults to None, which builds it.
+        """
+        if isinstance(df, pd.DataFrame):
+            df = ColumnStore.from_frame(df)
+            # the scatter plot draws float32 coordinates, storing them as such spares a copy per process
+            for c in ("x", "y"):
+                df.columns[c] = np.ascontiguousarray(df.column(c), dtype=np.float32)
+        self.store = df
+        self.mapper = mapper
+        self.neighbors: Optional[NeighborIndex] = None
+        color = self.store.series("color") if mapper is not None else None
+        self.is_label_float = str(color.dtype).startswith("float") if mapper is not None else None
+
+        self.label_range: Optional[Tuple[float, float]] = None
+        self.label_options: Optional[List[str]] = None
+        self.label_index: Optional[LabelIndex] = None
+        if mapper is not None:
+            self.label_index = label_index if label_index is not None else LabelIndex(color)
+            if self.is_label_float:
+                self.label_range = self.label_index.value_range
+            else:
+                # MultiChoice works only with Strings
+                self.label_options = list(self.label_index.labels)
+                if self.label_index.n_missing:
+                    self.label_options.append(MISSING_LABEL)
+
+        self.plot_data = self._plot_data()
+
+    def _plot_data(self) -> Dict[str, np.ndarray]:
+        # the scatter plot only needs compact coordinates and color codes, these arrays are shared by all the
+        # sessions and sent to the browser as binary buffers
+        plot_data = {
+            "x": np.ascontiguousarray(self.store.column("x"), dtype=np.float32),
+            "y": np.ascontiguousarray(self.store.column("y"), dtype=np.float32),
+        }
+        if self.mapper is not None:
+            plot_data["color"] = get_color_codes(self.store.series("color"))
+        return plot_data
+
+    @classmethod
+    def load(cls, path: str, columns: Optional[Iterable[str]] = None) -> "Dataset":
+        """
+        Loads a dataset from a table.
+
+        Args:
+            path (str): The path of the table, see `bundler.utils.tables.read_table` for the supported formats.
+            columns (Optional[Iterable[str]]): Columns to display, defaults to None which loads every column.
+
+        Returns:
+            Dataset: The loaded dataset.
+        """
+        with DATASET_LOAD_SECONDS.time(kind="text"):
+            df = read_table(path, columns=app_columns(columns))
+            mapper, df = get_color_mapping(df)
+            dataset = cls(df, mapper)
+        logger.info(f"Loaded {len(df)} rows from {path}")
+        return dataset
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def share(self, directory: Union[str, pathlib.Path]) -> None:
+        """
+        Moves the columns to memory-mapped files, to be called before the server forks its worker processes.
+
+        Forked processes only share the memory that none of them writes to. Python objects such as the strings of
+        a DataFrame are written to by reference counting as soon as they are read, so every worker would end up
+        with its own copy of the table; memory-mapped columns are shared through the page cache instead.
+
+        Args:
+            directory (Union[str, pathlib.Path]): Directory of the columns, replaced if it exists.
+        """
+        if self.store.directory is not None:
+            # already memory-mapped, e.g. from a bundle
+            return
+        self.store.save(directory)
+        self.store = ColumnStore.load(directory)
+        self.plot_data = self._plot_data()
+        logger.info(f"Shared {len(self)} rows through {directory}")
+
+    def load_neighbors(self, path: str) -> None:
+        """
+        Indexes the embeddings of the rows, to expand selections with their nearest neighbors.
+
+        Args:
+            path (str): A .npy file holding one embedding per row, in the order of the table.
+        """
+        neighbors = NeighborIndex.load(path)
+        if len(neighbors) != len(self):
+            raise ValueError(f"{path} holds {len(neighbors)} vectors but the dataset has {len(self)} rows.")
+        self.neighbors = neighbors
+        logger.info(f"Indexed {len(neighbors)} vectors from {path}")
+
+    @cached_property
+    def point_colors(self) -> np.ndarray:
+        """RGB color of every point, used to render density images (see `bundler.utils.lod`)."""
+        return point_colors(self.plot_data.get("color", np.empty(len(self))), self.mapper)
+
+    def color_mapper(self) -> Optional[bokeh.transform.transform]:
+        """Returns a copy of the color mapper for a new document, Bokeh models can't be shared across documents."""
+        if self.mapper is None:
+            return None
+        transform = self.mapper["transform"]
+        return {**self.mapper, "transform": type(transform)(**transform.properties_with_values(include_defaults=False))}
+
+    def color_bar_kwargs(self) -> Dict[str, Any]:
+        """Arguments of the `ColorBar` of a new document, see `get_color_bar_kwargs`."""
+        return get_color_bar_kwargs(self.store.series("color")) if self.mapper is not None else {}
+
+    @property
+    def table_columns(self) -> List[str]:
+        """Names of the columns displayed in the data table."""
+        return get_datatable_columns(self.store.names)
+
+    def filter(self, indices: Optional[Sequence[int]], values: Optional[List]) -> np.ndarray:
+        """
+        Restricts row positions to the rows whose 'color' label passes the label filter.
+
+        Args:
+            indices (Optional[Sequence[int]]): The row positions to filter, None for every row.
+            values (Optional[List]): The label filter, either a range for float labels or a list of labels.
+                An empty or None filter keeps all the rows.
+
+        Returns:
+            np.ndarray: The row positions passing the filter, in the same order as `indices`.
+        """
+        if self.mapper is None or not values:
+            return np.arange(len(self)) if indices is None else np.asarray(indices, dtype=int)
+        if indices is None:
+            return self.label_index.rows(values)
+        return self.label_index.filter(np.asarray(indices, dtype=int), values)
+
+    def rows(self, indices: Sequence[int]) -> Dict[str, Any]:
+        """
+        Returns the rows to push to the data table.
+
+        Args:
+            indices (Sequence[int]): The row positions.
+
+        Returns:
+            Dict[str, Any]: The displayed columns of the rows, in the order of `indices`, along with their
+                position in an 'index' column.
+        """
+        indices = np.asarray(indices, dtype=int)
+        data = {c: self.store.take(c, indices) for c in self.table_columns}
+        data["index"] = indices
+        return data
+
+    def tasks(self, indices: Sequence[int]) -> pd.DataFrame:
+        """
+        Returns the Label Studio tasks of rows.
+
+        Args:
+            indices (Sequence[int]): The row positions.
+
+        Returns:
+            pd.DataFrame: The 'id' and 'project' columns of the rows.
+        """
+        return self.store.frame(indices, ["id", "project"])
+
+
+class ImageDataset(Dataset):
+    """Dataset whose rows reference images through a 'path' column."""
+
+    def __init__(self, df: Union[pd.DataFrame, ColumnStore], mapper: Optional[bokeh.transform.transform],
+                 mode: ThumbnailMode = ThumbnailMode.eager, thumbnails: Optional[LazyThumbnails] = None,
+                 label_index: Optional[LabelIndex] = None):
+        """
+        Args:
+            df (Union[pd.DataFrame, ColumnStore]): The data, with an 'image' column unless the thumbnails are encoded
+                lazily.
+            mapper (Optional[bokeh.transform.transform]): The color mapper returned by `get_color_mapping`.
+            mode (ThumbnailMode): How the thumbnails are produced.
+            thumbnails (Optional[LazyThumbnails]): The thumbnail encoder, required in lazy mode.
+            label_index (Optional[LabelIndex]): The index of the 'color' column, built if None.
+        """
+        super(ImageDataset, self).__init__(df, mapper, label_index=label_index)
+        self.mode = mode
+        self.thumbnails = thumbnails
+
+    @classmethod
+    def load(cls, path: str, columns: Optional[Iterable[str]] = None, mode: ThumbnailMode = ThumbnailMode.eager,
+             workers: int = 1, cache: Optional[ThumbnailCache] = None,
+             spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> "ImageDataset":
+        """
+        Loads an image dataset from a table and prepares its thumbnails.
+
+        Args:
+            path (str): The path of the table, see `bundler.utils.tables.read_table` for the supported formats.
+            columns (Optional[Iterable[str]]): Columns to display, defaults to None which loads every column.
+            mode (ThumbnailMode): Whether to encode all the thumbnails upfront, only the displayed ones, or to
+                reference the thumbnails served over HTTP (see `bundler.utils.handlers.ThumbnailHandler`).
+            workers (int): Number of processes used to encode the thumbnails.
+            cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+            spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+
+        Returns:
+            ImageDataset: The loaded dataset.
+        """
+        with DATASET_LOAD_SECONDS.time(kind="image"):
+            mapper, df = read_file(
+                path, do_encoding=mode == ThumbnailMode.eager, workers=workers, cache=cache, spec=spec,
+                columns=app_columns(columns, "path")
+            )
+            if mode == ThumbnailMode.http:
+                df["image"] = [
+                    p if type(p) == str and p.startswith("http") else f"{THUMBNAIL_ROUTE}/{i}"
+                    for i, p in enumerate(df["path"])
+                ]
+            thumbnails = LazyThumbnails(workers=workers, cache=cache, spec=spec) \
+                if mode == ThumbnailMode.lazy else None
+            dataset = cls(df, mapper, mode=mode, thumbnails=thumbnails)
+        logger.info(f"Loaded {len(df)} rows from {path}")
+        return dataset
+
+    @property
+    def paths(self) -> Sequence[str]:
+        """Image paths indexed by row position."""
+        return self.store.column("path")
+
+    @property
+    def table_columns(self) -> List[str]:
+        return [c for c in super(ImageDataset, self).table_columns if c != "image"]
+
+    def rows(self, indices: Sequence[int]) -> Dict[str, Any]:
+        data = super(ImageDataset, self).rows(indices)
+        if self.mode == ThumbnailMode.lazy:
+            data["image"] = self.thumbnails.take(self.store.take("path", data["index"]))
+        else:
+            data["image"] = self.store.take("image", data["index"])
+        return data
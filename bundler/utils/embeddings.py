@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import pathlib
+import re
+from typing import Callable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# size of the .npy header, fixed so that the shape can be rewritten in place when rows are appended
+NPY_HEADER_SIZE = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(shape: Tuple[int, int], dtype: np.dtype) -> bytes:
+    """Version 1.0 .npy header of a C-ordered array, padded to `NPY_HEADER_SIZE` bytes."""
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    size = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+    header = header.ljust(size - 1) + "\n"
+    if len(header) != size:
+        raise ValueError(f"Shape {shape} doesn't fit in a {NPY_HEADER_SIZE} bytes .npy header.")
+    return NPY_MAGIC + np.uint16(size).astype("<u2").tobytes() + header.encode("latin1")
+
+
+class EmbeddingStore(object):
+    """
+    Append-only matrix of embeddings stored as a regular .npy file.
+
+    Rows are appended at the end of the file and the shape in the header is only updated once they are flushed, so
+    the header acts as a checkpoint: after a crash, the rows written past it are discarded and a run can resume from
+    `len(store)`. The file can be memory-mapped at any time with `np.load(path, mmap_mode="r")`.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], dtype: np.dtype = np.float32):
+        """
+        Args:
+            path (Union[str, pathlib.Path]): The .npy file, created on the first append if it doesn't exist.
+            dtype (np.dtype): Type of the stored embeddings, ignored when the file exists.
+        """
+        self.path = pathlib.Path(path)
+        self.dtype = np.dtype(dtype)
+        self.n_rows, self.dim = 0, None
+        if self.path.exists():
+            self._open()
+
+    def _open(self) -> None:
+        with open(self.path, "rb") as f:
+            if np.lib.format.read_magic(f) != (1, 0):
+                raise ValueError(f"{self.path} is not an embedding store.")
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            if f.tell() != NPY_HEADER_SIZE or fortran_order or len(shape) != 2:
+                raise ValueError(f"{self.path} is not an embedding store.")
+        self.n_rows, self.dim = shape
+        self.dtype = dtype
+        # drop the rows written after the last checkpoint
+        size = NPY_HEADER_SIZE + self.n_rows * self.dim * self.dtype.itemsize
+        if os.path.getsize(self.path) > size:
+            os.truncate(self.path, size)
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def append(self, embeddings: np.ndarray) -> None:
+        """
+        Appends embeddings and checkpoints them.
+
+        Args:
+            embeddings (np.ndarray): A (n, dim) array.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if embeddings.ndim != 2:
+            raise ValueError(f"Expected a 2D array, got shape {embeddings.shape}.")
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "wb") as f:
+                f.write(_npy_header((0, self.dim), self.dtype))
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {embeddings.shape[1]}.")
+
+        with open(self.path, "r+b") as f:
+            f.seek(NPY_HEADER_SIZE + self.n_rows * self.dim * self.dtype.itemsize)
+            f.write(embeddings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            self.n_rows += len(embeddings)
+            f.seek(0)
+            f.write(_npy_header((self.n_rows, self.dim), self.dtype))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def truncate(self, n_rows: int) -> None:
+        """Drops the rows past the first `n_rows`."""
+        if n_rows >= self.n_rows:
+            return
+        with open(self.path, "r+b") as f:
+            f.write(_npy_header((n_rows, self.dim), self.dtype))
+            f.truncate(NPY_HEADER_SIZE + n_rows * self.dim * self.dtype.itemsize)
+        self.n_rows = n_rows
+
+    def load(self, mmap_mode: Optional[str] = "r") -> np.ndarray:
+        """Returns the stored embeddings, memory-mapped by default."""
+        if self.dim is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return np.load(self.path, mmap_mode=mmap_mode)
+
+
+# size of the keys of the embedding cache, in bytes
+KEY_SIZE = 16
+
+
+def embedding_key(model_name: str, *content) -> bytes:
+    """
+    Key of an embedding in an `EmbeddingCache`.
+
+    Args:
+        model_name (str): Name of the model computing the embedding.
+        *content: What is embedded, e.g. a sentence, or a text along with a span. Must be JSON serializable.
+
+    Returns:
+        bytes: A `KEY_SIZE` bytes digest.
+    """
+    payload = json.dumps([model_name, *content], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf8"), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache(object):
+    """
+    Persistent cache of embeddings keyed by content hash, so that re-runs only embed new or changed rows.
+
+    The embeddings of a model are stored in an append-only `EmbeddingStore`, and their keys (see `embedding_key`)
+    are appended in the same order to an index file of fixed-size records. The index is loaded in memory as a hash
+    table and looked up in bulk, the keys added during the run are kept in a dictionary on top of it.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], model_name: str):
+        """
+        Args:
+            directory (Union[str, pathlib.Path]): Root directory of the cache, every model gets its own subdirectory.
+            model_name (str): Name of the model computing the embeddings.
+        """
+        self.model_name = model_name
+        self.directory = pathlib.Path(directory) / re.sub(r"[^\w.-]+", "--", model_name)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.store = EmbeddingStore(self.directory / "embeddings.npy")
+        self.index_path = self.directory / "index.bin"
+
+        keys = self.index_path.read_bytes() if self.index_path.exists() else b""
+        # the store is appended before the index, after a crash they are realigned on the shortest one
+        n = min(len(keys) // KEY_SIZE, len(self.store))
+        if len(keys) != n * KEY_SIZE:
+            keys = keys[:n * KEY_SIZE]
+            self.index_path.write_bytes(keys)
+        self.store.truncate(n)
+        self._index = pd.Index([keys[i:i + KEY_SIZE] for i in range(0, len(keys), KEY_SIZE)], dtype=object)
+        self._new_rows = {}
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def key(self, *content) -> bytes:
+        """Key of the embedding of `content` by the model of the cache, see `embedding_key`."""
+        return embedding_key(self.model_name, *content)
+
+    def lookup(self, keys: Sequence[bytes]) -> np.ndarray:
+        """
+        Args:
+            keys (Sequence[bytes]): The keys to look up.
+
+        Returns:
+            np.ndarray: The row of every key in the cache, -1 for the missing keys.
+        """
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._index):
+            rows = self._index.get_indexer(pd.Index(list(keys), dtype=object)).astype(np.int64)
+        if self._new_rows:
+            for i in np.flatnonzero(rows < 0):
+                rows[i] = self._new_rows.get(keys[i], -1)
+        return rows
+
+    def add(self, keys: Sequence[bytes], embeddings: np.ndarray) -> None:
+        """Appends embeddings along with their keys, the keys must be unique and not cached yet."""
+        start = len(self.store)
+        self.store.append(embeddings)
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(keys))
+        self._new_rows.update(zip(keys, range(start, start + len(keys))))
+
+    def get_or_compute(self, keys: Sequence[bytes], compute: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Returns the embeddings of `keys`, computing and caching the missing ones.
+
+        Args:
+            keys (Sequence[bytes]): The keys of the embeddings.
+            compute (Callable[[np.ndarray], np.ndarray]): Called with the positions in `keys` of the missing
+                embeddings (one position per distinct missing key), returns their embeddings in the same order.
+
+        Returns:
+            np.ndarray: The (len(keys), dim) embeddings.
+        """
+        rows = self.lookup(keys)
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            # duplicated keys are only computed once
+            _, first = np.unique(np.array([keys[i] for i in missing], dtype=object), return_index=True)
+            todo = missing[np.sort(first)]
+            self.add([keys[i] for i in todo], compute(todo))
+            rows = self.lookup(keys)
+        return np.asarray(self.store.load()[rows])
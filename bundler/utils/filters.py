@@ -0,0 +1,145 @@
+import json
+import pathlib
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# label filter option matching the rows without a label
+MISSING_LABEL = "nan"
+
+
+class LabelIndex(object):
+    """
+    Precomputed index of the 'color' column, answering label filters without scanning the table.
+
+    Discrete labels are stored as integer codes along with the sorted row positions of every code, float labels
+    as their sorted order and the rank of every row in it. A filter change then costs a lookup per selected row
+    (or a slice of the index when nothing is selected) instead of a pass over the DataFrame.
+    """
+
+    def __init__(self, color: pd.Series):
+        """
+        Args:
+            color (pd.Series): The 'color' column, as processed by `get_color_mapping`.
+        """
+        color = color.reset_index(drop=True)
+        self.is_float = str(color.dtype).startswith("float")
+        if self.is_float:
+            values = color.to_numpy(dtype=np.float64)
+            # NaNs are sorted last and never match a range
+            self.order = np.argsort(values, kind="stable")
+            self.n_valid = int(np.count_nonzero(~np.isnan(values)))
+            self.sorted_values = values[self.order[:self.n_valid]]
+            self.rank = np.empty(len(values), dtype=np.int64)
+            self.rank[self.order] = np.arange(len(values))
+            return
+
+        if isinstance(color.dtype, pd.CategoricalDtype):
+            codes = color.cat.codes.to_numpy()
+            self.labels = [str(c) for c in color.cat.categories]
+        else:
+            # integer labels are displayed as strings in the MultiChoice
+            codes, uniques = pd.factorize(color, sort=True)
+            self.labels = [str(v) for v in uniques]
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.code_of = {label: code for code, label in enumerate(self.labels)}
+        self.code_of[MISSING_LABEL] = -1
+
+        # rows of code `c` are order[offsets[c + 1]:offsets[c + 2]], missing labels (code -1) come first
+        shifted = self.codes.astype(np.int64) + 1
+        self.order = np.argsort(shifted, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(shifted, minlength=len(self.labels) + 1))])
+
+    def _arrays(self) -> List[str]:
+        return ["order", "sorted_values", "rank"] if self.is_float else ["codes", "order", "offsets"]
+
+    def save(self, directory: Union[str, pathlib.Path]) -> None:
+        """Writes the index to a directory, see `load`."""
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in self._arrays():
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        meta = {"is_float": self.is_float}
+        if self.is_float:
+            meta["n_valid"] = self.n_valid
+        else:
+            meta["labels"] = self.labels
+        with open(directory / "index.json", "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, directory: Union[str, pathlib.Path]) -> "LabelIndex":
+        """Memory-maps an index saved with `save`, without scanning the labels again."""
+        directory = pathlib.Path(directory)
+        with open(directory / "index.json", "r") as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        index.is_float = meta["is_float"]
+        if index.is_float:
+            index.n_valid = meta["n_valid"]
+        else:
+            index.labels = meta["labels"]
+            index.code_of = {label: code for code, label in enumerate(index.labels)}
+            index.code_of[MISSING_LABEL] = -1
+        for name in index._arrays():
+            setattr(index, name, np.load(directory / f"{name}.npy", mmap_mode="r"))
+        return index
+
+    @property
+    def n_missing(self) -> int:
+        """Number of rows without a label."""
+        return len(self.order) - self.n_valid if self.is_float else int(self.offsets[1])
+
+    @property
+    def value_range(self) -> Tuple[float, float]:
+        """Smallest and largest float label, NaN if there is none."""
+        if not self.n_valid:
+            return np.nan, np.nan
+        return self.sorted_values[0], self.sorted_values[self.n_valid - 1]
+
+    def _codes(self, values: Sequence) -> List[int]:
+        return sorted({self.code_of[str(v)] for v in values if str(v) in self.code_of})
+
+    def _rank_bounds(self, values: Sequence[float]):
+        low, high = values
+        return (int(np.searchsorted(self.sorted_values, low, side="left")),
+                int(np.searchsorted(self.sorted_values, high, side="right")))
+
+    def rows(self, values: Sequence) -> np.ndarray:
+        """
+        Row positions matching a label filter.
+
+        Args:
+            values (Sequence): Either a (low, high) range for float labels, or a list of labels.
+
+        Returns:
+            np.ndarray: The sorted row positions.
+        """
+        if self.is_float:
+            start, stop = self._rank_bounds(values)
+            return np.sort(self.order[start:stop])
+        parts = [self.order[self.offsets[c + 1]:self.offsets[c + 2]] for c in self._codes(values)]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=int)
+
+    def filter(self, indices: np.ndarray, values: Optional[Sequence]) -> np.ndarray:
+        """
+        Restricts row positions to the rows matching a label filter.
+
+        Args:
+            indices (np.ndarray): The row positions to filter.
+            values (Optional[Sequence]): Either a (low, high) range for float labels, or a list of labels.
+                An empty or None filter keeps all the rows.
+
+        Returns:
+            np.ndarray: The row positions passing the filter, in the same order as `indices`.
+        """
+        if not values:
+            return indices
+        if self.is_float:
+            start, stop = self._rank_bounds(values)
+            rank = self.rank[indices]
+            return indices[(rank >= start) & (rank < stop)]
+        keep = np.zeros(len(self.labels) + 1, dtype=bool)
+        keep[np.asarray(self._codes(values), dtype=np.int64) + 1] = True
+        return indices[keep[self.codes[indices].astype(np.int64) + 1]]
@@ -0,0 +1,131 @@
+import base64
+import logging
+from functools import partial
+from typing import Optional, Sequence
+
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler
+
+from bundler.utils.cache import ThumbnailCache
+from bundler.utils.metrics import REGISTRY, Registry
+from bundler.utils.utils import DEFAULT_THUMBNAIL, PLACEHOLDER_PNG, ThumbnailSpec, make_thumbnail, \
+    make_thumbnail_etag
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_ROUTE = "/thumbnails"
+METRICS_ROUTE = "/metrics"
+
+
+class ThumbnailHandler(RequestHandler):
+    """
+    Serves the thumbnail of a row, addressed by its position in the dataset: `GET /thumbnails/<row id>`.
+
+    Thumbnails are encoded off the IOLoop and sent with an ETag derived from the source file, so browsers can
+    cache them and revalidate with a cheap 304. The on-disk cache they are written to is pruned in the background.
+    """
+
+    def initialize(self, paths: Sequence[str], cache: Optional[ThumbnailCache] = None,
+                   spec: ThumbnailSpec = DEFAULT_THUMBNAIL, max_age: int = 3600):
+        """
+        Args:
+            paths (Sequence[str]): The image paths of the dataset, indexed by row id.
+            cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+            spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+            max_age (int): Number of seconds browsers may reuse a thumbnail without revalidating it.
+        """
+        self.paths = paths
+        self.cache = cache
+        self.spec = spec
+        self.max_age = max_age
+
+    def compute_etag(self) -> Optional[str]:
+        # ETags are set explicitly from the source file, no need to hash the response body
+        return None
+
+    async def get(self, row_id: str):
+        try:
+            path = self.paths[int(row_id)]
+        except (IndexError, ValueError):
+            raise HTTPError(404)
+
+        if type(path) == str and path.startswith("http"):
+            self.redirect(path)
+            return
+
+        etag = make_thumbnail_etag(path, spec=self.spec)
+        if etag is None:
+            logger.error(f"Could not find image {path}")
+            self._send_placeholder()
+            return
+
+        self.set_header("Etag", f'"{etag}"')
+        self.set_header("Cache-Control", f"private, max-age={self.max_age}")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        try:
+            data = await IOLoop.current().run_in_executor(
+                None, partial(make_thumbnail, path, cache=self.cache, spec=self.spec)
+            )
+        except Exception as e:
+            logger.error(f"Could not encode image {path}: {e}")
+            self._send_placeholder()
+            return
+        if self.cache is not None:
+            # keeps the cache within its size limit, from a background thread at most once a minute
+            self.cache.prune_later()
+
+        self.set_header("Content-Type", self.spec.mime_type)
+        self.write(data)
+
+    def _send_placeholder(self):
+        self.set_header("Content-Type", "image/png")
+        self.set_header("Cache-Control", "no-cache")
+        self.write(base64.b64decode(PLACEHOLDER_PNG))
+
+
+def thumbnail_pattern(paths: Sequence[str], cache: Optional[ThumbnailCache] = None,
+                      spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> tuple:
+    """
+    Builds the Tornado route serving the thumbnails of a dataset.
+
+    Args:
+        paths (Sequence[str]): The image paths of the dataset, indexed by row id.
+        cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+        spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+
+    Returns:
+        tuple: A `(pattern, handler, kwargs)` tuple to be passed in the `extra_patterns` of a Bokeh server.
+    """
+    return rf"{THUMBNAIL_ROUTE}/(\d+)", ThumbnailHandler, {"paths": paths, "cache": cache, "spec": spec}
+
+
+class MetricsHandler(RequestHandler):
+    """Exposes the metrics of the server in the Prometheus text format: `GET /metrics`."""
+
+    def initialize(self, registry: Registry = REGISTRY):
+        """
+        Args:
+            registry (Registry): The exposed metrics.
+        """
+        self.registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.write(self.registry.render())
+
+
+def metrics_pattern(registry: Registry = REGISTRY) -> tuple:
+    """
+    Builds the Tornado route exposing the metrics of the server.
+
+    Args:
+        registry (Registry): The exposed metrics.
+
+    Returns:
+        tuple: A `(pattern, handler, kwargs)` tuple to be passed in the `extra_patterns` of a Bokeh server.
+    """
+    return METRICS_ROUTE, MetricsHandler, {"registry": registry}
@@ -0,0 +1,147 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+NAN_RGB = (128, 128, 128)
+
+
+def _palette_rgb(palette) -> np.ndarray:
+    """Converts a list of hex colors into an (n, 3) uint8 array."""
+    palette = [c.lstrip("#") for c in palette]
+    return np.array([[int(c[i:i + 2], 16) for i in (0, 2, 4)] for c in palette], dtype=np.uint8)
+
+
+def point_colors(values: np.ndarray, mapper: Optional[dict]) -> np.ndarray:
+    """
+    Resolves, on the server, the color each point gets in the browser.
+
+    Args:
+        values (np.ndarray): The values fed to the color mapper, see `get_color_codes`.
+        mapper (Optional[dict]): The color mapper returned by `get_color_mapping`.
+
+    Returns:
+        np.ndarray: An (n, 3) uint8 array of RGB colors, points without a color are grey.
+    """
+    n = len(values)
+    colors = np.empty((n, 3), dtype=np.uint8)
+    colors[:] = NAN_RGB
+    if mapper is None:
+        colors[:] = (31, 119, 180)  # Bokeh's default glyph color
+        return colors
+
+    # `get_color_mapping` always maps the colors linearly, categorical labels through their codes
+    transform = mapper["transform"]
+    palette = _palette_rgb(transform.palette)
+    values = np.asarray(values, dtype=float)
+    # out of range values, e.g. the -1 code of missing categorical labels, keep the grey color
+    known = (values >= transform.low) & (values <= transform.high)
+    span = (transform.high - transform.low) or 1.0
+    idx = ((values[known] - transform.low) / span * len(palette)).astype(int)
+    colors[known] = palette[np.clip(idx, 0, len(palette) - 1)]
+    return colors
+
+
+def visible_mask(x: np.ndarray, y: np.ndarray, x_range: Tuple[float, float], y_range: Tuple[float, float]) \
+        -> np.ndarray:
+    """Boolean mask of the points within the viewport."""
+    return (x >= x_range[0]) & (x <= x_range[1]) & (y >= y_range[0]) & (y <= y_range[1])
+
+
+def density_image(x: np.ndarray, y: np.ndarray, colors: np.ndarray, x_range: Tuple[float, float],
+                  y_range: Tuple[float, float], width: int, height: int) -> np.ndarray:
+    """
+    Renders points into a binned density image.
+
+    Every pixel takes the average color of the points falling into it, and an opacity growing with the
+    logarithm of their count, so that both the clusters and the color classes within them stay visible.
+
+    Args:
+        x (np.ndarray): The x coordinates of the points.
+        y (np.ndarray): The y coordinates of the points.
+        colors (np.ndarray): The (n, 3) uint8 RGB colors of the points, see `point_colors`.
+        x_range (Tuple[float, float]): The horizontal extent of the image, in data coordinates.
+        y_range (Tuple[float, float]): The vertical extent of the image, in data coordinates.
+        width (int): Width of the image, in pixels.
+        height (int): Height of the image, in pixels.
+
+    Returns:
+        np.ndarray: A (height, width) uint32 array of packed RGBA pixels, as expected by `image_rgba`.
+    """
+    mask = visible_mask(x, y, x_range, y_range)
+    x, y, colors = x[mask], y[mask], colors[mask]
+
+    x_span = (x_range[1] - x_range[0]) or 1.0
+    y_span = (y_range[1] - y_range[0]) or 1.0
+    bx = np.minimum(((x - x_range[0]) / x_span * width).astype(np.int64), width - 1)
+    by = np.minimum(((y - y_range[0]) / y_span * height).astype(np.int64), height - 1)
+    flat = by * width + bx
+
+    size = width * height
+    counts = np.bincount(flat, minlength=size).astype(np.float64)
+    occupied = counts > 0
+
+    rgba = np.zeros((size, 4), dtype=np.uint8)
+    for channel in range(3):
+        sums = np.bincount(flat, weights=colors[:, channel], minlength=size)
+        rgba[occupied, channel] = (sums[occupied] / counts[occupied]).astype(np.uint8)
+    if occupied.any():
+        alpha = np.log1p(counts[occupied]) / np.log1p(counts.max())
+        rgba[occupied, 3] = (64 + 191 * alpha).astype(np.uint8)
+
+    return rgba.view(np.uint32).reshape(height, width)
+
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Vectorized even-odd rule point-in-polygon test.
+
+    Args:
+        x (np.ndarray): The x coordinates of the points.
+        y (np.ndarray): The y coordinates of the points.
+        xs (np.ndarray): The x coordinates of the polygon vertices.
+        ys (np.ndarray): The y coordinates of the polygon vertices.
+
+    Returns:
+        np.ndarray: Boolean mask of the points inside the polygon.
+    """
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    if len(xs) < 3:
+        return inside
+
+    # only test the points within the bounding box of the polygon
+    candidates = np.flatnonzero(visible_mask(x, y, (xs.min(), xs.max()), (ys.min(), ys.max())))
+    px, py = x[candidates], y[candidates]
+    result = np.zeros(len(candidates), dtype=bool)
+    for x0, y0, x1, y1 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+        crosses = (y0 > py) != (y1 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = (x1 - x0) * (py - y0) / (y1 - y0) + x0
+        result ^= crosses & (px < x_cross)
+    inside[candidates] = result
+    return inside
+
+
+def select_geometry(x: np.ndarray, y: np.ndarray, geometry: Dict) -> np.ndarray:
+    """
+    Resolves a selection tool geometry into row positions.
+
+    Args:
+        x (np.ndarray): The x coordinates of the points.
+        y (np.ndarray): The y coordinates of the points.
+        geometry (Dict): The `geometry` of a `SelectionGeometry` event, from a lasso ('poly') or box ('rect') tool.
+
+    Returns:
+        np.ndarray: The positions of the selected points.
+    """
+    if geometry["type"] == "poly":
+        mask = points_in_polygon(x, y, geometry["x"], geometry["y"])
+    elif geometry["type"] == "rect":
+        mask = visible_mask(
+            x, y,
+            (min(geometry["x0"], geometry["x1"]), max(geometry["x0"], geometry["x1"])),
+            (min(geometry["y0"], geometry["y1"]), max(geometry["y0"], geometry["y1"]))
+        )
+    else:
+        raise ValueError(f"Unsupported selection geometry: {geometry['type']}")
+    return np.flatnonzero(mask)
@@ -1,15 +1,125 @@
+import json
 import logging
 import os
-from collections import defaultdict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import requests as requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from bundler.utils.metrics import LS_REQUEST_SECONDS, LS_REQUESTS
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# default maximum number of filter items (single ids or id ranges) of a single view
+MAX_FILTERS_PER_VIEW = 100
+
+# default number of tasks labeled by a single request
+LABEL_BATCH_SIZE = 1000
+
+# maximum number of filter items (single ids or id ranges) of a task listing, which are sent in its query string
+MAX_FILTERS_PER_QUERY = 50
+
+# statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# statuses of requests the server refused without processing them, the only ones a non-idempotent POST is retried on
+POST_RETRY_STATUSES = (429, 503)
+
+HIDDEN_COLUMNS = {
+    "explore": [
+        "tasks:inner_id",
+        "tasks:annotations_by",
+        "tasks:annotations_ids",
+        "tasks:predictions_score",
+        "tasks:predictions_model_versions",
+        "tasks:predictions_results",
+        "tasks:file_upload",
+        "tasks:created_at",
+        "tasks:updated_at",
+        "tasks:updated_by",
+        "tasks:avg_lead_time",
+        "tasks:storage_filename"
+    ],
+    "labeling": [
+        "tasks:id",
+        "tasks:inner_id",
+        "tasks:completed_at",
+        "tasks:cancelled_annotations",
+        "tasks:total_predictions",
+        "tasks:annotators",
+        "tasks:annotations_results",
+        "tasks:annotations_ids",
+        "tasks:predictions_score",
+        "tasks:predictions_model_versions",
+        "tasks:predictions_results",
+        "tasks:file_upload",
+        "tasks:created_at",
+        "tasks:updated_at",
+        "tasks:updated_by",
+        "tasks:avg_lead_time",
+        "tasks:drafts"
+    ]
+}
+
+
+def id_ranges(ids: Sequence[int]) -> List[Tuple[int, int]]:
+    """
+    Compresses task ids into ranges of consecutive ids.
+
+    Args:
+        ids (Sequence[int]): The task ids, in any order and possibly duplicated.
+
+    Returns:
+        List[Tuple[int, int]]: The sorted, inclusive (first, last) ranges covering exactly the ids.
+    """
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    if len(ids) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(ids) != 1)
+    starts = np.concatenate([[0], breaks + 1])
+    stops = np.concatenate([breaks, [len(ids) - 1]])
+    return list(zip(ids[starts].tolist(), ids[stops].tolist()))
+
+
+def id_filter(first: int, last: int) -> dict:
+    """Data manager filter item matching the task ids from `first` to `last` included."""
+    if first == last:
+        return {"filter": "filter:tasks:id", "operator": "equal", "type": "Number", "value": first}
+    # filter items share a single conjunction, so ranges use the "in" operator rather than OR-ed bounds
+    return {"filter": "filter:tasks:id", "operator": "in", "type": "Number", "value": {"min": first, "max": last}}
+
+
+class _Retry(Retry):
+    """
+    Retries GET requests on read errors and on `RETRY_STATUSES`, but POST requests only when they can't have been
+    applied: connection errors and `POST_RETRY_STATUSES`.
+
+    Creating views and importing predictions are not idempotent, a POST that timed out while Label Studio processed
+    it must not be sent again.
+    """
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method and method.upper() == "POST":
+            return status_code in POST_RETRY_STATUSES
+        return super(_Retry, self).is_retry(method, status_code, has_retry_after)
+
+
+def _has_choice(results: Optional[List[dict]], from_name: str, label: str) -> bool:
+    """Whether the results of a prediction or an annotation choose `label` with the control tag `from_name`."""
+    return any(
+        result.get("from_name") == from_name and label in (result.get("value") or {}).get("choices", [])
+        for result in results or [] if isinstance(result, dict)
+    )
+
 
 class LabelStudioAuthenticationError(Exception):
     pass
@@ -19,116 +129,415 @@ class LabelStudioError(Exception):
     pass
 
 
-class LabelStudioClient(object):
-    def __init__(self):
+class ViewResult(NamedTuple):
+    """Outcome of the creation of a single Label Studio view."""
+    project: int
+    title: str
+    n_tasks: int
+    view_id: Optional[int] = None
+    error: Optional[str] = None
 
-        try:
-            self.token = os.environ["LS_TOKEN"]
-        except KeyError:
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class TabResult(NamedTuple):
+    """Outcome of `LabelStudioClient.create_tab`."""
+    created: List[ViewResult]
+    failed: List[ViewResult]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    @property
+    def summary(self) -> str:
+        summary = f"{len(self.created)} view(s) created"
+        if self.failed:
+            summary += f", {len(self.failed)} failed ({self.failed[0].error})"
+        return summary
+
+
+class LabelBatch(NamedTuple):
+    """Outcome of the labeling of a batch of tasks, `n_skipped` of which Label Studio already held labeled."""
+    project: int
+    task_ids: List[int]
+    error: Optional[str] = None
+    n_skipped: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class LabelResult(NamedTuple):
+    """Outcome of `LabelStudioClient.label_tasks`."""
+    labeled: List[LabelBatch]
+    failed: List[LabelBatch]
+    skipped: int
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    @property
+    def n_labeled(self) -> int:
+        return sum(len(batch.task_ids) for batch in self.labeled)
+
+    @property
+    def summary(self) -> str:
+        summary = f"{self.n_labeled} task(s) labeled"
+        if self.skipped:
+            summary += f", {self.skipped} already labeled"
+        if self.failed:
+            summary += f", {sum(len(b.task_ids) for b in self.failed)} failed ({self.failed[0].error})"
+        return summary
+
+
+class LabelStudioClient(object):
+    def __init__(self, url: Optional[str] = None, token: Optional[str] = None,
+                 session: Optional[requests.Session] = None, max_workers: int = 4,
+                 timeout: Union[float, Tuple[float, float]] = (5, 30), retries: int = 3, backoff_factor: float = 0.5,
+                 max_filters: int = MAX_FILTERS_PER_VIEW):
+        """
+        Args:
+            url (Optional[str]): Endpoint of Label Studio, defaults to the `LS_ENDPOINT` environment variable.
+            token (Optional[str]): Authentication token, defaults to the `LS_TOKEN` environment variable.
+            session (Optional[requests.Session]): HTTP session to send the requests with, defaults to a pooled
+                session retrying on rate limiting and transient server errors (see `_Retry`).
+            max_workers (int): Maximum number of concurrent requests.
+            timeout (Union[float, Tuple[float, float]]): Connect and read timeouts of every request, in seconds.
+            retries (int): Maximum number of retries of a request.
+            backoff_factor (float): Exponential backoff factor between retries, in seconds.
+            max_filters (int): Maximum number of filter items (single ids or id ranges) of a view.
+        """
+        self.token = token or os.environ.get("LS_TOKEN")
+        if not self.token:
             raise LabelStudioAuthenticationError("Authentication token missing.")
 
-        try:
-            self.url = os.environ["LS_ENDPOINT"]
-        except KeyError:
+        self.url = url or os.environ.get("LS_ENDPOINT")
+        if not self.url:
             raise LabelStudioError("Label studio endpoint is missing.")
+        self.url = self.url.rstrip("/")
 
         self.headers = {"Authorization": f"Token {self.token}"}
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.max_filters = max(1, max_filters)
+        self._controls: Dict[Tuple[int, Optional[str]], Tuple[str, str, str]] = {}
+        # (project, task, control, label, as annotation) written by this client, skipped without asking Label Studio.
+        # It is lost on restart and not shared by the processes of a server, see `label_tasks`
+        self._labeled: Set[Tuple[int, int, str, str, bool]] = set()
+        self._labeled_lock = threading.Lock()
+        self.session = session if session is not None else self._make_session(retries, backoff_factor)
 
-    def create_tab(self, df: pd.DataFrame, name: str) -> None:
-        """"""
-        projects = defaultdict(list)
-        for _, row in df.iterrows():
-            projects[row.project].append(row.id)
-
-        url = f"{self.url}/api/dm/views/"
-        for project, ids in projects.items():
-            query = {
-                "data": {
-                    "type": "list",
-                    "target": "tasks",
-                    "gridWidth": 4,
-                    "columnsWidth": {},
-                    "hiddenColumns": {
-                        "explore": [
-                            "tasks:inner_id",
-                            "tasks:annotations_by",
-                            "tasks:annotations_ids",
-                            "tasks:predictions_score",
-                            "tasks:predictions_model_versions",
-                            "tasks:predictions_results",
-                            "tasks:file_upload",
-                            "tasks:created_at",
-                            "tasks:updated_at",
-                            "tasks:updated_by",
-                            "tasks:avg_lead_time",
-                            "tasks:storage_filename"
-                        ],
-                        "labeling": [
-                            "tasks:id",
-                            "tasks:inner_id",
-                            "tasks:completed_at",
-                            "tasks:cancelled_annotations",
-                            "tasks:total_predictions",
-                            "tasks:annotators",
-                            "tasks:annotations_results",
-                            "tasks:annotations_ids",
-                            "tasks:predictions_score",
-                            "tasks:predictions_model_versions",
-                            "tasks:predictions_results",
-                            "tasks:file_upload",
-                            "tasks:created_at",
-                            "tasks:updated_at",
-                            "tasks:updated_by",
-                            "tasks:avg_lead_time",
-                            "tasks:drafts"
-                        ]
-                    },
-                    "columnsDisplayType": {}
-                },
-                "project": project,
-                "user": 1
-            }
-            if len(ids) <= 100:
-                query["data"]["title"] = name
-                query["data"]["filters"] = {
-                    "conjunction": "or",
-                    "items": [
-                        {
-                            "filter": "filter:tasks:id",
-                            "operator": "equal",
-                            "type": "Number",
-                            "value": idx
-                        } for idx in ids
-                    ]
+    def _make_session(self, retries: int, backoff_factor: float) -> requests.Session:
+        """Creates a session keeping up to `max_workers` connections alive and retrying failed requests."""
+        retry = _Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            # POST requests are only retried on the statuses of `_Retry.is_retry`, never on read errors
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _request(self, method: str, endpoint: str, path: str, **kwargs) -> requests.Response:
+        """
+        Sends a request to Label Studio, recording its latency (retries included) and outcome.
+
+        Args:
+            method (str): The HTTP method.
+            endpoint (str): The route of the request in the metrics, e.g. '/api/projects/{id}'.
+            path (str): The path of the request.
+            **kwargs: Arguments of `requests.Session.request`.
+
+        Returns:
+            requests.Response: The response.
+        """
+        status = "error"
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, f"{self.url}{path}", headers=self.headers, timeout=self.timeout, **kwargs)
+            status = str(r.status_code)
+            return r
+        finally:
+            LS_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            LS_REQUESTS.inc(endpoint=endpoint, status=status)
 
+    @staticmethod
+    def _view_query(project: int, title: str, ranges: Sequence[Tuple[int, int]]) -> dict:
+        return {
+            "data": {
+                "type": "list",
+                "target": "tasks",
+                "gridWidth": 4,
+                "columnsWidth": {},
+                "hiddenColumns": HIDDEN_COLUMNS,
+                "columnsDisplayType": {},
+                "title": title,
+                "filters": {
+                    "conjunction": "or",
+                    "items": [id_filter(first, last) for first, last in ranges]
                 }
-                r = requests.post(url, json=query, headers=self.headers)
-                try:
-                    assert r.status_code == 201
-                    logger.info(f"Tab {name} has been created.")
-                except AssertionError:
-                    logger.error(f"Upload aborted:\n{r.json()}")
+            },
+            "project": project,
+            "user": 1
+        }
+
+    def _create_view(self, project: int, title: str, ranges: Sequence[Tuple[int, int]]) -> ViewResult:
+        """Creates a view filtering the task id `ranges` of `project`."""
+        n_tasks = sum(last - first + 1 for first, last in ranges)
+        try:
+            r = self._request("POST", "/api/dm/views/", "/api/dm/views/", json=self._view_query(project, title, ranges))
+        except requests.RequestException as e:
+            return ViewResult(project, title, n_tasks, error=str(e))
+        if r.status_code != 201:
+            return ViewResult(project, title, n_tasks, error=f"HTTP {r.status_code}: {r.text[:500]}")
+        try:
+            view_id = r.json().get("id")
+        except ValueError:
+            view_id = None
+        return ViewResult(project, title, n_tasks, view_id=view_id)
+
+    def create_tab(self, df: pd.DataFrame, name: str,
+                   progress: Optional[Callable[[ViewResult, int, int], None]] = None) -> TabResult:
+        """
+        Creates Label Studio views (tabs) listing the tasks of a DataFrame.
+
+        Tasks are grouped by project and their ids compressed into ranges of consecutive ids, so that the number
+        of views grows with the number of gaps in the selection rather than with its size. Projects needing more
+        than `max_filters` ranges are split into views titled "<name> - <i>". The views are created concurrently.
+
+        Args:
+            df (pd.DataFrame): The tasks, with their 'id' and 'project' columns.
+            name (str): Title of the tab.
+            progress (Optional[Callable[[ViewResult, int, int], None]]): Called with every view once created (or
+                failed), along with the number of views done so far and the total number of views. It is called
+                from the threads sending the requests.
+
+        Returns:
+            TabResult: The created and failed views.
+        """
+        views = []
+        for project, ids in df.groupby("project", sort=False)["id"]:
+            ranges = id_ranges(ids.to_numpy())
+            if len(ranges) <= self.max_filters:
+                views.append((int(project), name, ranges))
             else:
-                for i, offset in enumerate(range(0, len(ids), 100)):
-                    batch = ids[offset: offset + 100]
-
-                    query["data"]["title"] = f"{name} - {i}"
-                    query["data"]["filters"] = {
-                        "conjunction": "or",
-                        "items": [
-                            {
-                                "filter": "filter:tasks:id",
-                                "operator": "equal",
-                                "type": "Number",
-                                "value": idx
-                            } for idx in batch
-                        ]
-
-                    }
-
-                    r = requests.post(url, json=query, headers=self.headers)
-                    try:
-                        assert r.status_code == 201
-                        logger.info(f"Tab {name} has been created.")
-                    except AssertionError:
-                        logger.error(f"Upload aborted:\n{r.json()}")
+                for i, offset in enumerate(range(0, len(ranges), self.max_filters)):
+                    views.append((int(project), f"{name} - {i}", ranges[offset: offset + self.max_filters]))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(views) or 1)) as executor:
+            futures = [executor.submit(self._create_view, *view) for view in views]
+            for done, future in enumerate(as_completed(futures), start=1):
+                if progress is not None:
+                    progress(future.result(), done, len(futures))
+            results = [future.result() for future in futures]
+
+        result = TabResult(created=[r for r in results if r.ok], failed=[r for r in results if not r.ok])
+        for failure in result.failed:
+            logger.error(f"Upload aborted for view '{failure.title}' of project {failure.project}: {failure.error}")
+        logger.info(f"Tab {name}: {len(result.created)} view(s) created, {len(result.failed)} failed.")
+        return result
+
+    def _label_control(self, project: int, from_name: Optional[str] = None) -> Tuple[str, str, str]:
+        """
+        Finds the control tag receiving the labels in the labeling config of a project.
+
+        Args:
+            project (int): The project id.
+            from_name (Optional[str]): Name of the control tag, defaults to the first 'Choices' tag of the config.
+
+        Returns:
+            Tuple[str, str, str]: The name of the control tag, the name of the object tag it labels, and its type.
+        """
+        key = (project, from_name)
+        if key not in self._controls:
+            r = self._request("GET", "/api/projects/{id}", f"/api/projects/{project}")
+            if r.status_code != 200:
+                raise LabelStudioError(f"Project {project} could not be fetched: HTTP {r.status_code}")
+            controls = {
+                name: control for name, control in (r.json().get("parsed_label_config") or {}).items()
+                if control.get("type") == "Choices"
+            }
+            if from_name is None and controls:
+                from_name = next(iter(controls))
+            if from_name not in controls:
+                raise LabelStudioError(f"Project {project} has no 'Choices' control tag named {from_name}.")
+            self._controls[key] = (from_name, controls[from_name]["to_name"][0], "choices")
+        return self._controls[key]
+
+    def _labeled_tasks(self, project: int, ids: List[int], from_name: str, label: str) -> Tuple[Set[int], Set[int]]:
+        """
+        Finds the tasks Label Studio already holds labeled.
+
+        Args:
+            project (int): The project id.
+            ids (List[int]): The task ids.
+            from_name (str): Name of the control tag of the label.
+            label (str): The label.
+
+        Returns:
+            Tuple[Set[int], Set[int]]: The tasks with a prediction of the model version of the label, and the tasks
+                with an annotation choosing the label.
+        """
+        model_version = f"bundler:{from_name}:{label}"
+        predicted, annotated = set(), set()
+        ranges = id_ranges(ids)
+        for offset in range(0, len(ranges), MAX_FILTERS_PER_QUERY):
+            chunk = ranges[offset: offset + MAX_FILTERS_PER_QUERY]
+            query = {"filters": {"conjunction": "or", "items": [id_filter(first, last) for first, last in chunk]}}
+            params = {
+                "project": project,
+                "query": json.dumps(query),
+                "fields": "all",
+                "page": 1,
+                "page_size": sum(last - first + 1 for first, last in chunk),
+            }
+            r = self._request("GET", "/api/tasks", "/api/tasks", params=params)
+            if r.status_code != 200:
+                raise LabelStudioError(f"Tasks of project {project} could not be listed: HTTP {r.status_code}")
+            for task in r.json().get("tasks", []):
+                if any(isinstance(p, dict) and p.get("model_version") == model_version
+                       for p in task.get("predictions") or []):
+                    predicted.add(task["id"])
+                if any(isinstance(a, dict) and not a.get("was_cancelled")
+                       and _has_choice(a.get("result"), from_name, label) for a in task.get("annotations") or []):
+                    annotated.add(task["id"])
+        return predicted, annotated
+
+    def _release(self, batch: LabelBatch, from_name: str, label: str, as_annotations: bool) -> LabelBatch:
+        """Releases the tasks of a failed batch, reserved by `label_tasks`, so that they can be labeled again."""
+        with self._labeled_lock:
+            self._labeled.difference_update(
+                (batch.project, idx, from_name, label, as_annotations) for idx in batch.task_ids
+            )
+        return batch
+
+    def _label_batch(self, project: int, ids: List[int], label: str, control: Tuple[str, str, str],
+                     as_annotations: bool) -> LabelBatch:
+        """
+        Imports `label` as a prediction of the tasks `ids`, then converts these predictions to annotations.
+
+        Tasks already holding the prediction are not imported again, nor converted again when already annotated.
+        """
+        from_name, to_name, control_type = control
+        model_version = f"bundler:{from_name}:{label}"
+        try:
+            predicted, annotated = self._labeled_tasks(project, ids, from_name, label)
+        except (LabelStudioError, requests.RequestException) as e:
+            return self._release(LabelBatch(project, ids, error=str(e)), from_name, label, as_annotations)
+        done = annotated if as_annotations else predicted
+        to_convert = [idx for idx in ids if idx not in done]
+        to_import = [idx for idx in to_convert if idx not in predicted]
+
+        predictions = [
+            {
+                "task": idx,
+                "model_version": model_version,
+                "result": [{
+                    "from_name": from_name,
+                    "to_name": to_name,
+                    "type": control_type,
+                    "value": {control_type: [label]}
+                }]
+            } for idx in to_import
+        ]
+        calls = []
+        if to_import:
+            calls.append((
+                "/api/projects/{id}/import/predictions", f"/api/projects/{project}/import/predictions", {}, predictions
+            ))
+        if as_annotations and to_convert:
+            calls.append((
+                "/api/dm/actions",
+                "/api/dm/actions",
+                {"id": "predictions_to_annotations", "project": project},
+                {"selectedItems": {"all": False, "included": to_convert}, "model_version": model_version}
+            ))
+        error = None
+        for endpoint, path, params, body in calls:
+            try:
+                r = self._request("POST", endpoint, path, params=params, json=body)
+            except requests.RequestException as e:
+                error = str(e)
+                break
+            if r.status_code not in (200, 201):
+                error = f"HTTP {r.status_code}: {r.text[:500]}"
+                break
+
+        if error is not None:
+            return self._release(LabelBatch(project, ids, error=error), from_name, label, as_annotations)
+        return LabelBatch(project, to_convert, n_skipped=len(ids) - len(to_convert))
+
+    def label_tasks(self, df: pd.DataFrame, label: str, as_annotations: bool = False, from_name: Optional[str] = None,
+                    batch_size: int = LABEL_BATCH_SIZE,
+                    progress: Optional[Callable[[LabelBatch, int, int], None]] = None) -> LabelResult:
+        """
+        Labels tasks in bulk, as predictions or as annotations.
+
+        The label is imported as a prediction of every task, a few thousand tasks per request, with a model version
+        derived from the label. Annotations are then created from these predictions by the
+        'predictions_to_annotations' action of the data manager.
+
+        Repeated requests don't duplicate predictions nor annotations: tasks already labeled the same way by this
+        client are skipped right away, and the others are checked against the predictions and annotations Label
+        Studio holds before importing, so that labels written before a restart, by another process of the server or
+        as predictions before being requested as annotations are skipped too. Two processes labeling the same tasks
+        at the very same time may still both import them.
+
+        Args:
+            df (pd.DataFrame): The tasks, with their 'id' and 'project' columns.
+            label (str): The label, one of the choices of the labeling config of the projects.
+            as_annotations (bool): Whether to create annotations, rather than predictions only.
+            from_name (Optional[str]): Name of the 'Choices' control tag to label, defaults to the first one.
+            batch_size (int): Number of tasks labeled by a single request.
+            progress (Optional[Callable[[LabelBatch, int, int], None]]): Called with every batch once labeled (or
+                failed), along with the number of batches done so far and the total number of batches. It is
+                called from the threads sending the requests.
+
+        Returns:
+            LabelResult: The labeled and failed batches, and the number of skipped tasks.
+        """
+        batches, failed, skipped = [], [], 0
+        for project, ids in df.groupby("project", sort=False)["id"]:
+            project = int(project)
+            ids = np.unique(ids.to_numpy()).astype(int).tolist()
+            try:
+                control = self._label_control(project, from_name)
+            except (LabelStudioError, requests.RequestException) as e:
+                failed.append(LabelBatch(project, ids, error=str(e)))
+                continue
+            with self._labeled_lock:
+                # tasks being labeled by a concurrent request are skipped too
+                keys = {idx: (project, idx, control[0], label, as_annotations) for idx in ids}
+                todo = [idx for idx, key in keys.items() if key not in self._labeled]
+                self._labeled.update(keys[idx] for idx in todo)
+            skipped += len(ids) - len(todo)
+            for offset in range(0, len(todo), batch_size):
+                batches.append((project, todo[offset: offset + batch_size], label, control, as_annotations))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches) or 1)) as executor:
+            futures = [executor.submit(self._label_batch, *batch) for batch in batches]
+            for done, future in enumerate(as_completed(futures), start=1):
+                if progress is not None:
+                    progress(future.result(), done, len(futures))
+            results = [future.result() for future in futures]
+
+        skipped += sum(r.n_skipped for r in results)
+        result = LabelResult(
+            labeled=[r for r in results if r.ok], failed=failed + [r for r in results if not r.ok], skipped=skipped
+        )
+        for failure in result.failed:
+            logger.error(f"Labeling aborted for {len(failure.task_ids)} task(s) of project {failure.project}: "
+                         f"{failure.error}")
+        logger.info(f"Label {label}: {result.n_labeled} task(s) labeled, {skipped} skipped, "
+                    f"{len(result.failed)} batch(es) failed.")
+        return result
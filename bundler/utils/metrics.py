@@ -0,0 +1,265 @@
+import abc
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# buckets of durations, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# buckets of payload sizes, in bytes, from 1KB to 64MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    """A metric of the Prometheus text format, with one series per combination of label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        """
+        Args:
+            name (str): Name of the metric.
+            help (str): Description of the metric.
+            labelnames (Sequence[str]): Names of the labels, every observation sets all of them.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects the labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """The sample lines of the series of the metric, in the Prometheus text format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super(Counter, self).__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in values]
+
+
+class Histogram(Metric):
+    """Counts of observations falling in cumulative buckets, along with their sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Args:
+            name (str): Name of the metric.
+            help (str): Description of the metric.
+            labelnames (Sequence[str]): Names of the labels, every observation sets all of them.
+            buckets (Sequence[float]): Upper bounds of the buckets, a +Inf bucket is added.
+        """
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = np.array(sorted(buckets) + [math.inf])
+        # per series: the count of every bucket (not cumulative), and the sum of the observations
+        self._series: Dict[Tuple[str, ...], Tuple[np.ndarray, List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        bucket = int(np.searchsorted(self.buckets, value, side="left"))
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = (np.zeros(len(self.buckets), dtype=np.int64), [0.0])
+            counts, total = self._series[key]
+            counts[bucket] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes the duration of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return int(series[0].sum()) if series is not None else 0
+
+    def sum(self, **labels) -> float:
+        series = self._series.get(self._key(labels))
+        return series[1][0] if series is not None else 0.0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            series = sorted((key, (counts.copy(), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            for bound, cumulative in zip(self.buckets, np.cumsum(counts)):
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {int(counts.sum())}")
+        return lines
+
+
+class ProcessInfo(Metric):
+    """
+    Identifies the process answering a scrape.
+
+    Every process of a server keeps its own metrics, so that a scrape through the shared port returns the metrics of
+    whichever process accepted the connection; this metric tells them apart.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super(ProcessInfo, self).__init__(name, help, ["pid", "task"])
+
+    def samples(self) -> List[str]:
+        # the task id of a forked server process is only known once it runs
+        from tornado.process import task_id
+
+        task = task_id()
+        values = (str(os.getpid()), str(task) if task is not None else "0")
+        return [f"{self.name}{_format_labels(self.labelnames, values)} 1.0"]
+
+
+class Registry(object):
+    """The metrics exposed by a server."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All the metrics in the Prometheus text format (version 0.0.4)."""
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+PROCESS_INFO = REGISTRY.register(ProcessInfo(
+    "bundler_process_info", "The server process exposing these metrics, each process keeps its own."
+))
+CALLBACK_SECONDS = REGISTRY.register(Histogram(
+    "bundler_callback_seconds", "Duration of the session callbacks.", ["callback"]
+))
+SLOW_CALLBACKS = REGISTRY.register(Counter(
+    "bundler_slow_callbacks_total", "Session callbacks slower than the slow callback threshold.", ["callback"]
+))
+SOURCE_PUSH_BYTES = REGISTRY.register(Histogram(
+    "bundler_source_push_bytes", "Estimated serialized size of the data pushed to the browser.", ["source"],
+    buckets=SIZE_BUCKETS
+))
+DATASET_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "bundler_dataset_load_seconds", "Duration of the dataset loads.", ["kind"]
+))
+THUMBNAIL_ENCODE_SECONDS = REGISTRY.register(Histogram(
+    "bundler_thumbnail_encode_seconds", "Duration of the thumbnail encodings, cache hits excluded."
+))
+LS_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "bundler_label_studio_request_seconds", "Latency of the Label Studio requests.", ["endpoint"]
+))
+LS_REQUESTS = REGISTRY.register(Counter(
+    "bundler_label_studio_requests_total", "Label Studio requests by outcome, the HTTP status or 'error'.",
+    ["endpoint", "status"]
+))
+
+# callbacks slower than this many seconds are logged, None disables the log
+slow_callback_seconds: Optional[float] = None
+
+
+def set_slow_callback_threshold(seconds: Optional[float]) -> None:
+    """Logs a warning for every callback slower than `seconds`, None disables the log."""
+    global slow_callback_seconds
+    slow_callback_seconds = seconds
+
+
+def instrumented(fn: Callable) -> Callable:
+    """Decorates a session callback to observe its duration, and to log it when slower than the threshold."""
+    name = fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            CALLBACK_SECONDS.observe(elapsed, callback=name)
+            if slow_callback_seconds is not None and elapsed > slow_callback_seconds:
+                SLOW_CALLBACKS.inc(callback=name)
+                logger.warning(f"Slow callback {name}: {1000 * elapsed:.0f}ms")
+
+    return wrapper
+
+
+def payload_size(data: Dict[str, Any]) -> int:
+    """
+    Estimates the serialized size of columns pushed to a `ColumnDataSource`.
+
+    Numeric arrays are sent as binary buffers, other columns as JSON lists.
+    """
+    size = 0
+    for values in data.values():
+        if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+            size += values.nbytes
+        else:
+            size += len(json.dumps(list(values), default=str))
+    return size
+
+
+def observe_push(source: str, data: Dict[str, Any]) -> None:
+    """Observes the size of data pushed to the `source` data source of a session."""
+    SOURCE_PUSH_BYTES.observe(payload_size(data), source=source)
@@ -0,0 +1,238 @@
+import logging
+import os
+import pathlib
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# below this number of vectors, exact search is fast enough and no index is built
+BRUTE_FORCE_BELOW = 50_000
+
+# number of vectors scored at once
+SEARCH_BATCH_SIZE = 65_536
+
+# maximum number of selected points used as queries when expanding a selection
+MAX_QUERIES = 1000
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, best_scores: np.ndarray, best_rows: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Merges the (m, c) `scores` of candidate `rows` into the current (m, k) best candidates of m queries."""
+    k = best_scores.shape[1]
+    c = scores.shape[1]
+    if c > k:
+        # only the k best candidates of every query are mapped to their rows, not the whole (m, c) matrix
+        top = np.argpartition(scores, c - k, axis=1)[:, c - k:]
+        scores, rows = np.take_along_axis(scores, top, axis=1), rows[top]
+    else:
+        rows = np.broadcast_to(rows, scores.shape)
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    top = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    return np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+
+
+class NeighborIndex(object):
+    """
+    Approximate nearest neighbor index over memory-mapped embeddings.
+
+    Vectors are partitioned into `n_lists` clusters by a k-means trained on a sample (an inverted file index, IVF);
+    a query only scores the vectors of its `n_probe` closest clusters. Small collections are searched exactly. The
+    partition is saved next to the vectors, so that it is only computed once.
+    """
+
+    def __init__(self, vectors: np.ndarray, metric: str = "cosine", n_lists: Optional[int] = None, n_probe: int = 8,
+                 brute_force_below: int = BRUTE_FORCE_BELOW, seed: int = 0,
+                 path: Optional[Union[str, pathlib.Path]] = None):
+        """
+        Args:
+            vectors (np.ndarray): The (n, dim) vectors, typically memory-mapped, indexed by row position.
+            metric (str): Either "cosine" or "euclidean".
+            n_lists (Optional[int]): Number of clusters, defaults to the square root of the number of vectors.
+            n_probe (int): Number of clusters scanned by a query.
+            brute_force_below (int): Number of vectors under which the search is exact.
+            seed (int): Seed of the k-means.
+            path (Optional[Union[str, pathlib.Path]]): The file of the vectors, the index is saved next to it.
+        """
+        if metric not in ("cosine", "euclidean"):
+            raise ValueError(f"Unsupported metric '{metric}', expected 'cosine' or 'euclidean'.")
+        self.vectors = vectors
+        self.metric = metric
+        self.n_lists = n_lists or int(min(4096, max(1, np.sqrt(len(vectors)))))
+        self.n_probe = n_probe
+        self.brute_force_below = brute_force_below
+        self.seed = seed
+        self.index_path = pathlib.Path(f"{path}.ivf.npz") if path is not None else None
+
+        self.norms = np.concatenate([
+            np.linalg.norm(np.asarray(vectors[i:i + SEARCH_BATCH_SIZE], dtype=np.float32), axis=1)
+            for i in range(0, len(vectors), SEARCH_BATCH_SIZE)
+        ]) if len(vectors) else np.empty(0, dtype=np.float32)
+        self.norms[self.norms == 0] = 1.0
+        self.centroids: Optional[np.ndarray] = None
+        self.order: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path], **kwargs) -> "NeighborIndex":
+        """
+        Memory-maps vectors saved with `np.save` and builds (or loads) their index.
+
+        Args:
+            path (Union[str, pathlib.Path]): The .npy file of the vectors.
+            **kwargs: Arguments of `NeighborIndex`.
+
+        Returns:
+            NeighborIndex: The index.
+        """
+        index = cls(np.load(path, mmap_mode="r"), path=path, **kwargs)
+        index.build()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def is_exact(self) -> bool:
+        return len(self) < self.brute_force_below
+
+    def _scores(self, rows: Union[slice, np.ndarray], queries: np.ndarray) -> np.ndarray:
+        """(m, c) similarity of m queries (normalized for cosine) with the vectors at `rows`, higher is closer."""
+        X = np.asarray(self.vectors[rows], dtype=np.float32)
+        dots = queries @ X.T
+        if self.metric == "cosine":
+            return dots / self.norms[rows]
+        # the squared norm of the queries doesn't change their ranking
+        return 2 * dots - self.norms[rows] ** 2
+
+    def _centroid_scores(self, X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """(m, n_lists) similarity of m prepared vectors with the centroids, higher is closer."""
+        if self.metric == "cosine":
+            return X @ centroids.T
+        return 2 * X @ centroids.T - (centroids ** 2).sum(axis=1)
+
+    def _assign(self, X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Closest centroid of every vector."""
+        return np.argmax(self._centroid_scores(X, centroids), axis=1)
+
+    def _prepare(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(X, axis=1, keepdims=True)
+            X = X / np.where(norms == 0, 1.0, norms)
+        return X
+
+    def _is_stale(self) -> bool:
+        if self.index_path is None or not self.index_path.exists():
+            return True
+        vectors_path = self.index_path.with_name(self.index_path.name[:-len(".ivf.npz")])
+        if vectors_path.exists() and os.path.getmtime(vectors_path) > os.path.getmtime(self.index_path):
+            return True
+        with np.load(self.index_path) as saved:
+            if saved["order"].shape[0] != len(self) or str(saved["metric"]) != self.metric:
+                return True
+            self.centroids, self.order, self.offsets = saved["centroids"], saved["order"], saved["offsets"]
+        return False
+
+    def build(self, n_iter: int = 10, sample_size: int = 256) -> None:
+        """
+        Partitions the vectors, unless they are few enough to be searched exactly or a saved index exists.
+
+        Args:
+            n_iter (int): Number of k-means iterations.
+            sample_size (int): Number of training vectors per cluster.
+        """
+        if self.is_exact or not self._is_stale():
+            return
+        rng = np.random.default_rng(self.seed)
+        size = min(len(self), self.n_lists * sample_size)
+        sample = self._prepare(self.vectors[np.sort(rng.choice(len(self), size=size, replace=False))])
+        logger.info(f"Training {self.n_lists} clusters on {size} vectors")
+
+        centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=self.n_lists)
+            # empty clusters keep their centroid
+            filled = counts > 0
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+            centroids[filled] = np.add.reduceat(sample[order], starts, axis=0) / counts[filled, None]
+            if self.metric == "cosine":
+                centroids = self._prepare(centroids)
+
+        logger.info(f"Assigning {len(self)} vectors to their cluster")
+        assignment = np.concatenate([
+            self._assign(self._prepare(self.vectors[i:i + SEARCH_BATCH_SIZE]), centroids)
+            for i in range(0, len(self), SEARCH_BATCH_SIZE)
+        ])
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))])
+        if self.index_path is not None:
+            tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp.npz")
+            np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets, metric=self.metric)
+            os.replace(tmp, self.index_path)
+
+    def search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """
+        Finds the approximate nearest neighbors of queries.
+
+        Args:
+            queries (np.ndarray): The (m, dim) query vectors.
+            k (int): Number of neighbors per query.
+
+        Returns:
+            np.ndarray: The (m, k) row positions of the neighbors, closest first, -1 where fewer were found.
+        """
+        queries = self._prepare(np.atleast_2d(queries))
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if self.is_exact or self.centroids is None:
+            for start in range(0, len(self), SEARCH_BATCH_SIZE):
+                rows = np.arange(start, min(start + SEARCH_BATCH_SIZE, len(self)))
+                best_scores, best_rows = _top_k(self._scores(rows, queries), rows, best_scores, best_rows)
+        else:
+            probes = np.argpartition(
+                -self._centroid_scores(queries, self.centroids), min(self.n_probe, self.n_lists) - 1, axis=1
+            )
+            probes = probes[:, :self.n_probe]
+            # every cluster is scanned once, for all the queries probing it, its rows are sorted (see `build`)
+            for cluster in np.unique(probes):
+                rows = self.order[self.offsets[cluster]:self.offsets[cluster + 1]]
+                if len(rows) == 0:
+                    continue
+                qs = np.flatnonzero((probes == cluster).any(axis=1))
+                best_scores[qs], best_rows[qs] = _top_k(
+                    self._scores(rows, queries[qs]), rows, best_scores[qs], best_rows[qs]
+                )
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1)
+
+    def expand(self, indices: np.ndarray, k: int, max_queries: int = MAX_QUERIES, seed: int = 0) -> np.ndarray:
+        """
+        Expands a selection with the nearest neighbors of its points.
+
+        Args:
+            indices (np.ndarray): The row positions of the selection.
+            k (int): Number of neighbors added per selected point.
+            max_queries (int): Maximum number of selected points whose neighbors are searched, larger selections
+                are sampled.
+            seed (int): Seed of the sample.
+
+        Returns:
+            np.ndarray: The sorted row positions of the selection and of its neighbors.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0 or k <= 0:
+            return np.unique(indices)
+        queries = indices
+        if len(queries) > max_queries:
+            queries = np.sort(np.random.default_rng(seed).choice(indices, size=max_queries, replace=False))
+        # the closest neighbor of a point is usually itself
+        neighbors = self.search(np.asarray(self.vectors[queries]), k + 1)
+        return np.union1d(indices, neighbors[neighbors >= 0])
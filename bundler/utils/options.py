@@ -0,0 +1,20 @@
+from enum import Enum
+
+
+class ThumbnailFormat(str, Enum):
+    """Output format of the thumbnails."""
+    jpeg = "jpeg"
+    webp = "webp"
+
+
+class ThumbnailMode(str, Enum):
+    """How thumbnails are produced for the data table."""
+    eager = "eager"  # every image is encoded before the document is built
+    lazy = "lazy"  # images are encoded when their row reaches the data table
+    http = "http"  # images are served by the server and the table only references their URL
+
+
+class BundleKind(str, Enum):
+    """The command serving a prepared bundle."""
+    text = "text"
+    image = "image"
@@ -0,0 +1,95 @@
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from bokeh.models import ColumnDataSource
+
+from bundler.utils.metrics import observe_push
+
+
+class Pager(object):
+    """
+    Server-side pagination over row positions.
+
+    Only the rows of the current page (or of the current random sample) are ever materialized and sent to the
+    browser, so the cost of a table update is bounded by the page size rather than by the selection size.
+    """
+
+    def __init__(self, page_size: int = 20, seed: Optional[int] = None):
+        """
+        Args:
+            page_size (int): Number of rows per page.
+            seed (Optional[int]): Seed of the random generator used to sample rows.
+        """
+        self.page_size = page_size
+        self.indices = np.array([], dtype=int)
+        self.page = 0
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, indices: np.ndarray) -> None:
+        """Paginates over new row positions, starting from the first page."""
+        self.indices = np.asarray(indices, dtype=int)
+        self.page = 0
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @property
+    def n_pages(self) -> int:
+        return max(1, -(-len(self.indices) // self.page_size))
+
+    def set_page_size(self, page_size: int) -> None:
+        """Changes the page size, keeping the first row of the current page visible."""
+        first_row = self.page * self.page_size
+        self.page_size = page_size
+        self.page = first_row // page_size
+
+    def next(self) -> None:
+        self.page = min(self.page + 1, self.n_pages - 1)
+
+    def prev(self) -> None:
+        self.page = max(self.page - 1, 0)
+
+    def current(self) -> np.ndarray:
+        """Row positions of the current page."""
+        start = self.page * self.page_size
+        return self.indices[start:start + self.page_size]
+
+    def sample(self) -> np.ndarray:
+        """Row positions of a random sample of `page_size` rows, drawn without shuffling the whole selection."""
+        size = min(self.page_size, len(self.indices))
+        return self.indices[np.sort(self.rng.choice(len(self.indices), size=size, replace=False))]
+
+    def describe(self, sampled: bool = False) -> str:
+        """Human readable position of the current page."""
+        n = len(self.indices)
+        if n == 0:
+            return "No rows"
+        if sampled:
+            return f"{min(self.page_size, n)} random rows out of {n}"
+        start = self.page * self.page_size
+        return f"Rows {start + 1}-{min(start + self.page_size, n)} of {n} (page {self.page + 1}/{self.n_pages})"
+
+
+def _same_values(a: Any, b: Any) -> bool:
+    # missing values compare equal, unlike with np.array_equal on object arrays
+    return len(a) == len(b) and pd.Series(np.asarray(a, dtype=object)).equals(pd.Series(np.asarray(b, dtype=object)))
+
+
+def update_source(source: ColumnDataSource, data: Dict[str, Any], name: str = "table") -> None:
+    """
+    Replaces the data of a `ColumnDataSource`, unless it is unchanged.
+
+    The data is always replaced as a whole rather than patched: a new page changes every column anyway, and patches
+    are serialized as JSON, which can't hold the NaN of missing values.
+
+    Args:
+        source (ColumnDataSource): The source to update.
+        data (Dict[str, Any]): The new columns.
+        name (str): Name of the source in the metrics of the pushed payloads.
+    """
+    current = source.data
+    if set(current.keys()) == set(data.keys()) and all(_same_values(current[c], v) for c, v in data.items()):
+        return
+    source.data = data
+    observe_push(name, data)
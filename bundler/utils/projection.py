@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import pathlib
+import pickle
+import shutil
+from typing import List, Optional, Union
+
+import numpy as np
+
+from bundler.utils.embeddings import KEY_SIZE, EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+REDUCER_FILE = "reducer.pkl"
+
+# number of rows projected at once by `Projection.transform`
+TRANSFORM_BATCH_SIZE = 100_000
+
+
+def vector_keys(X: np.ndarray) -> List[bytes]:
+    """Content hashes of the rows of a matrix, used to find the rows already projected."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return [hashlib.blake2b(row.tobytes(), digest_size=KEY_SIZE).digest() for row in X]
+
+
+class Projection(object):
+    """
+    2D projection of embeddings, fitted once and persisted so that the layout stays stable across refreshes.
+
+    The fitted reducer is pickled in the projection directory, and the coordinates of every projected embedding
+    are cached by content hash: rows projected by a previous run keep their exact coordinates, only new embeddings
+    are projected, out-of-sample, with the reducer's `transform`.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path]):
+        """
+        Args:
+            directory (Union[str, pathlib.Path]): Directory of the projection, loaded if it exists.
+        """
+        self.directory = pathlib.Path(directory)
+        self.reducer = None
+        if (self.directory / REDUCER_FILE).exists():
+            with open(self.directory / REDUCER_FILE, "rb") as reader:
+                self.reducer = pickle.load(reader)
+            self.coordinates = EmbeddingCache(self.directory, "coordinates")
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.reducer is not None
+
+    def fit(self, X: np.ndarray, sample_size: Optional[int] = None, seed: int = 0, **umap_kwargs) -> None:
+        """
+        Fits a new UMAP projection, replacing the previous one.
+
+        Args:
+            X (np.ndarray): The (n, dim) embeddings, may be memory-mapped.
+            sample_size (Optional[int]): Number of random rows to fit the projection on, the other rows are projected
+                out-of-sample. Defaults to None, which fits on every row.
+            seed (int): Seed of the sample.
+            **umap_kwargs: Arguments of `umap.UMAP`.
+        """
+        from umap import UMAP
+
+        indices = np.arange(len(X))
+        if sample_size is not None and sample_size < len(X):
+            indices = np.sort(np.random.default_rng(seed).choice(len(X), size=sample_size, replace=False))
+        sample = np.asarray(X[indices], dtype=np.float32)
+        logger.info(f"Fitting the projection on {len(sample)} out of {len(X)} rows")
+        self.reducer = UMAP(**umap_kwargs)
+        coordinates = self.reducer.fit_transform(sample)
+
+        # the coordinates of the previous projection are discarded along with it
+        shutil.rmtree(self.directory / "coordinates", ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / REDUCER_FILE, "wb") as writer:
+            pickle.dump(self.reducer, writer)
+        self.coordinates = EmbeddingCache(self.directory, "coordinates")
+        self.coordinates.get_or_compute(vector_keys(sample), lambda missing: coordinates[missing])
+
+    def transform(self, X: np.ndarray, batch_size: int = TRANSFORM_BATCH_SIZE) -> np.ndarray:
+        """
+        Projects embeddings, reusing the coordinates of the embeddings already projected.
+
+        Args:
+            X (np.ndarray): The (n, dim) embeddings, may be memory-mapped.
+            batch_size (int): Number of rows projected at once.
+
+        Returns:
+            np.ndarray: The (n, 2) coordinates.
+        """
+        if not self.is_fitted:
+            raise ValueError(f"No projection fitted in {self.directory}.")
+        coordinates, n_new = [], 0
+        for offset in range(0, len(X), batch_size):
+            batch = np.asarray(X[offset: offset + batch_size], dtype=np.float32)
+
+            def project(missing: np.ndarray) -> np.ndarray:
+                nonlocal n_new
+                n_new += len(missing)
+                return self.reducer.transform(batch[missing])
+
+            coordinates.append(self.coordinates.get_or_compute(vector_keys(batch), project))
+        logger.info(f"Projected {n_new} new row(s) out of {len(X)}")
+        return np.concatenate(coordinates) if coordinates else np.empty((0, 2), dtype=np.float32)
@@ -0,0 +1,341 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from bokeh.layouts import column, row
+from bokeh.events import RangesUpdate, SelectionGeometry
+from bokeh.models import BoxSelectTool, Button, ColorBar, ColumnDataSource, DataTable, Div, LassoSelectTool, \
+    MultiChoice, RadioButtonGroup, Range1d, RangeSlider, Select, Spinner, TableColumn, TextInput
+from bokeh.plotting import figure
+
+from bundler.utils.dataset import Dataset
+from bundler.utils.lod import density_image, select_geometry, visible_mask
+from bundler.utils.metrics import instrumented, observe_push
+from bundler.utils.pagination import Pager, update_source
+
+# the Label Studio client is created on the first upload, so that datasets can be explored without credentials
+_ls_client = None
+_ls_client_lock = threading.Lock()
+
+# tabs are uploaded off the IOLoop, so that an upload doesn't freeze the sessions of the server
+upload_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ls-upload")
+
+PAGE_SIZES = [20, 50, 100, 200, 500]
+
+
+def get_ls_client():
+    """Returns the `LabelStudioClient` shared by every session, created from the environment on first use."""
+    global _ls_client
+    with _ls_client_lock:
+        if _ls_client is None:
+            from bundler.utils.ls_client import LabelStudioClient
+            _ls_client = LabelStudioClient()
+    return _ls_client
+
+
+class Session(object):
+    """
+    State and widgets of a single browser session.
+
+    The dataset is shared with every other session of the server; a session only keeps its own selection and
+    label filter, and pushes the rows it displays to its data table one page at a time.
+    """
+
+    def __init__(self, dataset: Dataset, columns: List[TableColumn], table_kwargs: Optional[Dict[str, Any]] = None,
+                 plot_size: int = 600, page_size: int = 20, lod_threshold: Optional[int] = None):
+        """
+        Args:
+            dataset (Dataset): The shared dataset.
+            columns (List[TableColumn]): Columns of the data table.
+            table_kwargs (Optional[Dict[str, Any]]): Extra arguments of the `DataTable`.
+            plot_size (int): Width and height of the scatter plot, in pixels.
+            page_size (int): Initial number of rows displayed in the data table.
+            lod_threshold (Optional[int]): Maximum number of points drawn as glyphs. Past it, the scatter plot shows
+                a density image of the viewport and only switches to glyphs once zoomed in on fewer points.
+                Defaults to None, which always draws every point.
+        """
+        self.dataset = dataset
+        self.plot_size = plot_size
+        self.lod_threshold = lod_threshold
+        self.is_lod = lod_threshold is not None and len(dataset) > lod_threshold
+
+        # Indices of the selected/highlighted data points
+        self.highlighted_idx = np.array([], dtype=int)
+
+        self.source = ColumnDataSource(data=dict())
+        if self.is_lod:
+            # level of detail: the glyphs only hold the visible points when zoomed in, see `render_lod`
+            self.source_orig = ColumnDataSource(data=self._plot_rows(np.array([], dtype=int)))
+            self.lod_source = ColumnDataSource(data={"image": [], "x": [], "y": [], "dw": [], "dh": []})
+        else:
+            self.source_orig = ColumnDataSource(data=dataset.plot_data)
+
+        self.data_table = DataTable(source=self.source, columns=columns, **(table_kwargs or {}))
+
+        # before any selection, the table lets the user browse the whole dataset
+        self.pager = Pager(page_size=page_size)
+        self.pager.reset(np.arange(len(dataset)))
+        self.page_mode = RadioButtonGroup(labels=["Pages", "Random sample"], active=0)
+        self.page_mode.on_change("active", lambda attr, old, new: self.refresh())
+        self.page_size = Select(
+            title="Rows per page", value=str(page_size),
+            options=[str(size) for size in sorted(set(PAGE_SIZES + [page_size]))]
+        )
+        self.page_size.on_change("value", self.update_on_page_size)
+        prev_btn = Button(label="◀ Previous")
+        prev_btn.on_click(self.prev_page)
+        next_btn = Button(label="Next ▶")
+        next_btn.on_click(self.next_page)
+        self.page_info = Div()
+        pagination = column(row(self.page_mode, self.page_size), row(prev_btn, next_btn, self.page_info))
+        self.refresh()
+
+        p = figure(
+            title="",
+            sizing_mode="scale_both",
+            tools=["lasso_select", "box_select", "pan", "box_zoom", "wheel_zoom", "reset"]
+        )
+        p.toolbar.active_drag = None
+        p.toolbar.active_inspect = None
+        if self.is_lod:
+            x_range, y_range = self._data_bounds()
+            p.x_range, p.y_range = Range1d(*x_range), Range1d(*y_range)
+            p.image_rgba(image="image", x="x", y="y", dw="dw", dh="dh", source=self.lod_source)
+
+        circle_kwargs = {
+            "x": "x",
+            "y": "y",
+            "size": 1,
+            "source": self.source_orig
+        }
+        mapper = dataset.color_mapper()
+        if mapper is not None:
+            circle_kwargs.update({"color": mapper})
+            color_bar = ColorBar(color_mapper=mapper["transform"], width=8, **self.dataset.color_bar_kwargs())
+            p.add_layout(color_bar, "right")
+
+        scatter = p.circle(**circle_kwargs)
+        p.plot_width = plot_size
+        p.plot_height = plot_size
+
+        if self.is_lod:
+            # selections are resolved on the server against every point, drawn or not
+            for tool in p.select({"type": (LassoSelectTool, BoxSelectTool)}):
+                tool.renderers = [scatter]
+            p.on_event(SelectionGeometry, self.update_on_geometry)
+            p.on_event(RangesUpdate, lambda event: self.render_lod((event.x0, event.x1), (event.y0, event.y1)))
+            self.render_lod(x_range, y_range)
+        else:
+            scatter.data_source.selected.on_change("indices", self.update)
+
+        self.tab_name = TextInput(value="", title="Tab name:")
+        self.tab_btn = Button(label="Create tab")
+        self.tab_btn.on_click(self.save)
+
+        self.label_input = TextInput(value="", title="Label:")
+        self.label_mode = RadioButtonGroup(labels=["Predictions", "Annotations"], active=0)
+        self.label_btn = Button(label="Label selection")
+        self.label_btn.on_click(self.label_selection)
+
+        self.upload_buttons = [self.tab_btn, self.label_btn]
+        self.upload_status = Div()
+        self.upload: Optional[Future] = None
+
+        self.label_filter_widget = None
+        if dataset.mapper is not None:
+            # adding filtering widget if 'color' column exists
+            if dataset.is_label_float:
+                min_val, max_val = dataset.label_range
+                self.label_filter_widget = RangeSlider(title="label filters", start=min_val, end=max_val,
+                                                       value=(min_val, max_val), step=0.01)
+            else:
+                self.label_filter_widget = MultiChoice(title="label filters", options=dataset.label_options)
+
+            self.label_filter_widget.on_change("value", self.update_on_label_filter)
+            controls = column(p, self.tab_name, self.label_filter_widget, self.tab_btn)
+        else:
+            controls = column(p, self.tab_name, self.tab_btn)
+        controls.children.extend([self.label_input, self.label_mode, self.label_btn, self.upload_status])
+
+        if dataset.neighbors is not None:
+            self.n_neighbors = Spinner(title="Neighbors per point", low=1, high=100, step=1, value=10)
+            expand_btn = Button(label="Expand selection")
+            expand_btn.on_click(self.expand_selection)
+            controls.children.extend([self.n_neighbors, expand_btn])
+
+        self.layout = row(controls, column(pagination, self.data_table))
+
+    def _plot_rows(self, indices: np.ndarray) -> Dict[str, np.ndarray]:
+        return {c: values[indices] for c, values in self.dataset.plot_data.items()}
+
+    def _data_bounds(self):
+        """Ranges covering every point, with a small margin."""
+        bounds = []
+        for c in ("x", "y"):
+            low, high = np.nanmin(self.dataset.plot_data[c]), np.nanmax(self.dataset.plot_data[c])
+            margin = 0.05 * ((high - low) or 1.0)
+            bounds.append((float(low - margin), float(high + margin)))
+        return bounds
+
+    @instrumented
+    def render_lod(self, x_range, y_range) -> None:
+        """Draws the viewport as a density image, or as glyphs once few enough points are visible."""
+        if None in (*x_range, *y_range):
+            return
+        x, y = self.dataset.plot_data["x"], self.dataset.plot_data["y"]
+        visible = np.flatnonzero(visible_mask(x, y, x_range, y_range))
+        if len(visible) <= self.lod_threshold:
+            self.source_orig.data = self._plot_rows(visible)
+            observe_push("points", self.source_orig.data)
+            self.lod_source.data = {"image": [], "x": [], "y": [], "dw": [], "dh": []}
+        else:
+            size = max(self.plot_size // 2, 1)
+            image = density_image(x, y, self.dataset.point_colors, x_range, y_range, size, size)
+            self.lod_source.data = {
+                "image": [image], "x": [x_range[0]], "y": [y_range[0]],
+                "dw": [x_range[1] - x_range[0]], "dh": [y_range[1] - y_range[0]]
+            }
+            observe_push("density", {"image": image})
+            if len(self.source_orig.data["x"]):
+                self.source_orig.data = self._plot_rows(np.array([], dtype=int))
+
+    @instrumented
+    def update_on_geometry(self, event):
+        """Callback used for plot update when lasso or box selecting in level of detail mode"""
+        if not event.final:
+            return
+        x, y = self.dataset.plot_data["x"], self.dataset.plot_data["y"]
+        self.update("indices", None, select_geometry(x, y, event.geometry))
+
+    @property
+    def label_values(self) -> Optional[List]:
+        """Current value of the label filter, None if there is no 'color' column."""
+        return self.label_filter_widget.value if self.label_filter_widget is not None else None
+
+    @property
+    def is_sampling(self) -> bool:
+        return self.page_mode.active == 1
+
+    def refresh(self) -> None:
+        """Pushes the current page, or a new random sample, to the data table."""
+        indices = self.pager.sample() if self.is_sampling else self.pager.current()
+        update_source(self.source, self.dataset.rows(indices))
+        self.page_info.text = self.pager.describe(sampled=self.is_sampling)
+
+    def show(self, indices: Optional[np.ndarray]) -> None:
+        """Paginates over the rows at `indices` (every row if None) that pass the label filter."""
+        self.pager.reset(self.dataset.filter(indices, self.label_values))
+        self.refresh()
+
+    @instrumented
+    def next_page(self):
+        """Callback used to display the next page, or another random sample"""
+        if not self.is_sampling:
+            self.pager.next()
+        self.refresh()
+
+    @instrumented
+    def prev_page(self):
+        """Callback used to display the previous page"""
+        if not self.is_sampling:
+            self.pager.prev()
+        self.refresh()
+
+    @instrumented
+    def update_on_page_size(self, attr, old, new):
+        """Callback used for table update when changing the number of rows per page"""
+        self.pager.set_page_size(int(new))
+        self.refresh()
+
+    @instrumented
+    def update(self, attr, old, new):
+        """Callback used for plot update when lasso selecting"""
+        self.highlighted_idx = np.asarray(new, dtype=int)
+        self.show(self.highlighted_idx)
+
+    @instrumented
+    def expand_selection(self):
+        """Callback used to add the nearest neighbors of the selected points to the selection"""
+        expanded = self.dataset.neighbors.expand(self.highlighted_idx, int(self.n_neighbors.value))
+        if self.is_lod:
+            self.update("indices", None, expanded)
+        else:
+            # goes through `update`, and shows the new selection on the plot
+            self.source_orig.selected.indices = expanded.tolist()
+
+    @instrumented
+    def update_on_label_filter(self, attr, old, new):
+        """Callback used for plot update when changing label filter"""
+        # without a selection, the filter applies to the whole dataset being browsed
+        self.show(self.highlighted_idx if len(self.highlighted_idx) else None)
+
+    @instrumented
+    def save(self):
+        """Callback used to save highlighted data points"""
+        indices = self.dataset.filter(self.highlighted_idx, self.label_values)
+        name = self.tab_name.value
+        client = self.ls_client()
+        if client is not None:
+            self.submit(f"Creating tab '{name}'", partial(client.create_tab, self.dataset.tasks(indices), name))
+
+    @instrumented
+    def label_selection(self):
+        """Callback used to label highlighted data points in Label Studio"""
+        label = self.label_input.value.strip()
+        if not label:
+            self.upload_status.text = "Enter a label first"
+            return
+        indices = self.dataset.filter(self.highlighted_idx, self.label_values)
+        as_annotations = self.label_mode.active == 1
+        client = self.ls_client()
+        if client is not None:
+            self.submit(f"Labeling {len(indices)} task(s) as '{label}'",
+                        partial(client.label_tasks, self.dataset.tasks(indices), label, as_annotations=as_annotations))
+
+    def ls_client(self):
+        """The shared Label Studio client, or None, with the error displayed, if it can't be created."""
+        from bundler.utils.ls_client import LabelStudioAuthenticationError, LabelStudioError
+
+        try:
+            return get_ls_client()
+        except (LabelStudioAuthenticationError, LabelStudioError) as e:
+            self.upload_status.text = f"Label Studio is not configured: {e}"
+            return None
+
+    def submit(self, description: str, job: Callable[..., Any]) -> None:
+        """
+        Runs a Label Studio upload in the background, its progress is pushed back to the document on the next ticks.
+
+        The upload buttons are disabled until it is done, so that a session runs a single upload at a time.
+        """
+        if self.upload is not None and not self.upload.done():
+            # a click sent by the browser before it received the disabled buttons
+            return
+        doc = self.layout.document
+        for btn in self.upload_buttons:
+            btn.disabled = True
+        self.upload_status.text = f"{description}..."
+
+        def progress(item: Any, done: int, total: int):
+            doc.add_next_tick_callback(partial(self.on_upload_progress, description, done, total))
+
+        self.upload = upload_executor.submit(job, progress=progress)
+        self.upload.add_done_callback(lambda future: doc.add_next_tick_callback(
+            partial(self.on_upload_done, description, future)))
+
+    def on_upload_progress(self, description: str, done: int, total: int) -> None:
+        if self.upload is not None and not self.upload.done():
+            self.upload_status.text = f"{description}: {done}/{total} request(s) done"
+
+    def on_upload_done(self, description: str, future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            self.upload_status.text = f"{description} failed: {e}"
+        else:
+            self.upload_status.text = f"{description}: {result.summary}"
+
+        for btn in self.upload_buttons:
+            btn.disabled = False
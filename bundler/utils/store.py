@@ -0,0 +1,188 @@
+import json
+import os
+import pathlib
+import shutil
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+STORE_VERSION = 1
+
+Column = Union[np.ndarray, pd.Categorical, "StringColumn"]
+
+
+class StringColumn(object):
+    """
+    Strings stored as their concatenated UTF-8 bytes and the offsets of every string.
+
+    Both arrays are memory-mapped, so that processes mapping the same files share a single copy of the strings in
+    the page cache. Strings are only decoded when accessed.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, valid: Optional[np.ndarray] = None):
+        """
+        Args:
+            data (np.ndarray): The uint8 bytes of all the strings.
+            offsets (np.ndarray): The n + 1 int64 offsets, string i is data[offsets[i]:offsets[i + 1]].
+            valid (Optional[np.ndarray]): Boolean mask of the non missing values, None if none is missing.
+        """
+        self.data = data
+        self.offsets = offsets
+        self.valid = valid
+
+    @classmethod
+    def write(cls, values: Iterable, path: pathlib.Path) -> None:
+        """Writes values (converted to strings, missing values being None or NaN) to `<path>.*` files."""
+        values = pd.Series(list(values) if not isinstance(values, (pd.Series, np.ndarray)) else values, dtype=object)
+        valid = values.notna().to_numpy()
+        encoded = [str(v).encode("utf8") if ok else b"" for v, ok in zip(values, valid)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        with open(f"{path}.data", "wb") as f:
+            for b in encoded:
+                f.write(b)
+        np.save(f"{path}.offsets.npy", offsets)
+        if not valid.all():
+            np.save(f"{path}.valid.npy", valid)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "StringColumn":
+        offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+        data = np.memmap(f"{path}.data", dtype=np.uint8, mode="r") if offsets[-1] else np.empty(0, dtype=np.uint8)
+        valid = np.load(f"{path}.valid.npy", mmap_mode="r") if os.path.exists(f"{path}.valid.npy") else None
+        return cls(data, offsets, valid)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if self.valid is not None and not self.valid[i]:
+            return None
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices: Sequence[int]) -> np.ndarray:
+        """Decodes the strings at `indices` into an object array, missing values are NaN."""
+        values = np.empty(len(indices), dtype=object)
+        for j, i in enumerate(np.asarray(indices, dtype=np.int64)):
+            value = self[i]
+            values[j] = np.nan if value is None else value
+        return values
+
+
+class ColumnStore(object):
+    """
+    Read-only columns of a table, indexed by row position.
+
+    Columns either live in memory (`from_frame`) or are memory-mapped from a directory (`load`), numeric columns
+    as .npy files, categorical columns as their codes and categories, and the other columns as `StringColumn`.
+    """
+
+    def __init__(self, columns: Dict[str, Column], n_rows: int, directory: Optional[pathlib.Path] = None):
+        self.columns = columns
+        self.n_rows = n_rows
+        # the directory the columns are memory-mapped from, None when they live in memory
+        self.directory = directory
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ColumnStore":
+        columns = {}
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                columns[name] = series.array
+            else:
+                columns[name] = series.to_numpy()
+        return cls(columns, len(df))
+
+    def save(self, directory: Union[str, pathlib.Path]) -> None:
+        """
+        Writes the columns to a directory, atomically: the directory only appears once complete.
+
+        Args:
+            directory (Union[str, pathlib.Path]): The destination, replaced if it exists.
+        """
+        directory = pathlib.Path(directory)
+        tmp = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        manifest = {"version": STORE_VERSION, "n_rows": self.n_rows, "columns": []}
+        for i, (name, values) in enumerate(self.columns.items()):
+            path = tmp / f"{i}"
+            if isinstance(values, pd.Categorical):
+                np.save(f"{path}.codes.npy", values.codes)
+                kind, extra = "category", {"categories": [str(c) for c in values.categories]}
+            elif isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+                np.save(f"{path}.npy", values)
+                kind, extra = "numeric", {}
+            else:
+                StringColumn.write(values, path)
+                kind, extra = "string", {}
+            manifest["columns"].append({"name": name, "file": path.name, "kind": kind, **extra})
+        with open(tmp / MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory: Union[str, pathlib.Path]) -> "ColumnStore":
+        """Memory-maps the columns saved in a directory."""
+        directory = pathlib.Path(directory)
+        with open(directory / MANIFEST_FILE, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported column store version in {directory}.")
+
+        columns = {}
+        for column in manifest["columns"]:
+            path = directory / column["file"]
+            if column["kind"] == "category":
+                codes = np.load(f"{path}.codes.npy", mmap_mode="r")
+                columns[column["name"]] = pd.Categorical.from_codes(codes, categories=column["categories"])
+            elif column["kind"] == "numeric":
+                columns[column["name"]] = np.load(f"{path}.npy", mmap_mode="r")
+            else:
+                columns[column["name"]] = StringColumn.load(path)
+        return cls(columns, manifest["n_rows"], directory=directory)
+
+    @staticmethod
+    def exists(directory: Union[str, pathlib.Path]) -> bool:
+        return (pathlib.Path(directory) / MANIFEST_FILE).exists()
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+    def column(self, name: str) -> Column:
+        return self.columns[name]
+
+    def series(self, name: str) -> pd.Series:
+        """A column as a Series, strings are decoded."""
+        values = self.columns[name]
+        if isinstance(values, StringColumn):
+            values = values.take(np.arange(len(values)))
+        return pd.Series(values, name=name, copy=False)
+
+    def take(self, name: str, indices: Sequence[int]) -> np.ndarray:
+        """The values of a column at `indices`."""
+        values = self.columns[name]
+        if isinstance(values, StringColumn):
+            return values.take(indices)
+        return np.asarray(values[np.asarray(indices, dtype=np.int64)])
+
+    def frame(self, indices: Sequence[int], names: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """The rows at `indices` as a DataFrame, restricted to the columns `names` (that exist) if given."""
+        names = self.names if names is None else [n for n in names if n in self.columns]
+        return pd.DataFrame({name: self.take(name, indices) for name in names})
@@ -0,0 +1,185 @@
+import json
+import pathlib
+from typing import Iterable, Iterator, List, Optional, Union
+
+import pandas as pd
+
+# file extension -> table format
+TABLE_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+}
+
+JSONL_CHUNKSIZE = 100_000
+
+# columns used by the apps themselves: coordinates, color and Label Studio identifiers
+APP_COLUMNS = ["x", "y", "color", "id", "project"]
+
+
+def table_format(path: Union[str, pathlib.Path]) -> str:
+    """
+    Detects the format of a table from its file extension.
+
+    Args:
+        path (Union[str, pathlib.Path]): The path of the table.
+
+    Returns:
+        str: One of "csv", "parquet", "feather" or "jsonl".
+    """
+    suffix = pathlib.Path(path).suffix.lower()
+    try:
+        return TABLE_FORMATS[suffix]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported file extension '{suffix}', expected one of: {', '.join(sorted(TABLE_FORMATS))}."
+        )
+
+
+def table_columns(path: Union[str, pathlib.Path]) -> List[str]:
+    """
+    Lists the columns of a table without loading its content.
+
+    The records of a JSON Lines file may have different keys, only those of the first one are listed.
+
+    Args:
+        path (Union[str, pathlib.Path]): The path of the table.
+
+    Returns:
+        List[str]: The column names.
+    """
+    fmt = table_format(path)
+    if fmt == "csv":
+        return list(pd.read_csv(path, nrows=0).columns)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    if fmt == "feather":
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            return list(reader.schema.names)
+    with open(path, "r") as reader:
+        return list(json.loads(reader.readline() or "{}"))
+
+
+def app_columns(displayed: Optional[Iterable[str]], *extra: str) -> Optional[List[str]]:
+    """
+    Lists the columns an app needs to load.
+
+    Args:
+        displayed (Optional[Iterable[str]]): Columns displayed in the data table, None to display all of them.
+        *extra (str): Additional columns required by the app, e.g. 'path' for images.
+
+    Returns:
+        Optional[List[str]]: The columns to load, or None to load every column.
+    """
+    if not displayed:
+        return None
+    return list(dict.fromkeys([*APP_COLUMNS, *extra, *displayed]))
+
+
+def read_table(path: Union[str, pathlib.Path], columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Reads a CSV, Parquet, Feather/Arrow IPC or JSON Lines file into a DataFrame.
+
+    Args:
+        path (Union[str, pathlib.Path]): The path of the table, its format is inferred from the extension.
+        columns (Optional[Iterable[str]]): Columns to load. Columns missing from the file are ignored so that
+            optional columns (e.g. 'color') can always be requested. Defaults to None, which loads every column.
+
+    Returns:
+        pd.DataFrame: The loaded table.
+    """
+    fmt = table_format(path)
+    wanted = list(dict.fromkeys(columns)) if columns is not None else None
+
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=(lambda c: c in wanted) if wanted is not None else None)
+
+    if fmt in ("parquet", "feather"):
+        if wanted is not None:
+            available = set(table_columns(path))
+            wanted = [c for c in wanted if c in available]
+        return pd.read_parquet(path, columns=wanted) if fmt == "parquet" else pd.read_feather(path, columns=wanted)
+
+    # JSON lines can't be projected while parsing, read it by chunks to only keep the wanted columns in memory. Its
+    # records may have different keys: a chunk misses the columns none of its records has, and the columns no record
+    # of the file has are dropped
+    chunks, found = [], set()
+    for chunk in pd.read_json(path, lines=True, chunksize=JSONL_CHUNKSIZE):
+        found.update(chunk.columns)
+        chunks.append(chunk if wanted is None else chunk.reindex(columns=wanted))
+    if wanted is not None:
+        wanted = [c for c in wanted if c in found]
+        chunks = [chunk[wanted] for chunk in chunks]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=wanted)
+
+
+def iter_table(path: Union[str, pathlib.Path], columns: Optional[Iterable[str]] = None,
+               chunksize: int = JSONL_CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV, Parquet, Feather/Arrow IPC or JSON Lines file by chunks, without loading it entirely.
+
+    Args:
+        path (Union[str, pathlib.Path]): The path of the table, its format is inferred from the extension.
+        columns (Optional[Iterable[str]]): Columns to load, missing columns are ignored as in `read_table`, but for
+            JSON Lines, whose chunks all have every wanted column.
+        chunksize (int): Number of rows of every chunk (but the last one).
+
+    Yields:
+        pd.DataFrame: The successive chunks of the table.
+    """
+    fmt = table_format(path)
+    wanted = list(dict.fromkeys(columns)) if columns is not None else None
+
+    if fmt == "csv":
+        yield from pd.read_csv(path, usecols=(lambda c: c in wanted) if wanted is not None else None,
+                               chunksize=chunksize)
+        return
+
+    if wanted is not None and fmt != "jsonl":
+        available = set(table_columns(path))
+        wanted = [c for c in wanted if c in available]
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=wanted):
+            yield batch.to_pandas()
+    elif fmt == "feather":
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        # the file is memory-mapped, only the sliced rows are materialized
+        with pa.memory_map(str(path)) as source:
+            table = ipc.open_file(source).read_all()
+            if wanted is not None:
+                table = table.select(wanted)
+            for offset in range(0, table.num_rows, chunksize):
+                yield table.slice(offset, chunksize).to_pandas()
+    else:
+        # the keys of the later records are unknown, every chunk has all the wanted columns, NaN where missing
+        for chunk in pd.read_json(path, lines=True, chunksize=chunksize):
+            yield chunk if wanted is None else chunk.reindex(columns=wanted)
+
+
+def write_table(df: pd.DataFrame, path: Union[str, pathlib.Path]) -> None:
+    """
+    Writes a DataFrame to a CSV, Parquet, Feather/Arrow IPC or JSON Lines file.
+
+    Args:
+        df (pd.DataFrame): The table to write.
+        path (Union[str, pathlib.Path]): The destination, its format is inferred from the extension.
+    """
+    fmt = table_format(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    elif fmt == "feather":
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_json(path, orient="records", lines=True)
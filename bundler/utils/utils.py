@@ -1,70 +1,95 @@
 import base64
 import io
 import logging
-from typing import Tuple, Optional, List
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, NamedTuple, Tuple, Optional, List, Sequence, Union
 
 import bokeh.transform
 import numpy as np
 import pandas as pd
 from PIL import Image
 from bokeh.palettes import Magma256, magma
-from bokeh.transform import linear_cmap, factor_cmap
+from bokeh.models import FixedTicker
+from bokeh.transform import linear_cmap
 from tqdm import tqdm
 
+from bundler.utils.cache import ThumbnailCache, thumbnail_key
+from bundler.utils.metrics import THUMBNAIL_ENCODE_SECONDS
+from bundler.utils.options import ThumbnailFormat  # noqa: F401, re-exported
+from bundler.utils.tables import read_table
+
 logger = logging.getLogger(__name__)
 
+IMG_TEMPLATE = '<img style="object-fit: scale-down;" width="100%" height="100%" src="{src}">'
+PLACEHOLDER_PNG = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/wYAAtMBwVI8FXgAAAAASUVORK5CYII="
+PLACEHOLDER_SRC = f"data:image/png;base64,{PLACEHOLDER_PNG}"
 
-def label_filter(df: pd.DataFrame, values: List[float], is_label_float: bool):
-    """
-    Filters a DataFrame based on a color label, using either a range or a set of discrete values.
+# number of images sent to an encoding worker at once, smaller batches are encoded in the calling process
+ENCODE_CHUNKSIZE = 64
 
-    Args:
-        df (pd.DataFrame): The DataFrame to filter.
-        values (List[float]): A list containing either two float values defining the range to filter by
-                              if `is_label_float` is True, or a list of discrete values to filter by if
-                              `is_label_float` is False.
-        is_label_float (bool): A flag indicating whether the label is a float (True) to filter using a range
-                               or not (False) to filter using discrete values.
 
-    Returns:
-        pd.DataFrame: A filtered DataFrame where the 'color' column values satisfy the specified conditions.
+class ThumbnailSpec(NamedTuple):
     """
+    Encoding parameters of the thumbnails.
 
-    if is_label_float:
-        min_val, max_val = values
-        return df[(df["color"] > min_val) & (df["color"] < max_val)]
-    else:
-        return df[df["color"].isin(values)]
+    Attributes:
+        size (Optional[int]): Bounding box, in pixels, the thumbnails are shrunk to. None keeps the full resolution.
+        format (str): PIL output format, either "JPEG" or "WEBP".
+        quality (int): Output quality, from 1 to 100.
+    """
+    size: Optional[int] = 200
+    format: str = "JPEG"
+    quality: int = 10
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format.lower()}"
+
+
+DEFAULT_THUMBNAIL = ThumbnailSpec()
 
 
 def get_color_mapping(df: pd.DataFrame) -> Tuple[Optional[bokeh.transform.transform], pd.DataFrame]:
     """
     Determines the appropriate color mapping for a DataFrame column and generates a color mapper.
 
+    Categorical labels are turned into a `pd.Categorical` of strings, and the mapper expects their integer codes
+    (see `get_color_codes`) rather than the strings themselves. This keeps the payload of the scatter plot to a
+    compact integer array, missing labels (code -1) being drawn in grey.
+
     Args:
         df (pd.DataFrame): The DataFrame containing the 'color' column that needs a color mapping.
 
     Returns:
         Tuple[Optional[bokeh.transform.transform], pd.DataFrame]: A tuple where the first element is a color
-            mapper (either a factor_cmap for categorical data or a linear_cmap for numerical data, or None if the
-            'color' column is missing) and the second element is the DataFrame with potentially modified 'color'
-            column to ensure compatibility with the color mapper.
+            mapper (a linear_cmap over the category codes for categorical data or over the values for numerical
+            data, or None if the 'color' column is missing) and the second element is the DataFrame with
+            potentially modified 'color' column to ensure compatibility with the color mapper.
     """
 
     if "color" not in df.columns:
         return None, df
 
     color_datatype = str(df["color"].dtype)
-    if color_datatype == "object":
-        df["color"] = df["color"].apply(
-            lambda x: str(x) if not (type(x) == float and np.isnan(x)) else x
-        )
-        all_values = list(df["color"].dropna().unique())
-        palette = magma(len(all_values))
-        mapper = factor_cmap(
+    if color_datatype in ("object", "category"):
+        # factorizing first means only the unique values are converted to strings; values with the same string
+        # representation (e.g. 1 and "1") are merged by the second factorization
+        codes, uniques = pd.factorize(df["color"])
+        label_codes, factors = pd.factorize(pd.Index([str(u) for u in uniques], dtype=object))
+        if len(uniques):
+            codes = np.where(codes >= 0, label_codes[codes], -1)
+        df["color"] = pd.Categorical.from_codes(codes, categories=factors)
+
+        n_factors = max(len(factors), 1)
+        mapper = linear_cmap(
             field_name="color",
-            palette=palette,
-            factors=all_values,
+            palette=magma(n_factors),
+            low=-0.5,
+            high=n_factors - 0.5,
+            low_color="grey",
             nan_color="grey"
         )
     elif color_datatype.startswith("float") or color_datatype.startswith("int"):
@@ -84,18 +109,54 @@ def get_color_mapping(df: pd.DataFrame) -> Tuple[Optional[bokeh.transform.transf
     return mapper, df
 
 
-def get_datatable_columns(df: pd.DataFrame) -> List[str]:
+def get_color_codes(color: pd.Series) -> np.ndarray:
+    """
+    Returns the values fed to the color mapper of `get_color_mapping`.
+
+    Args:
+        color (pd.Series): The 'color' column processed by `get_color_mapping`.
+
+    Returns:
+        np.ndarray: The int32 category codes (-1 for missing labels) of categorical labels, or the float32 values
+            of numerical labels.
+    """
+    if isinstance(color.dtype, pd.CategoricalDtype):
+        return np.ascontiguousarray(color.cat.codes.to_numpy(), dtype=np.int32)
+    return np.ascontiguousarray(color.to_numpy(), dtype=np.float32)
+
+
+def get_color_bar_kwargs(color: pd.Series) -> dict:
+    """
+    Returns the ticks of the color bar of categorical labels, so that the codes are displayed as their label.
+
+    Args:
+        color (pd.Series): The 'color' column processed by `get_color_mapping`.
+
+    Returns:
+        dict: Keyword arguments for `bokeh.models.ColorBar`, empty for numerical labels.
+    """
+    if not isinstance(color.dtype, pd.CategoricalDtype):
+        return {}
+    factors = list(color.cat.categories)
+    return {
+        "ticker": FixedTicker(ticks=list(range(len(factors)))),
+        "major_label_overrides": {i: str(f) for i, f in enumerate(factors)},
+    }
+
+
+def get_datatable_columns(df: Union[pd.DataFrame, Iterable[str]]) -> List[str]:
     """
     Generates a list of DataFrame column names filtered to exclude certain columns.
 
     Args:
-        df (pd.DataFrame): The DataFrame from which to filter out specific columns.
+        df (Union[pd.DataFrame, Iterable[str]]): The DataFrame, or its column names, from which to filter out
+            specific columns.
 
     Returns:
         List[str]: A list of column names
     """
 
-    columns = df.columns
+    columns = df.columns if isinstance(df, pd.DataFrame) else df
     filtered_columns = []
     for c in columns:
         if c in ["x", "y", "path"] or c.startswith("Unnamed"):
@@ -104,54 +165,219 @@ def get_datatable_columns(df: pd.DataFrame) -> List[str]:
     return filtered_columns
 
 
-def encode_image(path: str) -> str:
+def make_thumbnail(path: str, cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> bytes:
+    """
+    Re-encodes an image file into a lightweight thumbnail.
+
+    JPEG sources are decoded at a reduced scale (see `PIL.Image.Image.draft`) when the thumbnail is smaller than
+    the image, which is much faster than decoding the full resolution and resizing it afterwards.
+
+    Args:
+        path (str): The file system path of the image.
+        cache (Optional[ThumbnailCache]): Cache to read the thumbnail from, or to store it into on a miss.
+        spec (ThumbnailSpec): Size, format and quality of the thumbnail.
+
+    Returns:
+        bytes: The encoded thumbnail.
+    """
+    key = cache.key(path, **spec._asdict()) if cache is not None else None
+    if key is not None:
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    with THUMBNAIL_ENCODE_SECONDS.time(), open(path, "rb") as image_file:
+        img = Image.open(image_file)
+        if spec.size:
+            if img.format == "JPEG":
+                img.draft("RGB", (spec.size, spec.size))
+            img.thumbnail((spec.size, spec.size))
+        if spec.format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format=spec.format, quality=spec.quality)
+    data = buffer.getvalue()
+
+    if key is not None:
+        cache.put(key, data)
+    return data
+
+
+def make_thumbnail_etag(path: str, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Optional[str]:
+    """Returns the ETag of the thumbnail of `path`, or None if the file cannot be found."""
+    return thumbnail_key(path, **spec._asdict())
+
+
+def encode_image(path: str, cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> str:
     """
     Encodes an image from a file or a URL into an HTML image tag with Base64 encoding.
 
     Args:
         path (str): The file system path or URL of the image to encode.
+        cache (Optional[ThumbnailCache]): Thumbnail cache used to avoid re-encoding unchanged images.
+        spec (ThumbnailSpec): Size, format and quality of the thumbnail.
 
     Returns:
         str: An HTML image tag as a string with the image content encoded in Base64 if the path points to a
-             file system resource, or an image tag with a URL source if the path is an HTTP URL.
+             file system resource, or an image tag with a URL source if the path is an HTTP URL. Images that
+             cannot be read are replaced by a placeholder.
     """
 
     if type(path) == str and path.startswith("http"):
-        return f'<img style="object-fit: scale-down;" width="100%" height="100%" src="{path}">'
+        return IMG_TEMPLATE.format(src=path)
     else:
         try:
-            with open(path, "rb") as image_file:
-                img = Image.open(image_file)
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=10)
-                enc_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            return f'<img style="object-fit: scale-down;" width="100%" height="100%" src="data:image/jpeg;base64,{enc_str}">'
+            enc_str = base64.b64encode(make_thumbnail(path, cache=cache, spec=spec)).decode("utf-8")
+            return IMG_TEMPLATE.format(src=f"data:{spec.mime_type};base64,{enc_str}")
         except FileNotFoundError:
             logger.error(f"Could not find image {path}")
-            return f'<img style="object-fit: scale-down;" width="100%" height="100%" src="data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/wYAAtMBwVI8FXgAAAAASUVORK5CYII=">'
+            return IMG_TEMPLATE.format(src=PLACEHOLDER_SRC)
+        except Exception as e:
+            # a single corrupted/unsupported file must not abort the whole encoding run
+            logger.error(f"Could not encode image {path}: {e}")
+            return IMG_TEMPLATE.format(src=PLACEHOLDER_SRC)
+
+
+def _encode_image_in_worker(path: str, cache: Optional[ThumbnailCache] = None,
+                            spec: ThumbnailSpec = DEFAULT_THUMBNAIL) -> Tuple[str, Optional[float]]:
+    """
+    Runs `encode_image` in a worker process of `encode_images`, and returns its encoding time (None on a cache hit).
+
+    Metrics observed by a worker process never reach the /metrics endpoint, the calling process observes the
+    returned time instead. Workers encode one image at a time, so the difference of their histogram is this image's.
+    """
+    count, total = THUMBNAIL_ENCODE_SECONDS.count(), THUMBNAIL_ENCODE_SECONDS.sum()
+    tag = encode_image(path, cache=cache, spec=spec)
+    if THUMBNAIL_ENCODE_SECONDS.count() == count:
+        return tag, None
+    return tag, THUMBNAIL_ENCODE_SECONDS.sum() - total
+
+
+def encode_images(paths: Sequence[str], workers: int = 1, chunksize: int = ENCODE_CHUNKSIZE,
+                  cache: Optional[ThumbnailCache] = None, spec: ThumbnailSpec = DEFAULT_THUMBNAIL,
+                  executor: Optional[Executor] = None, prune: bool = True) -> List[str]:
+    """
+    Encodes a sequence of images, optionally spreading the work over a pool of processes.
+
+    Args:
+        paths (Sequence[str]): The file system paths or URLs of the images to encode.
+        workers (int, optional): Number of worker processes. Values lower or equal to 1 encode in the current
+            process. Defaults to 1.
+        chunksize (int, optional): Number of images sent to a worker at once. Defaults to 64.
+        cache (Optional[ThumbnailCache]): Thumbnail cache shared by all the workers. Defaults to None.
+        spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+        executor (Optional[Executor]): A long-lived pool of `workers` processes to encode with, instead of a pool
+            started for this call. Defaults to None.
+        prune (bool): Whether to prune the cache once the images are encoded. Defaults to True.
+
+    Returns:
+        List[str]: The HTML image tags, in the same order as `paths`.
+    """
+    if workers <= 1 or len(paths) <= chunksize:
+        encode = partial(encode_image, cache=cache, spec=spec)
+        encoded = [encode(p) for p in tqdm(paths, total=len(paths), desc="Encoding Images")]
+    else:
+        encode = partial(_encode_image_in_worker, cache=cache, spec=spec)
+        encoded = []
+        with ProcessPoolExecutor(max_workers=workers) if executor is None else nullcontext(executor) as pool:
+            # `map` yields results in submission order, so rows stay aligned with the DataFrame
+            for tag, seconds in tqdm(
+                pool.map(encode, paths, chunksize=chunksize),
+                total=len(paths),
+                desc=f"Encoding Images ({workers} workers)"
+            ):
+                if seconds is not None:
+                    THUMBNAIL_ENCODE_SECONDS.observe(seconds)
+                encoded.append(tag)
+
+    if cache is not None and prune:
+        cache.prune()
+    return encoded
+
+
+class LazyThumbnails(object):
+    """
+    Memoizing thumbnail encoder used to only encode the images that are actually displayed.
+
+    The tags of the most recently displayed images are remembered by path, so paging back and forth doesn't encode
+    them again; older ones are read back from the on-disk cache. An instance can be shared by every session of a
+    server: its process pool is started on the first large batch and kept for the next ones, and the cache is pruned
+    in the background rather than on every page.
+    """
+
+    def __init__(self, workers: int = 1, cache: Optional[ThumbnailCache] = None,
+                 spec: ThumbnailSpec = DEFAULT_THUMBNAIL, max_entries: int = 4096):
+        """
+        Args:
+            workers (int): Number of processes used to encode a batch of missing thumbnails.
+            cache (Optional[ThumbnailCache]): On-disk thumbnail cache.
+            spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+            max_entries (int): Number of encoded tags kept in memory.
+        """
+        self.workers = workers
+        self.cache = cache
+        self.spec = spec
+        self.max_entries = max_entries
+        self._encoded: "OrderedDict[str, str]" = OrderedDict()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers > 1 and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def take(self, paths: Sequence[str]) -> List[str]:
+        """
+        Returns the encoded thumbnails of `paths`, encoding the ones that were never requested before.
+
+        Args:
+            paths (Sequence[str]): The file system paths or URLs of the images.
+
+        Returns:
+            List[str]: The HTML image tags, in the same order as `paths`.
+        """
+        paths = list(paths)
+        encoded = {p: self._encoded[p] for p in dict.fromkeys(paths) if p in self._encoded}
+        missing = [p for p in dict.fromkeys(paths) if p not in encoded]
+        if missing:
+            executor = self._pool() if len(missing) > ENCODE_CHUNKSIZE else None
+            encoded.update(zip(missing, encode_images(
+                missing, workers=self.workers, cache=self.cache, spec=self.spec, executor=executor, prune=False
+            )))
+            if self.cache is not None:
+                self.cache.prune_later()
+        for p, tag in encoded.items():
+            self._encoded[p] = tag
+            self._encoded.move_to_end(p)
+        while len(self._encoded) > self.max_entries:
+            self._encoded.popitem(last=False)
+        return [encoded[p] for p in paths]
 
 
-def read_file(path: str, do_encoding: bool = True) \
+def read_file(path: str, do_encoding: bool = True, workers: int = 1, cache: Optional[ThumbnailCache] = None,
+              spec: ThumbnailSpec = DEFAULT_THUMBNAIL, columns: Optional[Iterable[str]] = None) \
         -> Tuple[bokeh.transform.transform, pd.DataFrame]:
     """
-    Reads a CSV file into a DataFrame, assigns a color mapping, and conditionally encodes related images.
+    Reads a table into a DataFrame, assigns a color mapping, and conditionally encodes related images.
 
     Args:
-        path (str): The file path to the CSV file to be read.
+        path (str): The file path to the table to be read, see `bundler.utils.tables.read_table` for the
+            supported formats.
         do_encoding (bool, optional): Whether to encode associated images into the DataFrame. Defaults to True.
+        workers (int, optional): Number of processes used to encode the images. Defaults to 1.
+        cache (Optional[ThumbnailCache]): Thumbnail cache used to skip unchanged images. Defaults to None.
+        spec (ThumbnailSpec): Size, format and quality of the thumbnails.
+        columns (Optional[Iterable[str]]): Columns to load, defaults to None which loads every column.
 
     Returns:
         Tuple[bokeh.transform.transform, pd.DataFrame]: A tuple where the first element is a color mapper generated
-            by get_color_mapping, and the second element is the DataFrame with the CSV data and optionally with an
+            by get_color_mapping, and the second element is the DataFrame with the table data and optionally with an
             additional 'image' column containing encoded image tags.
     """
-    df = pd.read_csv(path)
+    df = read_table(path, columns=columns)
     mapper, df = get_color_mapping(df)
 
     if do_encoding:
-        thumbnail_paths = []
-        for p in tqdm(df["path"], total=len(df["path"]), desc="Encoding Images"):
-            thumbnail_paths.append(encode_image(p))
-        df["image"] = thumbnail_paths
+        df["image"] = encode_images(df["path"].tolist(), workers=workers, cache=cache, spec=spec)
 
     return mapper, df
@@ -1,41 +1,187 @@
 import argparse
+import importlib
+import json
+import logging
+import os
+import pathlib
+from typing import Any, Dict, List, Optional
 
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-from umap import UMAP
+import numpy as np
+from tqdm import tqdm
+
+from bundler.utils.bundle import file_checksum
+from bundler.utils.cache import DEFAULT_CACHE_DIR
+from bundler.utils.embeddings import EmbeddingCache, EmbeddingStore
+from bundler.utils.projection import Projection
+from bundler.utils.tables import iter_table, read_table, write_table
+
+logger = logging.getLogger(__name__)
 
 
 def parse_args():
     """"""
     parser = argparse.ArgumentParser()
     parser.add_argument("--model-name", type=str, default="paraphrase-MiniLM-L6-v2")
-    parser.add_argument("--input-file", type=str)
-    parser.add_argument("--output-file", type=str)
+    parser.add_argument("--input-file", type=str, help="Input table (.csv, .parquet, .feather/.arrow or .jsonl)")
+    parser.add_argument("--output-file", type=str, help="Output table, its format is inferred from the extension")
+    parser.add_argument("--embeddings-file", type=str, default=None,
+                        help="Appendable .npy file storing the embeddings, an interrupted run resumes from it. "
+                             "Defaults to the output file with a .npy extension")
+    parser.add_argument("--restart", action="store_true", help="Discard the embeddings computed by a previous run")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Number of rows read and checkpointed at once")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of sentences encoded at once")
+    parser.add_argument("--encoder", type=str, default=None,
+                        help="Encoder factory as 'module:attr', called with the model name and returning an object "
+                             "with an `encode(sentences, batch_size)` method. Defaults to sentence-transformers")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR / "embeddings"),
+                        help="Directory of the embedding cache, shared by the runs of a model")
+    parser.add_argument("--no-cache", action="store_true", help="Embed every row without using the cache")
+    parser.add_argument("--projection-dir", type=str, default=None,
+                        help="Directory of the persisted 2D projection, reused by later runs to keep the layout "
+                             "stable. Defaults to the output file with a .projection extension")
+    parser.add_argument("--refit", action="store_true", help="Fit a new projection instead of reusing the saved one")
+    parser.add_argument("--fit-sample-size", type=int, default=None,
+                        help="Number of random rows the projection is fitted on, the others are projected")
     return parser.parse_args()
 
 
-def run(args):
-    # Load the universal sentence encoder
-    model = SentenceTransformer(args["model_name"])
+def load_encoder(spec: Optional[str], model_name: str):
+    """
+    Loads the sentence encoder.
+
+    Args:
+        spec (Optional[str]): An encoder factory as 'module:attr', None for a `SentenceTransformer`.
+        model_name (str): The model name, passed to the factory.
+
+    Returns:
+        An object with an `encode(sentences, batch_size)` method returning a (n, dim) array.
+    """
+    if spec is None:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)(model_name)
+
+
+class LazyEncoder(object):
+    """Loads the encoder on its first use, so that runs fully served by the cache don't load the model."""
+
+    def __init__(self, spec: Optional[str], model_name: str):
+        self.spec = spec
+        self.model_name = model_name
+        self._encoder = None
+
+    def encode(self, sentences: List[str], batch_size: int) -> np.ndarray:
+        if self._encoder is None:
+            self._encoder = load_encoder(self.spec, self.model_name)
+        return self._encoder.encode(sentences, batch_size=batch_size)
+
+
+def source_file(store: EmbeddingStore) -> pathlib.Path:
+    """The file recording the input the embeddings of a store are computed from, e.g. embeddings.npy.source.json."""
+    return store.path.with_name(store.path.name + ".source.json")
+
+
+def source_record(input_file: str) -> Dict[str, Any]:
+    """The size and checksum of an input table."""
+    return {"size": os.path.getsize(input_file), "checksum": file_checksum(input_file)}
 
-    # Load original dataset
-    df = pd.read_csv(args["input_file"])
-    sentences = df["text"]
+
+def is_resumable(store: EmbeddingStore, input_file: str) -> bool:
+    """
+    Whether the rows of a store were embedded from the current content of the input.
+
+    The input is read to compare its checksum, modification times being unreliable (e.g. copied files). Stores without
+    a record of their input can't be resumed.
+    """
+    try:
+        recorded = json.loads(source_file(store).read_text())
+    except FileNotFoundError:
+        return False
+    return os.path.getsize(input_file) == recorded["size"] and file_checksum(input_file) == recorded["checksum"]
+
+
+def embed(input_file: str, store: EmbeddingStore, encoder, chunk_size: int, batch_size: int,
+          cache: Optional[EmbeddingCache] = None) -> None:
+    """
+    Encodes the 'text' column of a table chunk by chunk, appending the embeddings to a store.
+
+    The rows already in the store are skipped, so that an interrupted run resumes from its last checkpoint. A store
+    computed from another version of the input is emptied first, the rows that didn't change being then found in the
+    cache.
+
+    Args:
+        input_file (str): The input table.
+        store (EmbeddingStore): The store receiving the embeddings, one row per input row.
+        encoder: The sentence encoder, see `load_encoder`.
+        chunk_size (int): Number of rows read, encoded and checkpointed at once.
+        batch_size (int): Number of sentences encoded at once.
+        cache (Optional[EmbeddingCache]): Cache of the embeddings of the model, only the sentences missing from it
+            are encoded.
+    """
+    if len(store) and not is_resumable(store, input_file):
+        logger.info(f"{input_file} changed since {store.path} was computed, starting over")
+        store.truncate(0)
+    if not len(store):
+        store.path.parent.mkdir(parents=True, exist_ok=True)
+        source_file(store).write_text(json.dumps(source_record(input_file)))
+
+    done, seen = len(store), 0
+    if done:
+        logger.info(f"Resuming from row {done}")
+    with tqdm(desc="Encoding", unit="rows", initial=done) as progress:
+        for chunk in iter_table(input_file, columns=["text"], chunksize=chunk_size):
+            start, seen = seen, seen + len(chunk)
+            if seen <= done:
+                continue
+            sentences = chunk["text"].iloc[max(done - start, 0):].fillna("").astype(str).tolist()
+            if cache is None:
+                embeddings = encoder.encode(sentences, batch_size=batch_size)
+            else:
+                embeddings = cache.get_or_compute(
+                    [cache.key(s) for s in sentences],
+                    lambda missing: np.asarray(encoder.encode([sentences[i] for i in missing], batch_size=batch_size))
+                )
+            store.append(np.asarray(embeddings))
+            progress.update(len(sentences))
+    if len(store) != seen:
+        raise ValueError(f"{store.path} holds {len(store)} embeddings but {input_file} has {seen} rows, "
+                         f"run again with --restart.")
+
+
+def project(X: np.ndarray, args) -> np.ndarray:
+    """Projects the embeddings in 2D, with the saved projection unless there is none or a refit is requested"""
+    projection = Projection(args["projection_dir"] or pathlib.Path(args["output_file"]).with_suffix(".projection"))
+    if args["refit"] or not projection.is_fitted:
+        projection.fit(X, sample_size=args["fit_sample_size"])
+    return projection.transform(X)
+
+
+def run(args):
+    embeddings_file = pathlib.Path(args["embeddings_file"] or pathlib.Path(args["output_file"]).with_suffix(".npy"))
+    if args["restart"] and embeddings_file.exists():
+        embeddings_file.unlink()
+    store = EmbeddingStore(embeddings_file)
 
     # Calculate embeddings
-    X = model.encode(sentences)
+    # a custom encoder doesn't share the embeddings of the default one
+    cache_name = args["model_name"] if args["encoder"] is None else f"{args['encoder']}:{args['model_name']}"
+    cache = None if args["no_cache"] else EmbeddingCache(args["cache_dir"], cache_name)
+    encoder = LazyEncoder(args["encoder"], args["model_name"])
+    embed(args["input_file"], store, encoder, args["chunk_size"], args["batch_size"], cache=cache)
 
-    # Reduce the dimensions with UMAP
-    umap = UMAP()
-    X_tfm = umap.fit_transform(X)
+    # Reduce the dimensions with UMAP, the embeddings are memory-mapped
+    X_tfm = project(store.load(), args)
 
     # Apply coordinates
+    df = read_table(args["input_file"])
     df["x"] = X_tfm[:, 0]
     df["y"] = X_tfm[:, 1]
 
-    df.to_csv(args["output_file"], index=False)
+    write_table(df, args["output_file"])
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     args = parse_args()
     run(vars(args))
@@ -1,83 +1,306 @@
+import abc
 import argparse
 import json
+import logging
+import pathlib
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
 import numpy as np
 import pandas as pd
-import torch
 from tqdm import tqdm
-from transformers import LukeTokenizer, LukeModel
-from typing import Dict, List
-from umap import UMAP
 
-model_name = "studio-ousia/luke-base"
-tokenizer = LukeTokenizer.from_pretrained(model_name)
-model = LukeModel.from_pretrained(model_name)
-model.eval()
+from bundler.utils.cache import DEFAULT_CACHE_DIR
+from bundler.utils.embeddings import EmbeddingCache
+from bundler.utils.projection import Projection
+from bundler.utils.tables import write_table
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "studio-ousia/luke-base"
+
+# entity vocabulary of the tiny random model, the pretrained one holds 500k entities; larger entity ids are clamped
+TINY_ENTITY_VOCAB_SIZE = 256
+
+Spans = List[Tuple[int, int]]
 
 
 def parse_args():
     """"""
     parser = argparse.ArgumentParser()
     parser.add_argument("--input-file", type=str)
-    parser.add_argument("--output-file", type=str)
+    parser.add_argument("--output-file", type=str, help="Output table (.csv, .parquet, .feather/.arrow or .jsonl)")
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=16, help="Number of tasks per forward pass")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes tokenizing the tasks")
+    parser.add_argument("--errors-file", type=str, default=None,
+                        help="JSON report of the tasks that could not be embedded, defaults to the output file with "
+                             "a .errors.json extension")
+    parser.add_argument("--tiny-random-model", action="store_true",
+                        help="Use a tiny randomly initialized model, e.g. to test or benchmark the pipeline. The "
+                             "tokenizer of --model-name is still used")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR / "embeddings"),
+                        help="Directory of the embedding cache, shared by the runs of a model")
+    parser.add_argument("--no-cache", action="store_true", help="Embed every task without using the cache")
+    parser.add_argument("--embeddings-file", type=str, default=None,
+                        help="Save the entity embeddings to this .npy file, e.g. for `bundler text --vectors`")
+    parser.add_argument("--projection-dir", type=str, default=None,
+                        help="Directory of the persisted 2D projection, reused by later runs to keep the layout "
+                             "stable. Defaults to the output file with a .projection extension")
+    parser.add_argument("--refit", action="store_true", help="Fit a new projection instead of reusing the saved one")
+    parser.add_argument("--fit-sample-size", type=int, default=None,
+                        help="Number of random rows the projection is fitted on, the others are projected")
     return parser.parse_args()
 
 
-def get_entities_embeddings(task: Dict) -> List[Dict]:
-    """Retrieves entity embedding"""
+class EntityEmbedder(abc.ABC):
+    """Embeds the entity spans of texts."""
+
+    @abc.abstractmethod
+    def embed(self, texts: List[str], spans: List[Spans]) -> Tuple[List[Optional[np.ndarray]], Dict[int, str]]:
+        """
+        Args:
+            texts (List[str]): The texts.
+            spans (List[Spans]): The (start, end) character spans of the entities of every text.
+
+        Returns:
+            Tuple[List[Optional[np.ndarray]], Dict[int, str]]: A (n_entities, dim) array per text, None for the texts
+                that could not be embedded, and the error of each of these texts, indexed by position.
+        """
+
+
+# tokenizer of the tokenization worker processes
+_tokenizer = None
+
+
+def _init_tokenizer(model_name: str) -> None:
+    global _tokenizer
+    from transformers import LukeTokenizer
+    _tokenizer = LukeTokenizer.from_pretrained(model_name)
+
+
+def _tokenize(item: Tuple[str, Spans]):
+    text, spans = item
+    try:
+        return _tokenizer(text, entity_spans=spans, add_prefix_space=True)
+    except Exception as e:
+        return e
+
+
+class LukeEmbedder(EntityEmbedder):
+    """
+    Embeds entities with the last hidden states of their span in a `LukeModel`.
+
+    Texts are tokenized by a pool of processes, sorted by length, and packed by batches of similar lengths so that
+    every forward pass processes many texts with little padding.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = 16, workers: int = 1,
+                 random_init: bool = False):
+        """
+        Args:
+            model_name (str): Name of the pretrained model, its tokenizer is always used.
+            batch_size (int): Number of texts per forward pass.
+            workers (int): Number of processes tokenizing the texts, 1 tokenizes them in the main process.
+            random_init (bool): Whether to use a tiny randomly initialized model rather than the pretrained one.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = workers
+        self.random_init = random_init
+        self._model = None
+
+    @property
+    def model(self):
+        """The model, loaded on first use."""
+        if self._model is None:
+            from transformers import LukeConfig, LukeModel
+            if self.random_init:
+                tokenizer = self.tokenizer
+                config = LukeConfig(
+                    vocab_size=len(tokenizer), entity_vocab_size=TINY_ENTITY_VOCAB_SIZE, hidden_size=32,
+                    entity_emb_size=16, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64
+                )
+                self._model = LukeModel(config)
+            else:
+                self._model = LukeModel.from_pretrained(self.model_name)
+            self._model.eval()
+        return self._model
+
+    @property
+    def tokenizer(self):
+        """The tokenizer of the main process, loaded on first use."""
+        if _tokenizer is None:
+            _init_tokenizer(self.model_name)
+        return _tokenizer
+
+    def _tokenize_all(self, texts: List[str], spans: List[Spans]) -> list:
+        items = list(zip(texts, spans))
+        if self.workers <= 1:
+            if _tokenizer is None:
+                _init_tokenizer(self.model_name)
+            return [_tokenize(item) for item in tqdm(items, desc="Tokenizing")]
+        with Pool(self.workers, initializer=_init_tokenizer, initargs=(self.model_name,)) as pool:
+            return list(tqdm(pool.imap(_tokenize, items, chunksize=64), total=len(items), desc="Tokenizing"))
+
+    def _forward(self, encodings: list) -> List[np.ndarray]:
+        import torch
+        batch = self.tokenizer.pad(encodings, padding=True, return_tensors="pt")
+        if self.random_init:
+            batch["entity_ids"] = batch["entity_ids"].clamp(max=TINY_ENTITY_VOCAB_SIZE - 1)
+        with torch.no_grad():
+            hidden = self.model(**batch).entity_last_hidden_state.numpy()
+        # entity spans are padded to the largest number of entities of the batch
+        return [hidden[i, :len(encoding["entity_ids"])] for i, encoding in enumerate(encodings)]
+
+    def embed(self, texts: List[str], spans: List[Spans]) -> Tuple[List[Optional[np.ndarray]], Dict[int, str]]:
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        errors: Dict[int, str] = {}
+
+        encodings = self._tokenize_all(texts, spans)
+        for i, encoding in enumerate(encodings):
+            if isinstance(encoding, Exception):
+                errors[i] = f"tokenization failed: {encoding}"
+
+        # length bucketing: batches hold texts of similar lengths
+        order = sorted((i for i in range(len(texts)) if i not in errors), key=lambda i: len(encodings[i]["input_ids"]))
+        for offset in tqdm(range(0, len(order), self.batch_size), desc="Embedding"):
+            batch = order[offset: offset + self.batch_size]
+            try:
+                for i, embedding in zip(batch, self._forward([encodings[i] for i in batch])):
+                    embeddings[i] = embedding
+            except Exception:
+                # isolate the failing texts so that they don't take the rest of the batch down
+                for i in batch:
+                    try:
+                        embeddings[i] = self._forward([encodings[i]])[0]
+                    except Exception as e:
+                        errors[i] = f"forward pass failed: {e}"
+        return embeddings, errors
+
+
+def get_entities(task: Dict) -> Tuple[str, Spans, List[Dict]]:
+    """Retrieves the text, entity spans and entity metadata of a task"""
     # This part is designed to handle span annotation from Label Studio.
     # However, it can be changed according to your data structure.
     text = task["data"]["text"]
     annotations = task["annotations"][0]["result"]
 
-    entity_spans = []
+    spans, entities = [], []
     for entity in annotations:
-        entity_spans.append((entity["value"]["start"], entity["value"]["end"]))
-
-    if len(entity_spans) == 0:
-        return []
-
-    # Tokenizing and feeding the model
-    encoding = tokenizer(text, entity_spans=entity_spans, add_prefix_space=True, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(**encoding)
-    entity_last_hidden_state = outputs.entity_last_hidden_state
-    entity_last_hidden_state = entity_last_hidden_state.squeeze(0).tolist()
-
-    embeddings = []
-    for entity, embed in zip(annotations, entity_last_hidden_state):
-        embeddings.append({
-            "embedding": embed,
+        spans.append((entity["value"]["start"], entity["value"]["end"]))
+        entities.append({
             "color": entity["value"]["labels"][0],
             "text": entity["value"]["text"],
             "entity_id": entity["id"],
             "sample_id": task["id"]
         })
-    return embeddings
+    return text, spans, entities
+
+
+def get_entities_embeddings(tasks: List[Dict], embedder: EntityEmbedder,
+                            cache: Optional[EmbeddingCache] = None) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Embeds the annotated entities of Label Studio tasks.
+
+    Args:
+        tasks (List[Dict]): The exported Label Studio tasks.
+        embedder (EntityEmbedder): The entity embedder.
+        cache (Optional[EmbeddingCache]): Cache of the entity embeddings, keyed by the text, all the spans of the
+            task (they attend to each other) and the entity span. Only the tasks with a missing entity are embedded.
+
+    Returns:
+        Tuple[List[Dict], List[Dict]]: The entities along with their embedding, and the error report of the tasks
+            that could not be embedded.
+    """
+    report, parsed = [], []
+    for task in tasks:
+        try:
+            text, spans, entities = get_entities(task)
+        except (KeyError, IndexError, TypeError) as e:
+            report.append({"task_id": task.get("id") if isinstance(task, dict) else None,
+                           "error": f"invalid task: {e!r}"})
+            continue
+        if spans:
+            parsed.append((text, spans, entities, task.get("id")))
+
+    todo = list(range(len(parsed)))
+    if cache is not None:
+        keys = [[cache.key(text, spans, span) for span in spans] for text, spans, _, _ in parsed]
+        rows = cache.lookup([key for task_keys in keys for key in task_keys])
+        ends = np.cumsum([len(task_keys) for task_keys in keys])
+        todo = [i for i, task_keys in enumerate(keys) if (rows[ends[i] - len(task_keys):ends[i]] < 0).any()]
+        logger.info(f"{len(parsed) - len(todo)} task(s) found in the cache, {len(todo)} to embed")
+
+    computed, errors = embedder.embed([parsed[i][0] for i in todo], [parsed[i][1] for i in todo])
+    embeddings = dict(zip(todo, computed))
+    errors = {todo[j]: error for j, error in errors.items()}
+
+    if cache is not None:
+        new_keys, new_embeddings = {}, []
+        for i in todo:
+            if i not in errors:
+                for key, embedding in zip(keys[i], embeddings[i]):
+                    if key not in new_keys:
+                        new_keys[key] = len(new_embeddings)
+                        new_embeddings.append(embedding)
+        new_keys = list(new_keys)
+        missing = np.flatnonzero(cache.lookup(new_keys) < 0) if new_keys else []
+        if len(missing):
+            cache.add([new_keys[j] for j in missing], np.stack([new_embeddings[j] for j in missing]))
+        stored = cache.store.load()
+        for i in range(len(parsed)):
+            if i not in embeddings:
+                embeddings[i] = np.asarray(stored[cache.lookup(keys[i])])
+
+    all_embeddings = []
+    for i, (_, _, entities, task_id) in enumerate(parsed):
+        if i in errors:
+            report.append({"task_id": task_id, "error": errors[i]})
+            continue
+        for entity, embedding in zip(entities, embeddings[i]):
+            all_embeddings.append({"embedding": embedding, **entity})
+    return all_embeddings, report
+
+
+def project(X: np.ndarray, args) -> np.ndarray:
+    """Projects the embeddings in 2D, with the saved projection unless there is none or a refit is requested"""
+    projection = Projection(args["projection_dir"] or pathlib.Path(args["output_file"]).with_suffix(".projection"))
+    if args["refit"] or not projection.is_fitted:
+        projection.fit(X, sample_size=args["fit_sample_size"])
+    return projection.transform(X)
 
 
 def run(args):
     with open(args["input_file"], "r") as reader:
         data = json.load(reader)
 
-    all_embeddings = []
-    for elt in tqdm(data, total=len(data)):
-        try:
-            all_embeddings.extend(get_entities_embeddings(elt))
-        except Exception as e:
-            import ipdb
-            ipdb.set_trace()
+    embedder = LukeEmbedder(args["model_name"], batch_size=args["batch_size"], workers=args["workers"],
+                            random_init=args["tiny_random_model"])
+    # a randomly initialized model is never cached
+    use_cache = not (args["no_cache"] or args["tiny_random_model"])
+    cache = EmbeddingCache(args["cache_dir"], args["model_name"]) if use_cache else None
+    all_embeddings, report = get_entities_embeddings(data, embedder, cache=cache)
+
+    if report:
+        errors_file = args["errors_file"] or pathlib.Path(args["output_file"]).with_suffix(".errors.json")
+        with open(errors_file, "w") as writer:
+            json.dump(report, writer, indent=2)
+        logger.warning(f"{len(report)} task(s) could not be embedded, see {errors_file}")
 
-    X = np.array([entity["embedding"] for entity in all_embeddings])
-    umap = UMAP()
-    X_tfm = umap.fit_transform(X)
+    X = np.array([entity["embedding"] for entity in all_embeddings], dtype=np.float32)
+    if args["embeddings_file"]:
+        np.save(args["embeddings_file"], X)
+    X_tfm = project(X, args)
 
     df = pd.DataFrame.from_records(all_embeddings, exclude=["embedding"])
     df["x"] = X_tfm[:, 0]
     df["y"] = X_tfm[:, 1]
 
-    df.to_csv(args["output_file"], index=False)
+    write_table(df, args["output_file"])
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     args = parse_args()
     run(vars(args))
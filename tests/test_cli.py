@@ -0,0 +1,37 @@
+import os
+
+from bundler.__main__ import share
+from bundler.utils.options import BundleKind
+
+
+class _Dataset(object):
+    """Records the directory a dataset is shared through."""
+
+    def __init__(self):
+        self.directory = None
+
+    def share(self, directory):
+        self.directory = directory
+
+
+def _shared_dir(path, tmp_path, kind=BundleKind.text, options=None, num_procs=2):
+    dataset = _Dataset()
+    share(dataset, path, tmp_path / "shared", num_procs, kind, options or {"columns": None})
+    return dataset.directory
+
+
+def test_share_directory_depends_on_the_options_and_the_table(tmp_path):
+    path = tmp_path / "table.csv"
+    path.write_text("x,y\n0,0\n")
+    directory = _shared_dir(path, tmp_path)
+    assert directory == _shared_dir(path, tmp_path)
+    assert directory != _shared_dir(path, tmp_path, options={"columns": ["x"]})
+    assert directory != _shared_dir(path, tmp_path, kind=BundleKind.image)
+    os.utime(path, ns=(0, 0))
+    assert directory != _shared_dir(path, tmp_path)
+
+
+def test_single_process_is_not_shared(tmp_path):
+    path = tmp_path / "table.csv"
+    path.write_text("x,y\n0,0\n")
+    assert _shared_dir(path, tmp_path, num_procs=1) is None
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bundler.utils.embeddings import EmbeddingCache, EmbeddingStore
+from scripts.embed import embed, source_file, source_record
+
+
+class _Encoder(object):
+    """Deterministic encoder recording the sentences it encodes, failing after `fail_after` calls."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.encoded = []
+
+    def encode(self, sentences, batch_size):
+        if self.fail_after is not None and len(self.encoded) >= self.fail_after:
+            raise KeyboardInterrupt
+        self.encoded.append(list(sentences))
+        return np.array([[len(s), sum(map(ord, s)) % 97, 1.0] for s in sentences], dtype=np.float32)
+
+
+@pytest.fixture
+def table(tmp_path):
+    path = tmp_path / "table.csv"
+    pd.DataFrame({"text": [f"sentence {i}" for i in range(23)] + [None], "label": "a"}).to_csv(path, index=False)
+    return path
+
+
+def _expected():
+    sentences = [f"sentence {i}" for i in range(23)] + [""]
+    return _Encoder().encode(sentences, batch_size=1)
+
+
+def test_embed_reads_and_checkpoints_chunk_by_chunk(table, tmp_path):
+    store, encoder = EmbeddingStore(tmp_path / "embeddings.npy"), _Encoder()
+    embed(str(table), store, encoder, chunk_size=5, batch_size=2)
+    assert [len(sentences) for sentences in encoder.encoded] == [5, 5, 5, 5, 4]
+    np.testing.assert_array_equal(store.load(), _expected())
+
+
+def test_interrupted_embed_resumes_from_its_last_checkpoint(table, tmp_path):
+    path = tmp_path / "embeddings.npy"
+    with pytest.raises(KeyboardInterrupt):
+        embed(str(table), EmbeddingStore(path), _Encoder(fail_after=2), chunk_size=5, batch_size=2)
+    assert len(EmbeddingStore(path)) == 10
+
+    store, encoder = EmbeddingStore(path), _Encoder()
+    embed(str(table), store, encoder, chunk_size=7, batch_size=2)
+    assert encoder.encoded[0][0] == "sentence 10"
+    assert sum(map(len, encoder.encoded)) == 14
+    np.testing.assert_array_equal(store.load(), _expected())
+
+
+def test_embed_only_encodes_sentences_missing_from_the_cache(table, tmp_path):
+    path, cache = tmp_path / "embeddings.npy", EmbeddingCache(tmp_path / "cache", "stub")
+    embed(str(table), EmbeddingStore(path), _Encoder(), chunk_size=10, batch_size=2, cache=cache)
+
+    # a refreshed table with one changed row, embedded into the same store
+    df = pd.read_csv(table)
+    df.loc[12, "text"] = "a changed sentence"
+    df.to_csv(table, index=False)
+    store, encoder = EmbeddingStore(path), _Encoder()
+    embed(str(table), store, encoder, chunk_size=10, batch_size=2, cache=cache)
+    assert encoder.encoded == [["a changed sentence"]]
+    expected = _expected()
+    expected[12] = _Encoder().encode(["a changed sentence"], batch_size=1)[0]
+    np.testing.assert_array_equal(store.load(), expected)
+
+
+def test_embed_starts_over_when_the_table_changed(tmp_path):
+    path, table = tmp_path / "embeddings.npy", tmp_path / "table.csv"
+    pd.DataFrame({"text": ["a", "bb", "ccc"]}).to_csv(table, index=False)
+    embed(str(table), EmbeddingStore(path), _Encoder(), chunk_size=2, batch_size=2)
+
+    pd.DataFrame({"text": ["zzzzz", "bb", "ccc", "dddd"]}).to_csv(table, index=False)
+    store = EmbeddingStore(path)
+    embed(str(table), store, _Encoder(), chunk_size=2, batch_size=2)
+    assert store.load()[:, 0].tolist() == [5, 2, 3, 4]
+
+    # same size
+    pd.DataFrame({"text": ["yyyyy", "bb", "ccc", "dddd"]}).to_csv(table, index=False)
+    store = EmbeddingStore(path)
+    embed(str(table), store, _Encoder(), chunk_size=2, batch_size=2)
+    assert store.load()[0, 1] == _Encoder().encode(["yyyyy"], batch_size=1)[0, 1]
+
+
+def test_embed_starts_over_a_store_without_a_record_of_its_input(table, tmp_path):
+    store = EmbeddingStore(tmp_path / "embeddings.npy")
+    store.append(np.zeros((10, 3), dtype=np.float32))
+    embed(str(table), store, _Encoder(), chunk_size=10, batch_size=2)
+    np.testing.assert_array_equal(store.load(), _expected())
+
+
+def test_embed_rejects_a_store_longer_than_the_table(table, tmp_path):
+    store = EmbeddingStore(tmp_path / "embeddings.npy")
+    store.append(np.zeros((30, 3), dtype=np.float32))
+    source_file(store).write_text(json.dumps(source_record(str(table))))
+    with pytest.raises(ValueError, match="--restart"):
+        embed(str(table), store, _Encoder(), chunk_size=10, batch_size=2)
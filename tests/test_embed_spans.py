@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from scripts.embed_spans import EntityEmbedder, LukeEmbedder, get_entities_embeddings
+
+
+def _task(idx, text, spans):
+    return {
+        "id": idx,
+        "data": {"text": text},
+        "annotations": [{"result": [
+            {"id": f"{idx}-{i}", "value": {"start": start, "end": end, "text": text[start:end], "labels": ["ORG"]}}
+            for i, (start, end) in enumerate(spans)
+        ]}],
+    }
+
+
+def test_tiny_random_model_smoke():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    embedder = LukeEmbedder(batch_size=2, random_init=True)
+    try:
+        embedder.tokenizer
+    except OSError as e:
+        pytest.skip(f"tokenizer unavailable: {e}")
+    tasks = [
+        _task(1, "Acme Corp is based in San Francisco.", [(0, 9), (22, 35)]),
+        _task(2, "Label Studio labels data.", [(0, 12)]),
+        _task(3, "No entities here.", []),
+    ]
+    entities, report = get_entities_embeddings(tasks, embedder)
+    assert report == []
+    assert [entity["sample_id"] for entity in entities] == [1, 1, 2]
+    assert np.stack([entity["embedding"] for entity in entities]).shape == (3, 32)
+
+
+class _LengthEmbedder(EntityEmbedder):
+    """Embeds every entity as its length, failing on texts without spaces."""
+
+    def embed(self, texts, spans):
+        errors = {i: "no space" for i, text in enumerate(texts) if " " not in text}
+        return [None if i in errors else np.array([[end - start] for start, end in text_spans], dtype=np.float32)
+                for i, text_spans in enumerate(spans)], errors
+
+
+def test_incomplete_embedder_fails_when_created():
+    class Incomplete(EntityEmbedder):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_entities_embeddings_report_failed_tasks():
+    tasks = [_task(1, "Acme Corp rocks", [(0, 9)]), _task(2, "Nospace", [(0, 2)])]
+    entities, report = get_entities_embeddings(tasks, _LengthEmbedder())
+    assert [(entity["sample_id"], entity["embedding"].tolist()) for entity in entities] == [(1, [9.0])]
+    assert [item["task_id"] for item in report] == [2]
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bundler.utils.filters import MISSING_LABEL, LabelIndex
+
+
+@pytest.fixture
+def scores():
+    rng = np.random.default_rng(0)
+    values = pd.Series(rng.uniform(0, 1, size=1000))
+    values[rng.random(1000) < 0.1] = np.nan
+    return values
+
+
+@pytest.fixture
+def labels():
+    rng = np.random.default_rng(0)
+    values = pd.Series(rng.choice(["a", "b", "c"], size=1000)).astype(object)
+    values[rng.random(1000) < 0.1] = np.nan
+    return values.astype("category")
+
+
+@pytest.mark.parametrize("low, high", [(0.2, 0.4), (0.0, 1.0), (0.5, 0.5), (2.0, 3.0)])
+def test_float_ranges_match_a_scan(scores, low, high):
+    index = LabelIndex(scores)
+    expected = np.flatnonzero((scores >= low) & (scores <= high))
+    assert np.array_equal(index.rows([low, high]), expected)
+    indices = np.arange(0, 1000, 7)[::-1]
+    assert np.array_equal(index.filter(indices, [low, high]), indices[np.isin(indices, expected)])
+
+
+def test_float_range_bounds_are_inclusive():
+    index = LabelIndex(pd.Series([0.1, 0.2, 0.3, np.nan]))
+    assert index.rows([0.2, 0.3]).tolist() == [1, 2]
+    assert index.value_range == (0.1, 0.3) and index.n_missing == 1
+
+
+def test_labels_match_a_scan(labels):
+    index = LabelIndex(labels)
+    expected = np.flatnonzero(labels.isin(["a", "c"]).to_numpy())
+    assert np.array_equal(index.rows(["a", "c"]), expected)
+    missing = np.flatnonzero(labels.isna().to_numpy())
+    assert np.array_equal(index.rows([MISSING_LABEL]), missing)
+    indices = np.arange(0, 1000, 3)[::-1]
+    assert np.array_equal(index.filter(indices, ["b"]), indices[labels.iloc[indices].eq("b").to_numpy()])
+
+
+def test_empty_filter_keeps_every_row(labels):
+    indices = np.array([5, 1, 3])
+    assert LabelIndex(labels).filter(indices, []) is indices
+    assert LabelIndex(labels).rows(["unknown"]).size == 0
+
+
+def test_saved_index_answers_the_same(tmp_path, scores, labels):
+    for color in (scores, labels):
+        index = LabelIndex(color)
+        index.save(tmp_path / str(color.dtype))
+        loaded = LabelIndex.load(tmp_path / str(color.dtype))
+        values = [0.2, 0.6] if index.is_float else ["a", MISSING_LABEL]
+        assert np.array_equal(index.rows(values), loaded.rows(values))
+        assert loaded.n_missing == index.n_missing
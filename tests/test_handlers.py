@@ -0,0 +1,41 @@
+import pathlib
+import tempfile
+
+from PIL import Image
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bundler.utils.cache import ThumbnailCache
+from bundler.utils.handlers import metrics_pattern, thumbnail_pattern
+
+
+class ThumbnailHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.directory = pathlib.Path(tempfile.mkdtemp())
+        self.paths = []
+        for i in range(3):
+            path = self.directory / f"{i}.png"
+            Image.new("RGB", (64, 64), (i * 80, 0, 0)).save(path)
+            self.paths.append(str(path))
+        # every thumbnail outgrows the cache, so pruning empties it
+        self.cache = ThumbnailCache(self.directory / "cache", max_size=0)
+        return Application([thumbnail_pattern(self.paths, cache=self.cache), metrics_pattern()])
+
+    def test_thumbnail_and_revalidation(self):
+        response = self.fetch("/thumbnails/0")
+        assert response.code == 200 and response.headers["Content-Type"] == "image/jpeg"
+        cached = self.fetch("/thumbnails/0", headers={"If-None-Match": response.headers["Etag"]})
+        assert cached.code == 304
+        assert self.fetch("/thumbnails/9").code == 404
+
+    def test_serving_prunes_the_cache(self):
+        assert self.fetch("/thumbnails/1").code == 200
+        with self.cache._prune_lock:  # waits for the background prune
+            pass
+        assert self.cache._last_prune is not None
+        assert not list((self.directory / "cache").glob("*/*"))
+
+    def test_metrics(self):
+        response = self.fetch("/metrics")
+        assert response.code == 200 and b"bundler_callback_seconds" in response.body
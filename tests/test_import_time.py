@@ -0,0 +1,29 @@
+import pathlib
+import subprocess
+import sys
+
+from benchmarks.import_time import MODULE, imported_heavy_modules, run
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def test_command_line_imports_no_heavy_dependency(monkeypatch):
+    # the benchmark imports the package from the working directory
+    monkeypatch.chdir(ROOT)
+    assert imported_heavy_modules(MODULE) == []
+
+
+def test_command_line_imports_within_budget(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    result = run(budget_ms=150, runs=3)
+    assert result["ok"], result
+
+
+def test_version_runs_without_label_studio_credentials():
+    # no LS_TOKEN nor LS_ENDPOINT in the environment
+    env = {"PYTHONPATH": str(ROOT)}
+    result = subprocess.run(
+        [sys.executable, "-m", "bundler", "version"], capture_output=True, text=True, env=env, cwd=ROOT
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip()
@@ -0,0 +1,217 @@
+import json as _json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+from bundler.utils.ls_client import LabelStudioClient, id_filter, id_ranges
+
+
+def test_id_ranges_compress_consecutive_ids():
+    assert id_ranges([]) == []
+    assert id_ranges([5, 3, 4, 4, 10, 1]) == [(1, 1), (3, 5), (10, 10)]
+    assert id_ranges(np.arange(100, 20_100)) == [(100, 20_099)]
+
+
+def test_id_filter_items():
+    assert id_filter(7, 7) == {"filter": "filter:tasks:id", "operator": "equal", "type": "Number", "value": 7}
+    assert id_filter(3, 5)["operator"] == "in" and id_filter(3, 5)["value"] == {"min": 3, "max": 5}
+
+
+def test_view_filters_match_exactly_the_tasks():
+    ids = [1, 2, 3, 8, 12, 13]
+    items = LabelStudioClient._view_query(1, "tab", id_ranges(ids))["data"]["filters"]["items"]
+    matched = set()
+    for item in items:
+        value = item["value"]
+        matched.update(range(value["min"], value["max"] + 1) if isinstance(value, dict) else [value])
+    assert sorted(matched) == ids and len(items) == 3
+
+
+class _Server(object):
+    """A local HTTP server answering every request with the next of `statuses`, after `delay` seconds."""
+
+    def __init__(self, statuses, delay=0.0):
+        self.statuses = list(statuses)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                server.requests.append((self.command, self.path))
+                time.sleep(delay)
+                status = server.statuses.pop(0) if len(server.statuses) > 1 else server.statuses[0]
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            do_GET = do_POST = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(statuses, delay=0.0):
+        servers.append(_Server(statuses, delay))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def _client(url, **kwargs):
+    return LabelStudioClient(url=url, token="token", backoff_factor=0, **kwargs)
+
+
+def test_get_is_retried_on_server_errors(serve):
+    server = serve([500, 500, 200])
+    assert _client(server.url)._request("GET", "/", "/").status_code == 200
+    assert len(server.requests) == 3
+
+
+def test_post_is_not_retried_on_server_errors(serve):
+    server = serve([500, 200])
+    assert _client(server.url)._request("POST", "/", "/", json={}).status_code == 500
+    assert len(server.requests) == 1
+
+
+def test_post_is_retried_when_refused(serve):
+    server = serve([429, 503, 201])
+    assert _client(server.url)._request("POST", "/", "/", json={}).status_code == 201
+    assert len(server.requests) == 3
+
+
+def test_post_is_not_retried_on_read_timeouts(serve):
+    server = serve([201], delay=0.5)
+    with pytest.raises(requests.RequestException):
+        _client(server.url, timeout=(1, 0.1))._request("POST", "/", "/", json={})
+    time.sleep(0.6)
+    assert len(server.requests) == 1
+
+
+def test_create_tab_reports_created_and_failed_views(serve):
+    server = serve([201, 500, 201])
+    tasks = pd.DataFrame({"id": [1, 2, 3, 10, 20, 30], "project": [1, 1, 1, 2, 2, 2]})
+    progress = []
+    result = _client(server.url, max_workers=1, max_filters=2).create_tab(
+        tasks, "tab", progress=lambda view, done, total: progress.append((done, total))
+    )
+    # project 1 is a single range, project 2 needs 3 ranges, split into views of 2 ranges
+    views = [(view.project, view.title) for view in result.created + result.failed]
+    assert views == [(1, "tab"), (2, "tab - 1"), (2, "tab - 0")]
+    assert len(result.created) == 2 and len(result.failed) == 1 and not result.ok
+    assert result.failed[0].error.startswith("HTTP 500")
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    assert all(method == "POST" for method, _ in server.requests) and len(server.requests) == 3
+
+
+class _Response(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {}
+        self.text = _json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeLabelStudio(object):
+    """An in-memory Label Studio project, standing in for the `requests.Session` of a client."""
+
+    def __init__(self, task_ids):
+        self.tasks = {idx: {"id": idx, "predictions": [], "annotations": []} for idx in task_ids}
+        self.posts = []
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        path = url.split("://", 1)[1].split("/", 1)[1]
+        if method == "GET" and path == "api/projects/1":
+            config = {"label": {"type": "Choices", "to_name": ["text"]}}
+            return _Response(200, {"parsed_label_config": config})
+        if method == "GET" and path == "api/tasks":
+            items = _json.loads(params["query"])["filters"]["items"]
+            ids = set()
+            for item in items:
+                value = item["value"]
+                ids.update(range(value["min"], value["max"] + 1) if isinstance(value, dict) else [value])
+            return _Response(200, {"tasks": [task for idx, task in self.tasks.items() if idx in ids]})
+        self.posts.append((path, params, json))
+        if path == "api/projects/1/import/predictions":
+            for prediction in json:
+                self.tasks[prediction["task"]]["predictions"].append(prediction)
+            return _Response(201)
+        if path == "api/dm/actions":
+            for idx in json["selectedItems"]["included"]:
+                for prediction in self.tasks[idx]["predictions"]:
+                    if prediction["model_version"] == json["model_version"]:
+                        self.tasks[idx]["annotations"].append({"result": prediction["result"]})
+            return _Response(200)
+        return _Response(404)
+
+    def n_labels(self, kind):
+        return sum(len(task[kind]) for task in self.tasks.values())
+
+
+def _tasks(ids):
+    return pd.DataFrame({"id": ids, "project": 1})
+
+
+def test_label_tasks_skips_tasks_labeled_by_the_client():
+    server = FakeLabelStudio(range(1, 11))
+    client = LabelStudioClient(url="http://ls", token="token", session=server)
+    assert client.label_tasks(_tasks(range(1, 6)), "positive").n_labeled == 5
+    result = client.label_tasks(_tasks(range(1, 11)), "positive")
+    assert result.n_labeled == 5 and result.skipped == 5
+    assert server.n_labels("predictions") == 10
+
+
+def test_label_tasks_skips_tasks_labeled_before_a_restart():
+    server = FakeLabelStudio(range(1, 11))
+    LabelStudioClient(url="http://ls", token="token", session=server).label_tasks(_tasks(range(1, 11)), "positive")
+    result = LabelStudioClient(url="http://ls", token="token", session=server).label_tasks(
+        _tasks(range(1, 11)), "positive"
+    )
+    assert result.n_labeled == 0 and result.skipped == 10
+    assert len(server.posts) == 1 and server.n_labels("predictions") == 10
+
+
+def test_annotating_predicted_tasks_only_converts_them():
+    server = FakeLabelStudio(range(1, 11))
+    client = LabelStudioClient(url="http://ls", token="token", session=server)
+    client.label_tasks(_tasks(range(1, 6)), "positive")
+    result = client.label_tasks(_tasks(range(1, 11)), "positive", as_annotations=True)
+    assert result.ok and result.n_labeled == 10
+    assert server.n_labels("predictions") == 10 and server.n_labels("annotations") == 10
+    result = client.label_tasks(_tasks(range(1, 11)), "positive", as_annotations=True)
+    assert result.n_labeled == 0 and server.n_labels("annotations") == 10
+
+
+def test_failed_batches_are_released():
+    server = FakeLabelStudio(range(1, 4))
+    client = LabelStudioClient(url="http://ls", token="token", session=server)
+    request = server.request
+    server.request = lambda method, url, **kwargs: \
+        _Response(500) if method == "POST" else request(method, url, **kwargs)
+    assert not client.label_tasks(_tasks([1, 2, 3]), "positive").ok
+    server.request = request
+    assert client.label_tasks(_tasks([1, 2, 3]), "positive").n_labeled == 3
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+from PIL import Image
+
+from bundler.utils.metrics import REGISTRY, THUMBNAIL_ENCODE_SECONDS, Counter, Histogram, Metric, Registry
+from bundler.utils.utils import encode_images
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests.", ["status"]))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+    requests.inc(status="200")
+    latency.observe(0.5)
+    text = registry.render()
+    assert 'requests_total{status="200"} 1.0' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text and 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert "latency_seconds_count 1" in text
+
+
+def test_process_info_identifies_the_process():
+    assert f'bundler_process_info{{pid="{os.getpid()}",task="0"}} 1.0' in REGISTRY.render()
+
+
+def test_encodings_in_worker_processes_are_observed(tmp_path):
+    paths = []
+    for i in range(8):
+        paths.append(str(tmp_path / f"{i}.png"))
+        Image.new("RGB", (16, 16)).save(paths[-1])
+    count = THUMBNAIL_ENCODE_SECONDS.count()
+    encode_images(paths, workers=2, chunksize=2)
+    assert THUMBNAIL_ENCODE_SECONDS.count() == count + len(paths)
+
+
+def test_metric_without_samples_fails_when_created():
+    class Gauge(Metric):
+        kind = "gauge"
+
+    with pytest.raises(TypeError):
+        Gauge("gauge", "A gauge without samples.")
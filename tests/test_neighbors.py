@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from bundler.utils.neighbors import NeighborIndex, _top_k
+
+
+def _recall(index: NeighborIndex, exact: NeighborIndex, queries: np.ndarray, k: int) -> float:
+    found, expected = index.search(queries, k), exact.search(queries, k)
+    return np.mean([len(np.intersect1d(f, e)) / k for f, e in zip(found, expected)])
+
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean"])
+def test_ivf_recall_against_brute_force(metric):
+    rng = np.random.default_rng(0)
+    # off the origin, so that ranking the clusters by dot product rather than by distance would miss most neighbors
+    vectors = (rng.normal(size=(20_000, 16)) + 3).astype(np.float32)
+    index = NeighborIndex(vectors, metric=metric, n_lists=64, n_probe=8, brute_force_below=0)
+    index.build()
+    exact = NeighborIndex(vectors, metric=metric)
+    assert exact.is_exact and not index.is_exact
+    queries = vectors[rng.choice(len(vectors), size=100, replace=False)]
+    assert _recall(index, exact, queries, k=10) > 0.7
+
+
+def test_expand_keeps_the_selection():
+    vectors = np.random.default_rng(0).normal(size=(500, 8)).astype(np.float32)
+    index = NeighborIndex(vectors)
+    expanded = index.expand(np.array([3, 7]), k=5)
+    assert {3, 7} <= set(expanded.tolist()) and len(expanded) > 2
+
+
+@pytest.mark.parametrize("n_candidates", [3, 8, 500])
+def test_top_k_merges_candidates_into_the_best(n_candidates):
+    rng = np.random.default_rng(0)
+    k, scores = 8, rng.normal(size=(20, n_candidates))
+    best_scores, best_rows = rng.normal(size=(20, k)), rng.integers(1000, 2000, size=(20, k))
+    rows = np.arange(n_candidates)
+    top_scores, top_rows = _top_k(scores, rows, best_scores, best_rows)
+
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_rows = np.concatenate([best_rows, np.broadcast_to(rows, scores.shape)], axis=1)
+    expected = np.argsort(-all_scores, axis=1)[:, :k]
+    order = np.argsort(-top_scores, axis=1)
+    np.testing.assert_array_equal(np.take_along_axis(top_rows, order, axis=1),
+                                  np.take_along_axis(all_rows, expected, axis=1))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource, TableColumn
+from bokeh.protocol import Protocol
+
+from bundler.utils.dataset import Dataset
+from bundler.utils.pagination import Pager, update_source
+from bundler.utils.session import Session
+from bundler.utils.utils import get_color_mapping
+
+
+def _document_events(model):
+    doc = Document()
+    doc.add_root(model)
+    events = []
+    doc.on_change(events.append)
+    return events
+
+
+def test_pager_pages():
+    pager = Pager(page_size=3)
+    pager.reset(np.arange(7))
+    assert pager.n_pages == 3
+    pager.next()
+    pager.next()
+    pager.next()
+    assert pager.current().tolist() == [6]
+    pager.set_page_size(2)
+    assert pager.current().tolist() == [6]
+
+
+def test_update_source_with_missing_values_serializes():
+    source = ColumnDataSource({"text": np.array(["a", "b"], dtype=object), "color": np.array([0.1, 0.2])})
+    events = _document_events(source)
+    update_source(source, {"text": np.array(["c", np.nan], dtype=object), "color": np.array([np.nan, 0.3])})
+    assert len(events) == 1
+    Protocol().create("PATCH-DOC", events)
+
+
+def test_update_source_skips_unchanged_data():
+    data = {"text": np.array(["a", np.nan], dtype=object), "index": np.array([0, 1])}
+    source = ColumnDataSource({k: v.copy() for k, v in data.items()})
+    events = _document_events(source)
+    update_source(source, data)
+    assert events == []
+
+
+def test_session_page_with_missing_values_serializes():
+    df = pd.DataFrame({
+        "x": np.arange(50, dtype=float),
+        "y": np.arange(50, dtype=float),
+        "text": [None if i % 7 == 0 else f"row {i}" for i in range(50)],
+        "color": [np.nan if i % 5 == 0 else i / 50 for i in range(50)],
+    })
+    mapper, df = get_color_mapping(df)
+    dataset = Dataset(df, mapper)
+    session = Session(dataset, [TableColumn(field=c, title=c) for c in dataset.table_columns], page_size=20)
+    events = _document_events(session.layout)
+    session.next_page()
+    assert events
+    Protocol().create("PATCH-DOC", events)
@@ -0,0 +1,48 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from bokeh.document import Document
+from bokeh.models import TableColumn
+
+from bundler.utils.dataset import Dataset
+from bundler.utils.session import Session
+from bundler.utils.utils import get_color_mapping
+
+
+class _Result(object):
+    summary = "done"
+
+
+def _session():
+    df = pd.DataFrame({"x": np.arange(10, dtype=float), "y": np.arange(10, dtype=float), "text": list("abcdefghij")})
+    mapper, df = get_color_mapping(df)
+    dataset = Dataset(df, mapper)
+    session = Session(dataset, [TableColumn(field=c, title=c) for c in dataset.table_columns])
+    Document().add_root(session.layout)
+    return session
+
+
+def test_session_runs_a_single_upload_at_a_time():
+    session, release, calls = _session(), threading.Event(), []
+
+    def job(progress):
+        calls.append(1)
+        release.wait(5)
+        return _Result()
+
+    session.submit("Uploading", job)
+    assert all(btn.disabled for btn in session.upload_buttons)
+    # a click sent before the browser received the disabled buttons
+    session.submit("Uploading again", job)
+    release.set()
+    session.upload.result(5)
+    assert len(calls) == 1
+
+    # the done callback runs on the next tick of the document
+    session.on_upload_done("Uploading", session.upload)
+    assert not any(btn.disabled for btn in session.upload_buttons)
+    assert session.upload_status.text == "Uploading: done"
+    session.submit("Uploading again", job)
+    session.upload.result(5)
+    assert len(calls) == 2
@@ -0,0 +1,41 @@
+import json
+
+import pandas as pd
+import pytest
+
+from bundler.utils.tables import iter_table, read_table
+
+
+@pytest.fixture
+def jsonl(tmp_path):
+    # the later records miss the 'label' key of the first one, and add a 'score' key
+    records = [{"text": "a", "label": "x"}, {"text": "b", "label": "y"}]
+    records += [{"text": f"c{i}", "score": i} for i in range(5)]
+    path = tmp_path / "table.jsonl"
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return path
+
+
+def test_iter_table_reads_chunks_missing_wanted_columns(jsonl):
+    chunks = list(iter_table(jsonl, columns=["text", "label"], chunksize=2))
+    assert [list(chunk.columns) for chunk in chunks] == [["text", "label"]] * 4
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["text"].tolist() == ["a", "b", "c0", "c1", "c2", "c3", "c4"]
+    assert df["label"].tolist()[:2] == ["x", "y"] and df["label"].iloc[2:].isna().all()
+
+
+def test_read_table_reads_chunks_missing_wanted_columns(jsonl, monkeypatch):
+    monkeypatch.setattr("bundler.utils.tables.JSONL_CHUNKSIZE", 2)
+    df = read_table(jsonl, columns=["label", "text", "absent"])
+    assert list(df.columns) == ["label", "text"]
+    assert len(df) == 7 and df["label"].notna().sum() == 2
+
+
+def test_jsonl_keeps_columns_first_found_after_the_first_record(jsonl, monkeypatch):
+    monkeypatch.setattr("bundler.utils.tables.JSONL_CHUNKSIZE", 2)
+    df = read_table(jsonl, columns=["text", "score"])
+    assert list(df.columns) == ["text", "score"]
+    assert df["score"].iloc[:2].isna().all() and df["score"].iloc[2:].tolist() == [0, 1, 2, 3, 4]
+
+    chunks = list(iter_table(jsonl, columns=["text", "score"], chunksize=2))
+    assert pd.concat(chunks, ignore_index=True)["score"].iloc[2:].tolist() == [0, 1, 2, 3, 4]
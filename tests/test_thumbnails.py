@@ -0,0 +1,47 @@
+import pickle
+
+from PIL import Image
+
+from bundler.utils.cache import ThumbnailCache
+from bundler.utils.utils import LazyThumbnails, PLACEHOLDER_SRC
+
+
+def _images(directory, n):
+    paths = []
+    for i in range(n):
+        path = directory / f"{i}.jpg"
+        Image.new("RGB", (32, 32), (i * 10 % 256, 0, 0)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_lazy_thumbnails_memo_is_bounded(tmp_path):
+    paths = _images(tmp_path, 6)
+    thumbnails = LazyThumbnails(max_entries=4)
+    first = thumbnails.take(paths[:3])
+    thumbnails.take(paths[3:])
+    assert len(thumbnails._encoded) == 4
+    assert thumbnails.take(paths[:3]) == first
+    assert all(PLACEHOLDER_SRC not in tag for tag in first)
+
+
+def test_lazy_thumbnails_fill_the_cache(tmp_path):
+    paths = _images(tmp_path, 3)
+    cache = ThumbnailCache(tmp_path / "cache")
+    LazyThumbnails(cache=cache).take(paths)
+    assert len(list((tmp_path / "cache").glob("*/*"))) == 3
+
+
+def test_prune_later_is_throttled(tmp_path):
+    cache = ThumbnailCache(tmp_path / "cache", max_size=0)
+    cache.put("ab" * 20, b"thumbnail")
+    assert cache.prune_later(interval=3600)
+    cache._prune_lock.acquire()  # waits for the background prune
+    cache._prune_lock.release()
+    assert not list((tmp_path / "cache").glob("*/*"))
+    assert not cache.prune_later(interval=3600)
+
+
+def test_cache_pickles_without_its_lock(tmp_path):
+    cache = pickle.loads(pickle.dumps(ThumbnailCache(tmp_path / "cache", max_size=10)))
+    assert cache.max_size == 10 and cache.prune_later()